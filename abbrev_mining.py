@@ -0,0 +1,272 @@
+import argparse
+import difflib
+import functools
+import gzip
+import hashlib
+import time
+import numpy as np
+import json_codec
+from fleet_analytics import run_lengths
+from local_expander import MIN_CONFIDENCE, NUMBER_RE, is_agent_output, tokenize
+from parallel_scan import parallel_scan, table_by_name
+
+#Mines the stored original_note -> cleaned_note pairs for the dictionary
+#local_expander.py serves notes from. Both sides are tokenized the way the
+#expander does, aligned token by token (difflib opcodes: kept, replaced by
+#up to MAX_EXPANSION_TOKENS words, or dropped; runs of replaced tokens are
+#split by initial letters) and every (token, rendering)
+#pair is interned to int ids; the counting, best rendering per token and
+#coverage are NumPy passes over those ids.
+#Confidence is the Wilson lower bound of "the agent renders this token this
+#way", so rare tokens need many consistent examples before they qualify.
+#The coverage section is the share of notes the dictionary could have served
+#whole, and the tokens that most often kept it from doing so.
+#
+#Usage:
+#  python abbrev_mining.py --table medical-notes --segments 16 --processes --out expansions.json
+#  python abbrev_mining.py --export user1.ndjson.gz user2.ndjson.gz --out expansions.json
+
+MAX_EXPANSION_TOKENS = 4
+MIN_SUPPORT = 20
+WILSON_Z = 1.96
+EXPORT_CHUNK = 5000
+BLOCKING_TOKENS = 20
+PROJECTION = ['original_note', 'cleaned_note', 'agent_version', 'edited_at']
+
+
+def is_training_pair(item):
+    #agent output only - hand edits change content, local and degraded expansions
+    #would teach the dictionary itself, patched near duplicates are not the agent's reading
+    return bool(item.get('original_note') and item.get('cleaned_note') and not item.get('edited_at')
+                and is_agent_output(item.get('agent_version')))
+
+
+def _split_by_initials(originals, cleaned):
+    #group sizes splitting cleaned into one expansion per original token, each
+    #starting with that token's first letter ("c/o sob" -> "complains of" "shortness
+    #of breath"); None unless exactly one split fits
+    found = []
+
+    def search(i, j, sizes):
+        if len(found) > 1:
+            return
+        if i == len(originals):
+            if j == len(cleaned):
+                found.append(sizes)
+            return
+        for size in range(1, min(MAX_EXPANSION_TOKENS, len(cleaned) - j) + 1):
+            if cleaned[j][0] == originals[i][0]:
+                search(i + 1, j + size, sizes + [size])
+
+    search(0, 0, [])
+    return found[0] if len(found) == 1 else None
+
+
+def align(original_tokens, cleaned_tokens):
+    #[(original token, rendering)] wherever the alignment pins a rendering down;
+    #words the agent inserted and rewrites that cant be split are left out
+    matcher = difflib.SequenceMatcher(None, original_tokens, cleaned_tokens, autojunk=False)
+    pairs = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            pairs.extend((token, token) for token in original_tokens[i1:i2])
+        elif tag == 'delete':
+            pairs.extend((token, '') for token in original_tokens[i1:i2])
+        elif tag == 'replace' and i2 - i1 == 1 and j2 - j1 <= MAX_EXPANSION_TOKENS:
+            pairs.append((original_tokens[i1], ' '.join(cleaned_tokens[j1:j2])))
+        elif tag == 'replace':
+            sizes = _split_by_initials(original_tokens[i1:i2], cleaned_tokens[j1:j2])
+            for token, size in zip(original_tokens[i1:i2], sizes or ()):
+                pairs.append((token, ' '.join(cleaned_tokens[j1:j1 + size])))
+                j1 += size
+    return pairs
+
+
+class PairCounter:
+    #accumulates token occurrences and aligned pairs as int32 id chunks
+
+    def __init__(self):
+        self.tokens = {}
+        self.renderings = {}
+        self.chunks = {'token': [], 'note_tokens': [], 'pair_token': [], 'pair_rendering': []}
+
+    def add_items(self, items):
+        tokens, renderings = self.tokens, self.renderings
+        occurrences, note_tokens, pair_tokens, pair_renderings = [], [], [], []
+        for item in items:
+            if not is_training_pair(item):
+                continue
+            original = tokenize(item['original_note'])
+            #numbers pass through the expander untouched, they are not dictionary entries
+            words = [token for token in original if not NUMBER_RE.fullmatch(token)]
+            occurrences.extend(tokens.setdefault(token, len(tokens)) for token in words)
+            note_tokens.append(len(words))
+            for token, rendering in align(original, tokenize(item['cleaned_note'])):
+                if not NUMBER_RE.fullmatch(token):
+                    pair_tokens.append(tokens[token])
+                    pair_renderings.append(renderings.setdefault(rendering, len(renderings)))
+        if note_tokens:
+            self.chunks['token'].append(np.array(occurrences, dtype=np.int32))
+            self.chunks['note_tokens'].append(np.array(note_tokens, dtype=np.int32))
+            self.chunks['pair_token'].append(np.array(pair_tokens, dtype=np.int32))
+            self.chunks['pair_rendering'].append(np.array(pair_renderings, dtype=np.int32))
+        return self
+
+    def merge(self, other):
+        #other's token and rendering ids are remapped onto ours
+        token_remap = np.empty(len(other.tokens), dtype=np.int32)
+        for token, code in other.tokens.items():
+            token_remap[code] = self.tokens.setdefault(token, len(self.tokens))
+        rendering_remap = np.empty(len(other.renderings), dtype=np.int32)
+        for rendering, code in other.renderings.items():
+            rendering_remap[code] = self.renderings.setdefault(rendering, len(self.renderings))
+        remaps = {'token': token_remap, 'pair_token': token_remap, 'pair_rendering': rendering_remap}
+        for name, chunks in other.chunks.items():
+            self.chunks[name].extend(remaps[name][chunk] if name in remaps else chunk for chunk in chunks)
+        return self
+
+    def arrays(self):
+        return {name: np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int32)
+                for name, chunks in self.chunks.items()}
+
+
+def _add_page(counter, items):
+    return counter.add_items(items)
+
+
+def _merge_counters(a, b):
+    return a.merge(b)
+
+
+def load_from_table(table_name, segments=8, processes=False, progress=None):
+    started = time.time()
+    scan = parallel_scan(functools.partial(table_by_name, table_name), segments,
+                         projection=PROJECTION, reducer=_add_page, initial=PairCounter(),
+                         combine=_merge_counters, processes=processes)
+    if progress:
+        progress(f"Aligned {scan['count']} notes from {table_name} in {time.time() - started:.1f}s\n")
+    return scan['result']
+
+
+def load_from_exports(paths):
+    #gzip NDJSON written by export_notes.py
+    counter = PairCounter()
+    for path in paths:
+        with gzip.open(path, 'rb') as f:
+            batch = []
+            for line in f:
+                batch.append(json_codec.loads(line))
+                if len(batch) == EXPORT_CHUNK:
+                    counter.add_items(batch)
+                    batch = []
+            counter.add_items(batch)
+    return counter
+
+
+def wilson_lower_bound(successes, trials, z=WILSON_Z):
+    successes = np.asarray(successes, dtype=np.float64)
+    trials = np.maximum(np.asarray(trials, dtype=np.float64), 1)
+    share = successes / trials
+    centre = share + z * z / (2 * trials)
+    margin = z * np.sqrt(share * (1 - share) / trials + z * z / (4 * trials * trials))
+    return (centre - margin) / (1 + z * z / trials)
+
+
+def build_dictionary(counter, min_support=MIN_SUPPORT, threshold=MIN_CONFIDENCE):
+    arrays = counter.arrays()
+    tokens = np.array(list(counter.tokens), dtype=object)
+    renderings = np.array(list(counter.renderings), dtype=object)
+    occurrences = np.bincount(arrays['token'], minlength=len(tokens))
+
+    #count each distinct (token, rendering) once, then keep the most frequent rendering per token
+    keys, counts = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if len(arrays['pair_token']):
+        keys, counts = run_lengths(arrays['pair_token'].astype(np.int64) * len(renderings) + arrays['pair_rendering'])
+    pair_token, pair_rendering = keys // max(len(renderings), 1), keys % max(len(renderings), 1)
+    order = np.lexsort((-counts, pair_token))
+    pair_token, pair_rendering, counts = pair_token[order], pair_rendering[order], counts[order]
+    best = np.concatenate(([True], pair_token[1:] != pair_token[:-1]))[:len(pair_token)]
+    token, rendering, support = pair_token[best], pair_rendering[best], counts[best]
+    confidence = wilson_lower_bound(support, occurrences[token])
+
+    keep = support >= min_support
+    token, rendering, support, confidence = token[keep], rendering[keep], support[keep], confidence[keep]
+    ranked = np.lexsort((-support, -confidence))
+    entries = [{
+        'token': tokens[token[i]],
+        'rendering': renderings[rendering[i]],
+        'confidence': round(float(confidence[i]), 4),
+        'support': int(support[i]),
+        'occurrences': int(occurrences[token[i]]),
+        'expands': bool(renderings[rendering[i]] != tokens[token[i]])
+    } for i in ranked]
+
+    version = hashlib.blake2b(json_codec.dumps(entries).encode('utf-8'), digest_size=6).hexdigest()
+    return {
+        'version': version,
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()),
+        'notes': int(len(arrays['note_tokens'])),
+        'min_support': min_support,
+        'coverage': coverage(arrays, len(tokens), token[confidence >= threshold], tokens, threshold),
+        'entries': entries
+    }
+
+
+def coverage(arrays, token_count, usable_tokens, tokens, threshold):
+    #share of the mined notes whose every token has a usable entry
+    usable = np.zeros(token_count, dtype=bool)
+    usable[usable_tokens] = True
+    note_tokens = arrays['note_tokens']
+    note_index = np.repeat(np.arange(len(note_tokens)), note_tokens)
+    missing = ~usable[arrays['token']]
+    blocked = np.bincount(note_index[missing], minlength=len(note_tokens))
+    servable = int(np.count_nonzero((blocked == 0) & (note_tokens > 0)))
+    blockers = np.bincount(arrays['token'][missing], minlength=token_count)
+    top = np.argsort(-blockers, kind='stable')[:BLOCKING_TOKENS]
+    return {
+        'threshold': threshold,
+        'servable_notes': servable,
+        'servable_share': round(servable / max(len(note_tokens), 1), 4),
+        'blocking_tokens': [[tokens[i], int(blockers[i])] for i in top if blockers[i]]
+    }
+
+
+def format_summary(dictionary, top=25):
+    coverage = dictionary['coverage']
+    lines = [f"Mined {dictionary['notes']} notes: {len(dictionary['entries'])} entries (version {dictionary['version']})",
+             f"Servable locally at confidence >= {coverage['threshold']}: {coverage['servable_notes']} notes "
+             f"({coverage['servable_share'] * 100:.1f}%)",
+             "Top expansions:"]
+    expansions = [entry for entry in dictionary['entries'] if entry['expands']][:top]
+    lines.extend(f"  {entry['token']!r:>12} -> {entry['rendering']!r}  confidence {entry['confidence']:.3f} "
+                 f"support {entry['support']}/{entry['occurrences']}" for entry in expansions)
+    lines.append("Most frequent blockers: " + ', '.join(f"{token} ({count})" for token, count in coverage['blocking_tokens']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mine an abbreviation expansion dictionary from stored notes")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--table', help="scan this notes table")
+    source.add_argument('--export', nargs='+', help="export_notes.py output files")
+    parser.add_argument('--segments', type=int, default=8)
+    parser.add_argument('--processes', action='store_true', help="align in worker processes (alignment is CPU bound)")
+    parser.add_argument('--min-support', type=int, default=MIN_SUPPORT, help="aligned examples an entry needs")
+    parser.add_argument('--threshold', type=float, default=MIN_CONFIDENCE, help="confidence used for the coverage estimate")
+    parser.add_argument('--out', required=True, help="dictionary file for LOCAL_EXPANSION_DICT")
+    args = parser.parse_args()
+
+    progress = lambda line: print(line, end='', flush=True)
+    if args.table:
+        counter = load_from_table(args.table, args.segments, args.processes, progress)
+    else:
+        counter = load_from_exports(args.export)
+
+    dictionary = build_dictionary(counter, args.min_support, args.threshold)
+    with open(args.out, 'w') as f:
+        f.write(json_codec.dumps(dictionary))
+    print(format_summary(dictionary))
+
+
+if __name__ == "__main__":
+    main()
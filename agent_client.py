@@ -1,13 +1,39 @@
 import logging 
+import re
 import uuid
-import json
+import json_codec
 import boto3
 import os
+from single_flight import SingleFlight, DynamoFlightStore, flight_key, run_shared
+from deadline import call_with_deadline
+from agent_scheduler import AgentScheduler
+from hedging import Hedger
 
 logger = logging.getLogger(__name__)
 
 
-bedrock_agent = boto3.client("bedrock-agent-runtime")
+#LOCAL_AGENT_LATENCY_MS swaps Bedrock for the local_agent.py simulator (local runs, load tests)
+if os.environ.get("LOCAL_AGENT_LATENCY_MS"):
+    from local_agent import LocalAgent
+    bedrock_agent = LocalAgent(latency=float(os.environ["LOCAL_AGENT_LATENCY_MS"]) / 1000)
+else:
+    bedrock_agent = boto3.client("bedrock-agent-runtime")
+
+#Identical notes in flight at the same time in the same lane share one agent
+#call - within this container always, across containers through
+#SINGLE_FLIGHT_TABLE when it is set. Lanes dont share, so an interactive note
+#never waits behind a bulk call (or goes without its hedge)
+SINGLE_FLIGHT_TABLE = os.environ.get("SINGLE_FLIGHT_TABLE")
+_flights = SingleFlight()
+_flight_store = DynamoFlightStore(SINGLE_FLIGHT_TABLE) if SINGLE_FLIGHT_TABLE else None
+
+#Agent calls from this process go through the interactive or bulk lane (agent_scheduler.py)
+scheduler = AgentScheduler()
+
+#Opt-in: AGENT_HEDGE_BUDGET=0.05 lets interactive calls whose first chunk is
+#later than the recent p95 start a second call, adding at most 5% more calls
+AGENT_HEDGE_BUDGET = float(os.environ.get("AGENT_HEDGE_BUDGET") or 0)
+hedger = Hedger(AGENT_HEDGE_BUDGET) if AGENT_HEDGE_BUDGET > 0 else None
 
 #Constants agent setup
 AGENT_ID = os.environ.get("BEDROCK_AGENT_ID")
@@ -16,48 +42,90 @@ AGENT_ALIAS_ID = os.environ.get("BEDROCK_AGENT_ALIAS_ID")
 if not AGENT_ID or not AGENT_ALIAS_ID:
     raise ValueError("BEDROCK_AGENT_ID and BEDROCK_AGENT_ALIAS_ID environment variables must be set")
 
-#Sends the input to the Bedrock agent
-def get_cleaned_note(note_input):
+#Recorded on every cleaned note. An alias can be repointed at a new agent
+#version without changing its ID, so ops can set BEDROCK_AGENT_VERSION explicitly.
+AGENT_VERSION = os.environ.get("BEDROCK_AGENT_VERSION") or f"{AGENT_ID}:{AGENT_ALIAS_ID}"
+
+#Sends the input to the Bedrock agent; with a deadline the call is given up
+#(DeadlineExceeded) once the request's budget is spent. Batch jobs pass lane='bulk'.
+def get_cleaned_note(note_input, deadline=None, lane='interactive'):
 
+    note = validate_note(note_input)
+    hedged = lane == 'interactive' and hedger is not None
+    invoke = lambda: scheduler.run(lane, lambda: _invoke_agent(note, hedged), deadline)
+    if _flight_store:
+        call = lambda: run_shared(_flight_store, flight_key(f"{lane}#{note}"), invoke, metrics=_flights.metrics,
+                                  deadline=deadline)
+    else:
+        call = invoke
+    #only this caller gives up at its deadline - a shared call carries on for
+    #the callers waiting on it and still publishes its result
+    return call_with_deadline(deadline, _flights.do, (lane, note), call)
+
+#The note as sent to the agent; ValueError for notes it cannot take
+def validate_note(note_input):
     if not note_input or not note_input.strip():
         raise ValueError("Note input cannot be empty")
     
     if len(note_input) > 10000:
         raise ValueError("Note too long for proccessing(max 10,000 characters)")
 
+    return normalize_note(note_input)
+
+#Notes that only differ in spacing get the same answer and can share a call
+def normalize_note(note_input):
+    lines = (re.sub(r"[ \t]+", " ", line).strip() for line in note_input.strip().splitlines())
+    return "\n".join(lines)
+
+def _start_agent_call(note_input):
+    #every call (a hedge included) gets its own session
+    return bedrock_agent.invoke_agent(
+    agentId=AGENT_ID,
+    agentAliasId=AGENT_ALIAS_ID,
+    sessionId=str(uuid.uuid4()),
+    inputText=note_input,
+    enableTrace=False
+    )
+
+def _invoke_agent(note_input, hedged=False):
     try:
-        response_stream = bedrock_agent.invoke_agent(
-        agentId=AGENT_ID,
-        agentAliasId=AGENT_ALIAS_ID,
-        sessionId=str(uuid.uuid4()),
-        inputText=note_input,
-        enableTrace=False
-        )
-        #Reads the stream (drops of text from the model)
-        full_response = ""
-        for event in response_stream:
-            if "chunk" in event and "bytes" in event["chunk"]:
-                full_response += event["chunk"]["bytes"].decode("utf-8")
-         
-        #Parses the complete JSON from the model          
-        try:
-            parsed = json.loads(full_response)
-            return parsed.get("outputText", "No outputText found.")
-        except json.JSONDecodeError:
-            return full_response.strip()
-        
+        #Reads the stream (drops of text from the model); a multi-byte
+        #character can be split across chunks, so decode once at the end
+        if hedged:
+            raw = hedger.call(lambda: _start_agent_call(note_input))
+        else:
+            response = _start_agent_call(note_input)
+            raw = b""
+            for event in response["completion"]:
+                if "chunk" in event and "bytes" in event["chunk"]:
+                    raw += event["chunk"]["bytes"]
+        return parse_agent_output(raw)
     except Exception as e: 
         logger.error(f"Bedrock processing failed: {type(e).__name__}")
+        raise agent_error(e)
+
+#The whole stream as bytes -> the cleaned text
+def parse_agent_output(raw):
+    full_response = raw.decode("utf-8")
+
+    #Parses the complete JSON from the model          
+    try:
+        parsed = json_codec.loads(full_response)
+        return parsed.get("outputText", "No outputText found.")
+    except json_codec.DecodeError:
+        return full_response.strip()
+
+#What callers see of a failed agent call
+def agent_error(e):
+    if "ResourceNotFoundException" in str(e):
+        return Exception("AI agent not found - check configuration")
+    elif "ValidationException" in str(e):
+        return Exception("Invalid input for AI processing")
+    elif "ThrottlingException" in str(e):
+        return Exception("AI service temporarily unavailable")
+    else:
+        return Exception("AI processing temporarily unavailable")
 
-        if "ResourceNotFoundException" in str(e):
-            raise Exception("AI agent not found - check configuration")
-        elif "ValidationException" in str(e):
-            raise Exception("Invalid input for AI processing")
-        elif "ThrottlingException" in str(e):
-            raise Exception("AI service temporarily unavailable")
-        else:
-            raise Exception("AI processing temporarily unavailable")
-        
 def test_agent_connection():
     try:
         test_note = "pt w/cp"
@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+from collections import deque
+from deadline import DeadlineExceeded
+
+#Priority lanes in front of invoke_agent. Clinicians in the UI (interactive)
+#and re-cleaning/backfills (bulk) share MAX_CONCURRENCY agent calls per
+#process:
+#  - when both lanes are queued, free slots go out by weighted fair queueing
+#    (LANE_WEIGHTS: 4 interactive calls for every bulk call)
+#  - bulk never holds more than MAX_CONCURRENCY - INTERACTIVE_RESERVE slots,
+#    so an interactive call always finds headroom
+#  - bulk gets no new slots while interactive waits put the SLO at risk: an
+#    interactive call has been queued for half of INTERACTIVE_WAIT_SLO_MS, or
+#    the p95 interactive wait over the last RECENT_SECONDS is over it
+#stats() reports queue depth, running calls and wait times per lane.
+
+LANES = ('interactive', 'bulk')
+LANE_WEIGHTS = {'interactive': 4, 'bulk': 1}
+MAX_CONCURRENCY = int(os.environ.get("AGENT_MAX_CONCURRENCY", "16"))
+INTERACTIVE_RESERVE = int(os.environ.get("AGENT_INTERACTIVE_RESERVE", "4"))
+INTERACTIVE_WAIT_SLO_MS = float(os.environ.get("AGENT_INTERACTIVE_WAIT_SLO_MS", "250"))
+RECENT_SECONDS = 10
+
+
+class _Ticket:
+
+    def __init__(self, lane, now):
+        self.lane = lane
+        self.queued_at = now
+        self.granted = False
+        self.yielded = False
+
+
+class _Lane:
+
+    def __init__(self, weight):
+        self.weight = weight
+        self.queue = deque()
+        self.running = 0
+        self.virtual_time = 0.0
+        self.admitted = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.recent_waits = deque() #(admitted at, wait)
+
+
+class AgentScheduler:
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, interactive_reserve=INTERACTIVE_RESERVE,
+                 wait_slo_ms=INTERACTIVE_WAIT_SLO_MS, weights=None, clock=time.monotonic):
+        if not 0 <= interactive_reserve < max_concurrency:
+            raise ValueError("interactive_reserve must leave bulk at least one slot")
+        self.max_concurrency = max_concurrency
+        self.bulk_limit = max_concurrency - interactive_reserve
+        self.wait_slo = wait_slo_ms / 1000
+        self.clock = clock
+        weights = weights or LANE_WEIGHTS
+        self._lanes = {lane: _Lane(weights[lane]) for lane in LANES}
+        self._cond = threading.Condition()
+        self.yields = 0
+
+    def run(self, lane, fn, deadline=None):
+        #fn() once the lane gets a slot; DeadlineExceeded if the deadline passes in the queue
+        self._acquire(lane, deadline)
+        try:
+            return fn()
+        finally:
+            self._release(lane)
+
+    def _acquire(self, lane, deadline):
+        if lane not in self._lanes:
+            raise ValueError(f"Unknown lane: {lane}")
+        with self._cond:
+            ticket = _Ticket(lane, self.clock())
+            queue = self._lanes[lane]
+            if not queue.queue:
+                #a lane coming back from idle does not get credit for the time it was away
+                queue.virtual_time = max(queue.virtual_time, self._min_virtual_time())
+            queue.queue.append(ticket)
+            self._dispatch()
+            poll = max(self.wait_slo / 2, 0.01) #the SLO check changes as time passes
+            while not ticket.granted:
+                timeout = deadline.remaining() if deadline else poll
+                if timeout <= 0:
+                    queue.queue.remove(ticket)
+                    self._dispatch()
+                    raise DeadlineExceeded(f"No agent slot for {lane} call in time")
+                self._cond.wait(min(timeout, poll))
+                self._dispatch()
+
+    def _release(self, lane):
+        with self._cond:
+            self._lanes[lane].running -= 1
+            self._dispatch()
+
+    def _min_virtual_time(self):
+        active = [lane.virtual_time for lane in self._lanes.values() if lane.queue]
+        return min(active) if active else max(lane.virtual_time for lane in self._lanes.values())
+
+    def _recent_waits(self, lane, now):
+        while lane.recent_waits and now - lane.recent_waits[0][0] > RECENT_SECONDS:
+            lane.recent_waits.popleft()
+        return sorted(wait for _, wait in lane.recent_waits)
+
+    def _interactive_at_risk(self, now):
+        interactive = self._lanes['interactive']
+        if interactive.queue and now - interactive.queue[0].queued_at >= self.wait_slo / 2:
+            return True
+        waits = self._recent_waits(interactive, now)
+        return bool(waits) and waits[int(len(waits) * 0.95)] > self.wait_slo
+
+    def _eligible(self, name, now):
+        if name == 'interactive':
+            return True
+        bulk = self._lanes['bulk']
+        if bulk.running >= self.bulk_limit:
+            return False
+        if self._interactive_at_risk(now):
+            if not bulk.queue[0].yielded:
+                bulk.queue[0].yielded = True
+                self.yields += 1
+            return False
+        return True
+
+    def _dispatch(self):
+        #hand free slots to waiters, lowest virtual time first; caller holds the lock
+        now = self.clock()
+        granted = False
+        while sum(lane.running for lane in self._lanes.values()) < self.max_concurrency:
+            candidates = [name for name, lane in self._lanes.items() if lane.queue and self._eligible(name, now)]
+            if not candidates:
+                break
+            name = min(candidates, key=lambda candidate: self._lanes[candidate].virtual_time)
+            lane = self._lanes[name]
+            ticket = lane.queue.popleft()
+            ticket.granted = True
+            granted = True
+            lane.running += 1
+            lane.virtual_time += 1 / lane.weight
+            wait = now - ticket.queued_at
+            lane.admitted += 1
+            lane.wait_total += wait
+            lane.wait_max = max(lane.wait_max, wait)
+            lane.recent_waits.append((now, wait))
+        if granted:
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            now = self.clock()
+            stats = {'bulk_yields': self.yields}
+            for name, lane in self._lanes.items():
+                waits = self._recent_waits(lane, now)
+                stats[name] = {
+                    'queued': len(lane.queue),
+                    'running': lane.running,
+                    'admitted': lane.admitted,
+                    'wait_avg_ms': lane.wait_total / lane.admitted * 1000 if lane.admitted else 0.0,
+                    'wait_p95_ms': waits[int(len(waits) * 0.95)] * 1000 if waits else 0.0,
+                    'wait_max_ms': lane.wait_max * 1000,
+                }
+            return stats
@@ -0,0 +1,372 @@
+import argparse
+import asyncio
+import base64
+import logging
+import os
+import signal
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, unquote
+import boto3
+from botocore.config import Config
+from botocore.session import get_session
+
+#Container mode: serves the Lambda handlers from one long-lived process behind
+#an async HTTP server (ECS/Fargate or any container host instead of Lambda +
+#API Gateway). Each request becomes the API Gateway event the handler already
+#understands and the handler's response dict becomes the HTTP response, so
+#the handlers and their tests stay as they are. Handlers are blocking (boto3,
+#the agent event stream) and run on a bounded pool of SERVER_WORKERS threads;
+#past SERVER_MAX_IN_FLIGHT requests the server answers 503 instead of queueing
+#without bound. Everything module-level - boto3 clients and their connection
+#pools, the history cache, near-duplicate index, single-flight, rate limit
+#buckets, the agent scheduler - lives for the whole process and is shared by
+#all requests, where Lambda rebuilds it per container.
+#
+#Runs under uvicorn when it is installed, otherwise on a small built-in
+#HTTP/1.1 server (keep-alive, Content-Length bodies only). The built-in server
+#gives a request's headers SERVER_HEADER_TIMEOUT and its body
+#SERVER_BODY_TIMEOUT seconds (an idle keep-alive connection is closed after the
+#header timeout) and holds at most SERVER_MAX_CONNECTIONS connections, so slow
+#or idle clients cannot pile up:
+#  python asgi_app.py [--host 0.0.0.0] [--port 8080]
+#  uvicorn asgi_app:app --port 8080
+
+logger = logging.getLogger(__name__)
+
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "64"))
+SERVER_MAX_IN_FLIGHT = int(os.environ.get("SERVER_MAX_IN_FLIGHT", str(SERVER_WORKERS * 4)))
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADER_BYTES = 64 * 1024
+SERVER_HEADER_TIMEOUT = float(os.environ.get("SERVER_HEADER_TIMEOUT", "10"))
+SERVER_BODY_TIMEOUT = float(os.environ.get("SERVER_BODY_TIMEOUT", "30"))
+SERVER_MAX_CONNECTIONS = int(os.environ.get("SERVER_MAX_CONNECTIONS", str(SERVER_MAX_IN_FLIGHT * 4)))
+
+#abandoned agent calls keep their deadline thread until they finish
+os.environ.setdefault("DEADLINE_WORKERS", str(SERVER_WORKERS * 2))
+
+#One botocore session for every module's clients, each with a connection pool
+#big enough for all workers (botocore's default of 10 would make threads wait
+#on each other). Has to run before the handler modules create their clients.
+_botocore_session = get_session()
+_botocore_session.set_default_client_config(Config(max_pool_connections=SERVER_WORKERS, retries={'mode': 'standard'}))
+boto3.setup_default_session(botocore_session=_botocore_session)
+
+import json_codec  # noqa: E402
+from deadline import DEFAULT_BUDGET_MS  # noqa: E402
+from auth import auth_lambda_handler  # noqa: E402
+from lambda_function import (lambda_handler, history_lambda_handler, update_note_lambda_handler,  # noqa: E402
+                             search_lambda_handler, error_response)
+
+#(method, path pattern, handler) - the routes API Gateway has in front of the Lambdas
+ROUTES = [
+    ('POST', '/process-note', lambda_handler),
+    ('GET', '/history', history_lambda_handler),
+    ('PUT', '/notes/{note_id}', update_note_lambda_handler),
+    ('GET', '/search', search_lambda_handler),
+    ('POST', '/signup', auth_lambda_handler),
+    ('POST', '/login', auth_lambda_handler),
+]
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match, Idempotency-Key',
+    'Access-Control-Max-Age': '600'
+}
+
+
+class RequestContext:
+    #the parts of the Lambda context the handlers use; the budget starts when the request arrives
+
+    def __init__(self, request_id, budget_ms=None):
+        self.aws_request_id = request_id
+        self.function_name = 'asgi'
+        self.expires_at = time.monotonic() + (budget_ms or DEFAULT_BUDGET_MS) / 1000
+
+    def get_remaining_time_in_millis(self):
+        return max(int((self.expires_at - time.monotonic()) * 1000), 0)
+
+
+def match_route(routes, method, path):
+    #(handler, route, path parameters); handler is None for 404 (route None) or 405
+    parts = path.rstrip('/').split('/') if path != '/' else ['']
+    path_found = False
+    for route_method, pattern, handler in routes:
+        pattern_parts = pattern.split('/')
+        if len(pattern_parts) != len(parts):
+            continue
+        params = {}
+        for expected, actual in zip(pattern_parts, parts):
+            if expected.startswith('{') and expected.endswith('}'):
+                if not actual:
+                    break
+                params[expected[1:-1]] = unquote(actual)
+            elif expected != actual:
+                break
+        else:
+            if route_method == method:
+                return handler, pattern, params
+            path_found = True
+    return None, ('' if path_found else None), {}
+
+
+def header_name(name):
+    #API Gateway passes headers with the client's casing and the handlers look up
+    #'Authorization'; ASGI lowercases them, so give them back their usual shape
+    return '-'.join(part.capitalize() for part in name.split('-'))
+
+
+def build_event(scope, body, route, path_params, request_id):
+    #the API Gateway (REST, payload 1.0) event for one request
+    headers = {}
+    for name, value in scope.get('headers', []):
+        name, value = header_name(name.decode('latin-1')), value.decode('latin-1')
+        headers[name] = f"{headers[name]},{value}" if name in headers else value
+    query = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+    try:
+        text = body.decode('utf-8') if body else None
+        encoded = False
+    except UnicodeDecodeError:
+        text, encoded = base64.b64encode(body).decode('ascii'), True
+    return {
+        'resource': route,
+        'path': scope['path'],
+        'httpMethod': scope['method'],
+        'headers': headers,
+        'queryStringParameters': query or None,
+        'pathParameters': path_params or None,
+        'body': text,
+        'isBase64Encoded': encoded,
+        'requestContext': {'requestId': request_id, 'httpMethod': scope['method'], 'path': scope['path'],
+                           'resourcePath': route}
+    }
+
+
+async def _send_response(send, response):
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded'):
+        body = base64.b64decode(body)
+    elif isinstance(body, str):
+        body = body.encode('utf-8')
+    headers = [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+               for name, value in (response.get('headers') or {}).items() if name.lower() != 'content-length']
+    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': response['statusCode'], 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class App:
+    #ASGI application running the handlers on a bounded thread pool
+
+    def __init__(self, routes=None, workers=SERVER_WORKERS, max_in_flight=SERVER_MAX_IN_FLIGHT, budget_ms=None):
+        self.routes = routes or ROUTES
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.budget_ms = budget_ms
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='handler')
+        self.in_flight = 0
+        self.metrics = {'requests': 0, 'rejected': 0, 'errors': 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await _send_response(send, await self.handle(scope, receive))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                #let running handlers finish their saves before the process exits
+                await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown, True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                return False
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def handle(self, scope, receive):
+        #the handler's response dict for one HTTP request
+        method, path = scope['method'], scope['path']
+        if method == 'OPTIONS':
+            return {'statusCode': 204, 'headers': CORS_HEADERS, 'body': ''}
+        if method == 'GET' and path == '/health':
+            return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'},
+                    'body': json_codec.dumps({'status': 'ok', 'in_flight': self.in_flight})}
+
+        handler, route, path_params = match_route(self.routes, method, path)
+        if handler is None:
+            return error_response(404 if route is None else 405,
+                                  "Endpoint not found" if route is None else "Method not allowed")
+        if self.in_flight >= self.max_in_flight:
+            self.metrics['rejected'] += 1
+            response = error_response(503, "Server busy, please retry")
+            response['headers']['Retry-After'] = '1'
+            return response
+
+        self.in_flight += 1
+        try:
+            body = await self._read_body(receive)
+            if body is False:
+                return error_response(413, "Request body too large")
+            if body is None:
+                return error_response(400, "Client disconnected")
+            request_id = str(uuid.uuid4())
+            event = build_event(scope, body, route, path_params, request_id)
+            context = RequestContext(request_id, self.budget_ms)
+            self.metrics['requests'] += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, handler, event, context)
+            except Exception as e:
+                #handlers answer their own errors - this is a bug in one of them
+                self.metrics['errors'] += 1
+                logger.error(f"Unhandled error - Request: {request_id}, Error: {type(e).__name__}")
+                return error_response(500, "Internal server error")
+        finally:
+            self.in_flight -= 1
+
+
+app = App()
+
+
+class _Connection:
+    #one keep-alive HTTP/1.1 connection of the built-in server
+
+    def __init__(self, app, reader, writer):
+        self.app = app
+        self.reader = reader
+        self.writer = writer
+
+    async def run(self):
+        try:
+            while await self._request():
+                pass
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError,
+                ValueError):
+            pass
+        finally:
+            self.writer.close()
+
+    async def _request(self):
+        #False once the connection should be closed
+        head = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), SERVER_HEADER_TIMEOUT)
+        request_line, *header_lines = head.decode('latin-1').split('\r\n')
+        method, target, version = request_line.split(' ', 2)
+        headers = []
+        for line in header_lines:
+            if line:
+                name, value = line.split(':', 1)
+                headers.append((name.strip().lower().encode('latin-1'), value.strip().encode('latin-1')))
+        fields = dict(headers)
+        if b'chunked' in fields.get(b'transfer-encoding', b''):
+            await self._write({'statusCode': 411, 'headers': {}, 'body': ''}, False)
+            return False
+        length = int(fields.get(b'content-length', b'0'))
+        if length > MAX_BODY_BYTES:
+            await self._write(error_response(413, "Request body too large"), False)
+            return False
+        body = await asyncio.wait_for(self.reader.readexactly(length), SERVER_BODY_TIMEOUT) if length else b''
+
+        path, _, query = target.partition('?')
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': version[5:], 'method': method,
+                 'scheme': 'http', 'path': unquote(path), 'raw_path': path.encode('latin-1'),
+                 'query_string': query.encode('latin-1'), 'headers': headers,
+                 'server': self.writer.get_extra_info('sockname'), 'client': self.writer.get_extra_info('peername')}
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+        async def receive():
+            return messages.pop() if messages else {'type': 'http.disconnect'}
+
+        keep_alive = version == 'HTTP/1.1' and fields.get(b'connection', b'').lower() != b'close'
+        await self._write(await self.app.handle(scope, receive), keep_alive)
+        return keep_alive
+
+    async def _write(self, response, keep_alive):
+        sent = {}
+
+        async def send(message):
+            sent[message['type']] = message
+
+        await _send_response(send, response)
+        start = sent['http.response.start']
+        lines = [f"HTTP/1.1 {start['status']} {_REASONS.get(start['status'], '')}"]
+        lines += [f"{name.decode('latin-1')}: {value.decode('latin-1')}" for name, value in start['headers']]
+        lines.append(f"connection: {'keep-alive' if keep_alive else 'close'}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + sent['http.response.body']['body'])
+        await self.writer.drain()
+
+
+_REASONS = {200: 'OK', 201: 'Created', 204: 'No Content', 304: 'Not Modified', 400: 'Bad Request',
+            401: 'Unauthorized', 404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict', 411: 'Length Required',
+            413: 'Payload Too Large', 422: 'Unprocessable Entity', 429: 'Too Many Requests',
+            500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+async def serve(app, host, port, ready=None):
+    #built-in server; stops accepting on SIGTERM/SIGINT (or the stop callback
+    #handed to ready) and waits for running handlers
+    connections = 0
+
+    async def connected(reader, writer):
+        nonlocal connections
+        if connections >= SERVER_MAX_CONNECTIONS:
+            app.metrics['rejected'] += 1
+            writer.close()
+            return
+        connections += 1
+        try:
+            await _Connection(app, reader, writer).run()
+        finally:
+            connections -= 1
+
+    server = await asyncio.start_server(connected, host, port, limit=MAX_HEADER_BYTES)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass #not the main thread
+    if ready:
+        ready(server.sockets[0].getsockname(), stop.set)
+    async with server:
+        await stop.wait()
+    await loop.run_in_executor(None, app.executor.shutdown, True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the note handlers from a long-lived process")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get("PORT", "8080")))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        import uvicorn
+    except ImportError:
+        uvicorn = None
+    print(f"Serving on {args.host}:{args.port} with {app.workers} handler threads "
+          f"({'uvicorn' if uvicorn else 'built-in server'})")
+    if uvicorn:
+        uvicorn.run(app, host=args.host, port=args.port, lifespan='on', log_level='warning')
+    else:
+        asyncio.run(serve(app, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
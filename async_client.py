@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.conditions import ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+import agent_client
+import db_client
+import reclean_queue
+from agent_client import validate_note, parse_agent_output, agent_error
+from deadline import DeadlineExceeded
+
+#asyncio versions of get_cleaned_note, save_to_dynamo and get_user_notes for
+#batch and backfill workers, so one process can keep hundreds of notes in
+#flight instead of holding a thread for each:
+#  - with aiobotocore installed the agent event stream is read and notes are
+#    written/queried on its async clients, no thread per call
+#  - without it the same coroutines run the blocking calls on a bounded pool
+#    of OFFLOAD_WORKERS threads
+#  - LOCAL_AGENT_LATENCY_MS uses the async local agent simulator
+#The version bump after a save, and queueing outdated
+#notes for re-cleaning, always go through the thread pool (they are best-effort).
+#AGENT_ASYNC_CONCURRENCY bounds agent calls in flight. These calls do not go
+#through the interactive/bulk lanes of agent_scheduler.py, so keep this path
+#out of processes that also serve interactive requests.
+
+logger = logging.getLogger(__name__)
+
+try:
+    from aiobotocore.session import get_session as _aio_session
+except ImportError:
+    _aio_session = None
+
+AGENT_ASYNC_CONCURRENCY = int(os.environ.get("AGENT_ASYNC_CONCURRENCY", "256"))
+OFFLOAD_WORKERS = int(os.environ.get("OFFLOAD_WORKERS", "32"))
+
+_offload_executor = ThreadPoolExecutor(max_workers=OFFLOAD_WORKERS, thread_name_prefix='offload')
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def native():
+    #True when agent and DynamoDB calls are async, not offloaded to threads
+    return _aio_session is not None
+
+
+async def offload(fn, *args, **kwargs):
+    #a blocking call, on the offload pool
+    return await asyncio.get_running_loop().run_in_executor(_offload_executor, lambda: fn(*args, **kwargs))
+
+
+class _Clients:
+    #aiobotocore clients (or the local agent) for one event loop, opened on first use
+
+    def __init__(self):
+        self.loop = None
+        self.clients = {}
+        self.exits = []
+        self.semaphore = None
+        self.flights = {}
+
+    def reset(self):
+        self.loop = asyncio.get_running_loop()
+        self.clients, self.exits, self.flights = {}, [], {}
+        self.semaphore = asyncio.Semaphore(AGENT_ASYNC_CONCURRENCY)
+
+    async def get(self, service):
+        if service not in self.clients:
+            if service == 'bedrock-agent-runtime' and os.environ.get("LOCAL_AGENT_LATENCY_MS"):
+                from local_agent import AsyncLocalAgent
+                self.clients[service] = AsyncLocalAgent(latency=float(os.environ["LOCAL_AGENT_LATENCY_MS"]) / 1000)
+            elif _aio_session is None:
+                return None
+            else:
+                context = _aio_session().create_client(service)
+                self.clients[service] = await context.__aenter__()
+                self.exits.append(context)
+        return self.clients[service]
+
+
+_state = _Clients()
+
+
+def _current():
+    #clients, semaphore and in-flight calls belong to the loop that made them
+    if _state.loop is not asyncio.get_running_loop():
+        _state.reset()
+    return _state
+
+
+async def close():
+    #closes the aiobotocore clients; call before the worker's event loop ends
+    state = _current()
+    while state.exits:
+        await state.exits.pop().__aexit__(None, None, None)
+    state.clients = {}
+
+
+async def _agent_call(note):
+    state = _current()
+    async with state.semaphore:
+        agent = await state.get('bedrock-agent-runtime')
+        if agent is None:
+            return await offload(agent_client._invoke_agent, note)
+        try:
+            response = await agent.invoke_agent(agentId=agent_client.AGENT_ID, agentAliasId=agent_client.AGENT_ALIAS_ID,
+                                                sessionId=str(uuid.uuid4()), inputText=note, enableTrace=False)
+            raw = b""
+            async for event in response["completion"]:
+                if "chunk" in event and "bytes" in event["chunk"]:
+                    raw += event["chunk"]["bytes"]
+            return parse_agent_output(raw)
+        except Exception as e:
+            logger.error(f"Bedrock processing failed: {type(e).__name__}")
+            raise agent_error(e)
+
+
+async def get_cleaned_note(note_input, deadline=None):
+    #agent_client.get_cleaned_note for asyncio callers; identical notes in flight share one call
+    note = validate_note(note_input)
+    flights = _current().flights
+    call = flights.get(note)
+    if call is None:
+        call = flights[note] = asyncio.ensure_future(_agent_call(note))
+        call.add_done_callback(lambda _: flights.pop(note, None))
+    if deadline is None:
+        return await asyncio.shield(call)
+    #only this caller gives up, the shared call carries on for the others
+    try:
+        return await asyncio.wait_for(asyncio.shield(call), timeout=deadline.remaining())
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Agent call did not finish within the deadline")
+
+
+def _serialize(values):
+    return {name: _serializer.serialize(value) for name, value in values.items()}
+
+
+def _deserialize(item):
+    return {name: _deserializer.deserialize(value) for name, value in item.items()}
+
+
+def _low_level(actions):
+    #note_write_actions for a plain (not resource) client
+    for action in actions:
+        for params in action.values():
+            for name in ('Item', 'Key', 'ExpressionAttributeValues'):
+                if name in params:
+                    params[name] = _serialize(params[name])
+    return actions
+
+
+async def save_to_dynamo(user_id, original_note, cleaned_note, context, agent_version=None, retention_policy=None,
+                         processing_time_ms=0, note_id=None, created_at=None, status='completed'):
+    #db_client.save_to_dynamo for asyncio callers; returns the note_id
+    dynamodb = await _current().get('dynamodb')
+    if dynamodb is None:
+        return await offload(db_client.save_to_dynamo, user_id, original_note, cleaned_note, context,
+                             agent_version=agent_version, retention_policy=retention_policy,
+                             processing_time_ms=processing_time_ms, note_id=note_id, created_at=created_at,
+                             status=status)
+
+    item = db_client.note_item(user_id, original_note, cleaned_note, context.aws_request_id, agent_version,
+                               retention_policy, processing_time_ms, note_id, created_at, status)
+    actions = _low_level(db_client.note_write_actions(None, item))
+    try:
+        if len(actions) == 1:
+            await dynamodb.put_item(**actions[0]['Put'])
+        else:
+            await dynamodb.transact_write_items(TransactItems=actions)
+    except Exception as e:
+        print(f"Database save failed: {str(e)}")
+        raise Exception("Failed to save note to database")
+
+    await offload(db_client.note_saved, user_id, item['note_id'])
+    return item['note_id']
+
+
+async def get_user_notes(user_id, limit=20, raise_errors=False):
+    #db_client.get_user_notes for asyncio callers
+    dynamodb = await _current().get('dynamodb')
+    if dynamodb is None:
+        return await offload(db_client.get_user_notes, user_id, limit=limit, raise_errors=raise_errors)
+
+    try:
+        table, params = db_client.user_notes_query(user_id)
+        expression = ConditionExpressionBuilder().build_expression(params.pop('KeyConditionExpression'),
+                                                                   is_key_condition=True)
+        response = await dynamodb.query(
+            TableName=table.name,
+            KeyConditionExpression=expression.condition_expression,
+            ExpressionAttributeNames=expression.attribute_name_placeholders,
+            ExpressionAttributeValues=_serialize(expression.attribute_value_placeholders),
+            ScanIndexForward=False, #Newest first
+            Limit=limit,
+            **params
+        )
+        items = [_deserialize(item) for item in response['Items']]
+        items = [item for item in items if not db_client.is_expired(item)]
+
+        #serve what is stored now, outdated cleanings are redone in the background
+        await offload(reclean_queue.enqueue_outdated, items)
+        return [db_client.format_note(item) for item in items]
+    except Exception as e:
+        print(f"Failed to get user notes: {str(e)}")
+        if raise_errors:
+            raise
+        return []
@@ -3,7 +3,7 @@ import boto3
 import hashlib
 import jwt
 import uuid
-import json
+import json_codec
 from datetime import datetime, timedelta
 
 
@@ -60,7 +60,9 @@ def verify_login(email, password):
     except Exception as e:
         return None, f"Login error: {str(e)}"
     
-def verify_token(token):
+def verify_token(token, deadline=None):
+    if deadline:
+        deadline.check("token verification")
     try:
         #same pattern - use enviroment variable 
         secret_key = os.environ.get('JWT_SECRET_KEY', 'dev-secret-key-replace-in-production') 
@@ -75,7 +77,7 @@ def verify_token(token):
 def auth_lambda_handler(event, context):
     try:
         #parse incoming request 
-        body = json.loads(event['body'])
+        body = json_codec.loads(event['body'])
         path = event.get('path', '')
 
         #route to appropiate function based on url
@@ -89,13 +91,13 @@ def auth_lambda_handler(event, context):
                 return {
                     'statusCode': 201, 
                     'headers': {'Access-Control-Allow-Origin': '*'}, 
-                    'body': json.dumps({'message': 'Account create succesfully'})
+                    'body': json_codec.dumps({'message': 'Account create succesfully'})
                 }
             else:
                 return {
                     'statusCode': 400, 
                     'headers': {'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': message})
+                    'body': json_codec.dumps({'error': message})
                 }
         elif '/login' in path:
             token, user_info = verify_login(body['email'], body['passsword'])
@@ -104,7 +106,7 @@ def auth_lambda_handler(event, context):
                 return {
                     'statusCode': 200, 
                     'headers': {'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
+                    'body': json_codec.dumps({
                         'token': token, 
                         'user': {
                             'email': user_info['email'],
@@ -116,19 +118,19 @@ def auth_lambda_handler(event, context):
                 return {
                     'statusCode': 401, 
                     'headers': {'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': user_info})
+                    'body': json_codec.dumps({'error': user_info})
                 }
         else: 
             return {
                 'statusCode': 404, 
                 'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Endpoint not found'})
+                'body': json_codec.dumps({'error': 'Endpoint not found'})
             }
     except Exception as e:
         return {
             'statusCode': 500, 
             'headers': {'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Server error: {str(e)}'})
+            'body': json_codec.dumps({'error': f'Server error: {str(e)}'})
         }
 def test_jwt_implementation():
     #test jwt generation and verification process
@@ -0,0 +1,78 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from agent_scheduler import AgentScheduler
+from local_agent import LocalAgent
+
+#Interactive latency while a backfill saturates agent concurrency.
+#Bulk workers keep the agent busy with back-to-back calls while clinicians'
+#notes arrive at random; compares one shared FIFO limit (a semaphore) with
+#the priority lanes of agent_scheduler.py.
+#Usage: python bench_agent_scheduler.py [seconds] [bulk_workers] [agent_latency_ms]
+
+MAX_CONCURRENCY = 8
+INTERACTIVE_PER_SECOND = 10
+
+
+class FifoScheduler:
+
+    def __init__(self, max_concurrency):
+        self.slots = threading.Semaphore(max_concurrency)
+
+    def run(self, lane, fn, deadline=None):
+        with self.slots:
+            return fn()
+
+
+def run(mode, seconds, bulk_workers, latency):
+    agent = LocalAgent(latency=latency)
+    scheduler = FifoScheduler(MAX_CONCURRENCY) if mode == 'fifo' else AgentScheduler(MAX_CONCURRENCY, 2)
+    stop = time.perf_counter() + seconds
+    waits = {'interactive': [], 'bulk': []}
+    lock = threading.Lock()
+
+    def call(lane, note):
+        started = time.perf_counter()
+        def invoke():
+            with lock:
+                waits[lane].append(time.perf_counter() - started)
+            response = agent.invoke_agent(inputText=note)
+            return b"".join(event['chunk']['bytes'] for event in response['completion'])
+        scheduler.run(lane, invoke)
+
+    def bulk_worker(i):
+        while time.perf_counter() < stop:
+            call('bulk', f"pt w/ cp, backfill {i}")
+
+    rng = random.Random(5)
+    with ThreadPoolExecutor(max_workers=bulk_workers + 64) as pool:
+        workers = [pool.submit(bulk_worker, i) for i in range(bulk_workers)]
+        clinicians = []
+        while time.perf_counter() < stop:
+            clinicians.append(pool.submit(call, 'interactive', "pt c/o sob"))
+            time.sleep(rng.expovariate(INTERACTIVE_PER_SECOND))
+        for future in workers + clinicians:
+            future.result()
+
+    interactive = sorted(waits['interactive'])
+    pick = lambda q: interactive[min(int(len(interactive) * q), len(interactive) - 1)] * 1000
+    return {'interactive': len(interactive), 'bulk': len(waits['bulk']),
+            'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99)}
+
+
+def main(seconds=10.0, bulk_workers=32, latency_ms=200.0):
+    print(f"{seconds}s, {bulk_workers} bulk workers, ~{INTERACTIVE_PER_SECOND}/s interactive, "
+          f"{MAX_CONCURRENCY} agent slots, {latency_ms} ms agent latency")
+    print("-" * 72)
+    for mode in ('fifo', 'lanes'):
+        result = run(mode, seconds, bulk_workers, latency_ms / 1000)
+        print(f"{mode:>6}: interactive wait p50 {result['p50_ms']:6.0f} ms  p95 {result['p95_ms']:6.0f} ms  "
+              f"p99 {result['p99_ms']:6.0f} ms  ({result['interactive']} calls)  bulk calls {result['bulk']}")
+
+
+if __name__ == "__main__":
+    import sys
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 10.0,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 32,
+         float(sys.argv[3]) if len(sys.argv) > 3 else 200.0)
@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from hedging import Hedger
+from local_agent import LocalAgent
+
+#Tail latency of agent calls with and without hedging, on the local agent
+#simulator with a share of straggling calls (straggler_factor x latency).
+#Usage: python bench_hedging.py [requests] [stragglers] [agent_latency_ms] [hedge_budget]
+
+CONCURRENCY = 16
+JITTER = 0.25
+STRAGGLER_FACTOR = 8
+
+
+def read(response):
+    return b"".join(event['chunk']['bytes'] for event in response['completion'])
+
+
+def run(requests, stragglers, latency, budget):
+    agent = LocalAgent(latency=latency, jitter=JITTER, stragglers=stragglers, straggler_factor=STRAGGLER_FACTOR, seed=7)
+    hedger = Hedger(budget) if budget else None
+
+    def request(i):
+        started = time.perf_counter()
+        start = lambda: agent.invoke_agent(inputText=f"pt w/ cp, note {i}")
+        if hedger:
+            hedger.call(start)
+        else:
+            read(start())
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        latencies = sorted(pool.map(request, range(requests)))
+    pick = lambda q: latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000
+    return {'calls': agent.calls, 'cancelled': agent.cancelled, 'p50_ms': pick(0.5), 'p95_ms': pick(0.95),
+            'p99_ms': pick(0.99), 'hedge_wins': hedger.metrics['hedge_wins'] if hedger else 0}
+
+
+def main(requests=800, stragglers=0.03, latency_ms=150.0, budget=0.05):
+    print(f"{requests} requests, {stragglers:.0%} stragglers at {STRAGGLER_FACTOR}x, {latency_ms} ms agent latency "
+          f"(+-{JITTER:.0%}), {CONCURRENCY} concurrent")
+    print("-" * 72)
+    for label, hedge_budget in (('no hedging', 0), (f'hedged {budget:.0%}', budget)):
+        result = run(requests, stragglers, latency_ms / 1000, hedge_budget)
+        print(f"{label:>11}: p50 {result['p50_ms']:5.0f} ms  p95 {result['p95_ms']:5.0f} ms  "
+              f"p99 {result['p99_ms']:5.0f} ms  agent calls {result['calls']} "
+              f"(+{result['calls'] / requests - 1:.1%}), hedges won {result['hedge_wins']}, "
+              f"closed {result['cancelled']}")
+
+
+if __name__ == "__main__":
+    import sys
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 800,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 0.03,
+         float(sys.argv[3]) if len(sys.argv) > 3 else 150.0,
+         float(sys.argv[4]) if len(sys.argv) > 4 else 0.05)
@@ -0,0 +1,70 @@
+import time
+import uuid
+from decimal import Decimal
+import json_codec
+
+#Measures per-request CPU spent serializing a full history response
+#(20 notes as DynamoDB returns them) with each available JSON backend.
+#Usage: python bench_json_codec.py [iterations]
+
+SAMPLE_NOTE = ("Patient with chest pain for 2 days, shortness of breath on exertion, "
+               "plan: laboratory tests, electrocardiogram, follow up in 1 week. ")
+
+
+def build_history_payload(note_count=20, note_chars=4000):
+    cleaned = (SAMPLE_NOTE * (note_chars // len(SAMPLE_NOTE) + 1))[:note_chars]
+    notes = []
+    for i in range(note_count):
+        notes.append({
+            'note_id': str(uuid.uuid4()),
+            'cleaned_note': cleaned,
+            'created_at': f"2025-06-27T02:{i:02d}:07.834941",
+            'original_length': Decimal(note_chars // 3),
+            'cleaned_length': Decimal(note_chars),
+        })
+    return {'notes': notes, 'count': len(notes)}
+
+
+def bench_backend(name, payload, body, iterations):
+    json_codec.use_backend(name)
+
+    start = time.process_time()
+    for _ in range(iterations):
+        json_codec.dumps(payload)
+    dumps_us = (time.process_time() - start) / iterations * 1e6
+
+    start = time.process_time()
+    for _ in range(iterations):
+        json_codec.loads(body)
+    loads_us = (time.process_time() - start) / iterations * 1e6
+
+    return dumps_us, loads_us
+
+
+def main(iterations=2000):
+    payload = build_history_payload()
+    body = json_codec.dumps(payload)
+    previous = json_codec.backend_name
+
+    print(f"History payload: {len(payload['notes'])} notes, {len(body)} bytes, {iterations} iterations")
+    print("-" * 60)
+    results = {}
+    for name in json_codec.BACKENDS:
+        results[name] = bench_backend(name, payload, body, iterations)
+        dumps_us, loads_us = results[name]
+        print(f"{name:>8}: dumps {dumps_us:8.1f} us/request   loads {loads_us:8.1f} us/request")
+
+    if "orjson" in results:
+        saved = results["stdlib"][0] - results["orjson"][0]
+        print("-" * 60)
+        print(f"CPU saved per history response: {saved:.1f} us "
+              f"({results['stdlib'][0] / results['orjson'][0]:.1f}x faster)")
+    else:
+        print("orjson not installed - only the stdlib backend was measured")
+
+    json_codec.use_backend(previous)
+
+
+if __name__ == "__main__":
+    import sys
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,95 @@
+import random
+import re
+import time
+from near_duplicate import NearDuplicateIndex
+
+#Hit rate, correctness and lookup latency of the near-duplicate index on a
+#synthetic corpus: templated notes (shared phrasing, different vitals, dates
+#and follow-up intervals) mixed with one-off notes. The stand-in agent expands
+#abbreviations deterministically, so every reused note can be checked against
+#what the agent would have returned.
+#Usage: python bench_near_duplicate.py [requests] [templates] [one_off_share]
+
+EXPANSIONS = {
+    'pt': 'patient', 'w/': 'with', 'cp': 'chest pain', 'sob': 'shortness of breath', 'c/o': 'complains of',
+    'f/u': 'follow up', 'hx': 'history', 'htn': 'hypertension', 'dm': 'diabetes', 'bp': 'blood pressure',
+    'hr': 'heart rate', 'nkda': 'no known drug allergies', 'prn': 'as needed', 'bid': 'twice daily',
+    'abd': 'abdominal', 'n/v': 'nausea and vomiting', 'r/o': 'rule out', 'mi': 'myocardial infarction',
+    'labs': 'laboratory tests', 'cxr': 'chest x-ray', 'ekg': 'electrocardiogram', 'rx': 'prescription'
+}
+WORDS = list(EXPANSIONS) + ['stable', 'denies', 'fever', 'today', 'pain', 'mild', 'ordered', 'on', 'and', 'plan']
+MAX_ENTRIES = (250, 1000, 4000)
+
+
+def fake_agent(note):
+    def expand(match):
+        token = match.group(0)
+        if re.fullmatch(r"\d+wk", token):
+            weeks = int(token[:-2])
+            return f"{weeks} week" + ('' if weeks == 1 else 's')
+        return EXPANSIONS.get(token.lower(), token)
+    cleaned = re.sub(r"[a-z0-9]+(?:[/.'][a-z0-9]+)*/?", expand, note, flags=re.IGNORECASE)
+    return cleaned[:1].upper() + cleaned[1:]
+
+
+def make_template(rng):
+    words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 14)))
+    return words + ", bp {sys}/{dia} hr {hr}, f/u {weeks}wk, seen {month}/{day}"
+
+
+def fill(template, rng):
+    return template.format(sys=rng.randint(100, 170), dia=rng.randint(60, 100), hr=rng.randint(50, 120),
+                           weeks=rng.randint(1, 6), month=rng.randint(1, 12), day=rng.randint(1, 28))
+
+
+def build_requests(count, templates, one_off_share, seed=7):
+    rng = random.Random(seed)
+    shapes = [make_template(rng) for _ in range(templates)]
+    #a few templates are used far more than the rest, like real order sets
+    weights = [1 / (rank + 1) for rank in range(templates)]
+    requests = []
+    for _ in range(count):
+        if rng.random() < one_off_share:
+            requests.append(fill(make_template(rng), rng))
+        else:
+            requests.append(fill(rng.choices(shapes, weights)[0], rng))
+    return requests
+
+
+def run(requests, max_entries):
+    index = NearDuplicateIndex(max_entries=max_entries)
+    wrong = 0
+    lookup_times = []
+    for note in requests:
+        started = time.perf_counter()
+        reused = index.lookup(note)
+        lookup_times.append(time.perf_counter() - started)
+        expected = fake_agent(note)
+        if reused:
+            wrong += reused[0] != expected
+        else:
+            index.add(note, expected, 'bench')
+    lookup_times.sort()
+    stats = index.stats()
+    stats.update(wrong=wrong,
+                 p50_ms=lookup_times[len(lookup_times) // 2] * 1000,
+                 p99_ms=lookup_times[int(len(lookup_times) * 0.99)] * 1000)
+    return stats
+
+
+def main(count=20000, templates=300, one_off_share=0.2):
+    requests = build_requests(count, templates, one_off_share)
+    print(f"{count} notes from {templates} templates, {one_off_share:.0%} one-off notes")
+    print("-" * 78)
+    for max_entries in MAX_ENTRIES:
+        stats = run(requests, max_entries)
+        print(f"max {max_entries:>5} entries: hit rate {stats['hit_rate']:6.1%}  agent calls saved {stats['hits']:>6}  "
+              f"wrong {stats['wrong']}  evicted {stats['evictions']:>6}  "
+              f"lookup p50 {stats['p50_ms']:.2f} ms p99 {stats['p99_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    import sys
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 300,
+         float(sys.argv[3]) if len(sys.argv) > 3 else 0.2)
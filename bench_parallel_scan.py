@@ -0,0 +1,72 @@
+import time
+import parallel_scan
+from parallel_scan import LocalTable
+
+#Scan throughput vs segment count against the in-memory table stand-in.
+#Every request sleeps like a DynamoDB round trip, so throughput is bound by
+#requests in flight - it should grow close to linearly with segments.
+#Worker processes pay a start-up cost on every scan and only pay off when
+#the reducer itself is CPU heavy.
+#Usage: python bench_parallel_scan.py [notes] [latency_ms] [--processes]
+
+PAGE_ITEMS = 250
+SEGMENT_COUNTS = (1, 2, 4, 8, 16, 32)
+
+_table = None
+_table_args = None
+
+
+def build_table(count, latency):
+    notes = [{'note_id': f"{i:08x}-bench", 'user_id': f"user-{i % 500}",
+              'original_length': 200 + i % 3000, 'cleaned_length': 300 + i % 4000}
+             for i in range(count)]
+    return LocalTable(notes, latency=latency, max_page_items=PAGE_ITEMS)
+
+
+def shared_table():
+    #threads share one table; forked worker processes inherit it, others build their own once
+    global _table
+    if _table is None:
+        _table = build_table(*_table_args)
+    return _table
+
+
+def count_items(total, items):
+    return total + len(items)
+
+
+def add(a, b):
+    return a + b
+
+
+def main(count=100000, latency_ms=5.0, processes=False):
+    global _table, _table_args
+    _table_args = (count, latency_ms / 1000)
+    _table = None
+    table = shared_table()
+    for segments in SEGMENT_COUNTS:
+        table._segment(0, segments) #split up front, not inside the timings
+
+    print(f"{count} notes, {PAGE_ITEMS} per page, {latency_ms} ms per request, "
+          f"{'processes' if processes else 'threads'}")
+    print("-" * 60)
+    baseline = None
+    for segments in SEGMENT_COUNTS:
+        start = time.perf_counter()
+        scan = parallel_scan.parallel_scan(shared_table, segments, reducer=count_items, initial=0,
+                                           combine=add, processes=processes)
+        elapsed = time.perf_counter() - start
+        assert scan['result'] == count
+        rate = count / elapsed
+        baseline = baseline or rate
+        speedup = rate / baseline
+        print(f"{segments:>3} segments: {rate:>10.0f} items/s  {speedup:5.1f}x  "
+              f"({speedup / segments * 100:3.0f}% of linear)")
+
+
+if __name__ == "__main__":
+    import sys
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    main(int(args[0]) if args else 100000,
+         float(args[1]) if len(args) > 1 else 5.0,
+         '--processes' in sys.argv)
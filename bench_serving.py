@@ -0,0 +1,151 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+#Requests per second per vCPU for POST /process-note, Lambda vs container mode.
+#Lambda: one request at a time per instance, and an instance gets
+#memory/1769 MB of a vCPU whether it computes or waits on the agent. Container
+#(asgi_app.py): one process on one vCPU with requests in flight concurrently.
+#Runs the real handler with the local agent simulator and a DB save that
+#only sleeps (no AWS calls); every note goes to the agent. The load generator
+#runs in the same process, so its CPU is counted against the container.
+#Usage: python bench_serving.py [requests] [agent_latency_ms] [lambda_memory_mb]
+
+LAMBDA_VCPU_MB = 1769       #memory that buys one full vCPU
+LAMBDA_SAMPLES = 20
+DB_SECONDS = 0.01
+CONCURRENCY = (16, 64, 256)
+WORDS = ['pt', 'w/', 'cp', 'sob', 'c/o', 'f/u', 'hx', 'htn', 'dm', 'bp', 'hr', 'prn', 'bid', 'labs',
+         'stable', 'chronic', 'acute', 'mild', 'severe', 'left', 'right', 'wk', 'dx', 'rx', 'neg', 'pos']
+
+
+def _configure(latency_ms, concurrency):
+    #settings the modules read at import time
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-west-2')
+    os.environ.setdefault('BEDROCK_AGENT_ID', 'bench-agent')
+    os.environ.setdefault('BEDROCK_AGENT_ALIAS_ID', 'bench-alias')
+    os.environ['LOCAL_AGENT_LATENCY_MS'] = str(latency_ms)
+    os.environ['SERVER_WORKERS'] = str(concurrency)
+    os.environ['DEADLINE_WORKERS'] = str(concurrency * 2)
+    os.environ['AGENT_MAX_CONCURRENCY'] = str(concurrency)
+    os.environ['RATE_LIMIT_PLANS'] = '{"standard": {"user_per_minute": 1000000, "user_burst": 1000000, ' \
+                                     '"tenant_per_minute": 1000000, "tenant_burst": 1000000}}'
+    os.environ['WRITE_JOURNAL_PATH'] = os.path.join(tempfile.mkdtemp(), 'journal.ndjson')
+
+
+def _local_save(**kwargs):
+    time.sleep(DB_SECONDS)
+    return kwargs['note_id']
+
+
+def build_requests(count, seed=5):
+    #(authorization, body) per request; notes are random enough that none are near duplicates
+    import jwt
+    import json_codec
+    rng = random.Random(seed)
+    secret = os.environ.get('JWT_SECRET_KEY', 'dev-secret-key-replace-in-production')
+    tokens = [jwt.encode({'user_id': f'user{i}', 'email': f'doc{i}@clinic{i}.org', 'exp': int(time.time()) + 3600},
+                         secret, algorithm='HS256') for i in range(50)]
+    requests = []
+    for i in range(count):
+        note = ' '.join(rng.choice(WORDS) for _ in range(12)) + f' ref {rng.choice(WORDS)}{i}'
+        requests.append((f'Bearer {tokens[i % len(tokens)]}', json_codec.dumps({'note': note})))
+    return requests
+
+
+class _LambdaContext:
+
+    def __init__(self, request_id):
+        self.aws_request_id = request_id
+        self.expires_at = time.monotonic() + 29
+
+    def get_remaining_time_in_millis(self):
+        return int((self.expires_at - time.monotonic()) * 1000)
+
+
+def run_lambda(requests, memory_mb):
+    #one instance, one request at a time
+    import lambda_function
+    durations = []
+    cpu_started = time.process_time()
+    for i, (authorization, body) in enumerate(requests):
+        started = time.perf_counter()
+        response = lambda_function.lambda_handler({'headers': {'Authorization': authorization}, 'body': body},
+                                                  _LambdaContext(f'lambda-{i}'))
+        assert response['statusCode'] == 200, response
+        durations.append(time.perf_counter() - started)
+    cpu_ms = (time.process_time() - cpu_started) / len(requests) * 1000
+    average = sum(durations) / len(durations)
+    vcpu = memory_mb / LAMBDA_VCPU_MB
+    return {'rps': 1 / average, 'vcpu': vcpu, 'rps_per_vcpu': 1 / average / vcpu, 'cpu_ms': cpu_ms,
+            'p50_ms': sorted(durations)[len(durations) // 2] * 1000}
+
+
+async def _container(app, requests, concurrency):
+    latencies = []
+    pending = iter(requests)
+
+    async def client():
+        for authorization, body in pending:
+            scope = {'type': 'http', 'method': 'POST', 'path': '/process-note', 'query_string': b'',
+                     'headers': [(b'authorization', authorization.encode()), (b'content-type', b'application/json')]}
+            messages = [{'type': 'http.request', 'body': body.encode(), 'more_body': False}]
+            sent = []
+
+            async def receive():
+                return messages.pop() if messages else {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+
+            started = time.perf_counter()
+            await app(scope, receive, send)
+            assert sent[0]['status'] == 200, sent
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies
+
+
+def run_container(requests, concurrency):
+    import asgi_app
+    app = asgi_app.App(workers=concurrency, max_in_flight=concurrency)
+    cpu_started, started = time.process_time(), time.perf_counter()
+    latencies = sorted(asyncio.run(_container(app, requests, concurrency)))
+    seconds = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    app.executor.shutdown()
+    return {'rps': len(requests) / seconds, 'cpu_share': cpu / seconds, 'cpu_ms': cpu / len(requests) * 1000,
+            'p50_ms': latencies[len(latencies) // 2] * 1000, 'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000}
+
+
+def main(requests=2000, latency_ms=300.0, memory_mb=512):
+    _configure(latency_ms, max(CONCURRENCY))
+    import lambda_function
+    import write_journal
+    lambda_function.save_to_dynamo = _local_save
+    lambda_function.near_duplicates.lookup = lambda note, owner=None: None
+    load = build_requests(requests)
+
+    print(f"{requests} notes, {latency_ms} ms agent latency, {DB_SECONDS * 1000:.0f} ms save, "
+          f"Lambda at {memory_mb} MB")
+    print("-" * 72)
+    result = run_lambda(load[:LAMBDA_SAMPLES], memory_mb)
+    print(f"{'lambda':>14}: {result['rps']:7.1f} req/s per instance ({result['vcpu']:.2f} vCPU)  "
+          f"{result['rps_per_vcpu']:7.1f} req/s/vCPU  cpu {result['cpu_ms']:.1f} ms/req  p50 {result['p50_ms']:.0f} ms")
+    baseline = result['rps_per_vcpu']
+    for concurrency in CONCURRENCY:
+        result = run_container(load, concurrency)
+        print(f"{f'container x{concurrency}':>14}: {result['rps']:7.1f} req/s on 1 vCPU ({result['cpu_share']:4.0%} busy)  "
+              f"{result['rps'] / baseline:5.1f}x  cpu {result['cpu_ms']:.1f} ms/req  "
+              f"p50 {result['p50_ms']:.0f} ms  p99 {result['p99_ms']:.0f} ms")
+    assert not write_journal.pending()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 2000, float(args[1]) if len(args) > 1 else 300.0,
+         int(args[2]) if len(args) > 2 else 512)
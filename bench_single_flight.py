@@ -0,0 +1,88 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from local_agent import LocalAgent
+from single_flight import SingleFlight, LocalFlightStore, flight_key, run_shared
+
+#Agent calls saved by single-flight under replayed "morning rounds" load:
+#every round, several users send the same templated note within a few
+#milliseconds, spread over several containers, next to one-off notes.
+#Compares no coalescing, coalescing inside each container, and coalescing
+#across containers through a shared lock store.
+#Usage: python bench_single_flight.py [rounds] [containers] [agent_latency_ms]
+
+BURST_USERS = 12
+BURST_JITTER = 0.05
+ONE_OFF_PER_ROUND = 6
+MODES = ('none', 'container', 'fleet')
+
+
+def build_load(rounds, seed=3):
+    #[(start offset, note)] per round
+    rng = random.Random(seed)
+    load = []
+    for round_number in range(rounds):
+        template = f"pt w/ cp, bp 120/80, f/u 2wk, order set {round_number}"
+        requests = [(rng.uniform(0, BURST_JITTER), template) for _ in range(BURST_USERS)]
+        requests += [(rng.uniform(0, BURST_JITTER), f"pt c/o sob, note {round_number}-{i}") for i in range(ONE_OFF_PER_ROUND)]
+        load.append(requests)
+    return load
+
+
+def run(load, containers, latency, mode):
+    agent = LocalAgent(latency=latency)
+    store = LocalFlightStore()
+    flights = [SingleFlight() for _ in range(containers)]
+    rng = random.Random(11)
+    latencies = []
+    lock = threading.Lock()
+
+    def invoke(note):
+        response = agent.invoke_agent(inputText=note)
+        return b"".join(event['chunk']['bytes'] for event in response['completion'])
+
+    def request(container, offset, note):
+        time.sleep(offset)
+        started = time.perf_counter()
+        if mode == 'none':
+            invoke(note)
+        elif mode == 'container':
+            flights[container].do(note, lambda: invoke(note))
+        else:
+            flights[container].do(note, lambda: run_shared(store, flight_key(note), lambda: invoke(note)))
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    requests = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=BURST_USERS + ONE_OFF_PER_ROUND) as pool:
+        for round_requests in load:
+            futures = [pool.submit(request, rng.randrange(containers), offset, note) for offset, note in round_requests]
+            for future in futures:
+                future.result()
+            requests += len(round_requests)
+    latencies.sort()
+    return {'requests': requests, 'agent_calls': agent.calls, 'seconds': time.perf_counter() - started,
+            'p50_ms': latencies[len(latencies) // 2] * 1000, 'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000}
+
+
+def main(rounds=20, containers=4, latency_ms=300.0):
+    load = build_load(rounds)
+    print(f"{rounds} rounds x ({BURST_USERS} identical + {ONE_OFF_PER_ROUND} one-off notes), "
+          f"{containers} containers, {latency_ms} ms agent latency")
+    print("-" * 72)
+    baseline = None
+    for mode in MODES:
+        result = run(load, containers, latency_ms / 1000, mode)
+        baseline = baseline or result['agent_calls']
+        print(f"{mode:>9}: {result['agent_calls']:>4} agent calls for {result['requests']} notes "
+              f"({1 - result['agent_calls'] / baseline:4.0%} fewer)  "
+              f"latency p50 {result['p50_ms']:.0f} ms p99 {result['p99_ms']:.0f} ms")
+
+
+if __name__ == "__main__":
+    import sys
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 4,
+         float(sys.argv[3]) if len(sys.argv) > 3 else 300.0)
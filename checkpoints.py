@@ -0,0 +1,21 @@
+import os
+import json_codec
+
+#JSON checkpoint files shared by the long-running CLI tools (export, reprocess, ...)
+
+
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return json_codec.loads(f.read())
+
+
+def save_checkpoint(path, checkpoint):
+    #write-then-rename so a crash never leaves a half written checkpoint
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(json_codec.dumps(checkpoint))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -1,113 +1,576 @@
+import os
+import time
 import uuid
-from datetime import datetime 
+from datetime import datetime, timedelta
+from decimal import Decimal
 import boto3
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Key, Attr
+import json_codec
+import reclean_queue
+from deadline import call_with_deadline
 
 #connect DB
 dynamodb = boto3.resource("dynamodb")
 notes_table = dynamodb.Table("medical-notes")
+versions_table = dynamodb.Table("medical-note-versions")
+tombstones_table = dynamodb.Table("medical-note-tombstones")
+changes_table = dynamodb.Table("medical-note-changes")
+notes_v2_table = dynamodb.Table("medical-notes-v2")
+
+#medical-notes (keyed by note_id) is being replaced by medical-notes-v2, keyed by
+#user_id + note_key (created_at#note_id) - see migrate_notes.py. Phases, in order:
+#  legacy     - medical-notes only
+#  dual_write - every write goes to both tables, reads stay on medical-notes (run the backfill now)
+#  v2_reads   - reads move to medical-notes-v2, writes still go to both so rolling back is safe
+#  v2         - medical-notes-v2 only
+NOTES_TABLE_PHASES = ('legacy', 'dual_write', 'v2_reads', 'v2')
+NOTES_TABLE_PHASE = os.environ.get("NOTES_TABLE_PHASE", "legacy")
+if NOTES_TABLE_PHASE not in NOTES_TABLE_PHASES:
+    raise ValueError(f"Unknown NOTES_TABLE_PHASE: {NOTES_TABLE_PHASE}")
+
+#how long a container trusts its cached copy of a user's version
+VERSION_CACHE_SECONDS = float(os.environ.get("VERSION_CACHE_SECONDS", "2"))
+
+#user_id -> (version, updated_at, fetched_at)
+_version_cache = {}
+
+#delta sync: deleted and changed notes are remembered this long, older cursors need a full resync
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get("TOMBSTONE_RETENTION_DAYS", "30"))
+
+#delta sync: notes this recent may still be missing from the GSI, so the
+#returned cursor never moves past now - SYNC_SETTLE_SECONDS
+SYNC_SETTLE_SECONDS = int(os.environ.get("SYNC_SETTLE_SECONDS", "5"))
+
+#retention policies: name -> days to keep a note (None keeps it forever)
+#e.g. RETENTION_POLICIES='{"default": 2555, "trial": 30}' RETENTION_POLICY=default
+RETENTION_POLICIES = json_codec.loads(os.environ.get("RETENTION_POLICIES") or '{"default": null}')
+RETENTION_POLICY = os.environ.get("RETENTION_POLICY", "default")
+
+def expires_at_for(policy=None):
+    #epoch seconds for the DynamoDB TTL attribute, or None
+    policy = policy or RETENTION_POLICY
+    if policy not in RETENTION_POLICIES:
+        raise ValueError(f"Unknown retention policy: {policy}")
+    days = RETENTION_POLICIES[policy]
+    if days is None:
+        return None
+    return int(time.time()) + int(days) * 86400
+
+#notes whose cleaning is not final (status 'pending', e.g. a degraded answer, or
+#'failed' after a retry) also carry pending_status, retry_at and attempts. Only
+#they appear in the sparse pending-status-index that status_sweeper.py works
+#through; settled_item() takes a note back out of it
+PENDING_STATUS_INDEX = 'pending-status-index'
+PENDING_ATTRIBUTES = ('pending_status', 'retry_at', 'attempts')
+
+def settled_item(item, **changes):
+    settled = {name: value for name, value in item.items() if name not in PENDING_ATTRIBUTES}
+    settled.update(changes)
+    settled['status'] = 'completed'
+    return settled
+
+def query_pending_notes(pending_status, due_before, **query_kwargs):
+    #notes with this pending_status whose retry_at has come, oldest first
+    condition = Key('pending_status').eq(pending_status) & Key('retry_at').lte(due_before)
+    return notes_read_table().query(IndexName=PENDING_STATUS_INDEX, KeyConditionExpression=condition, **query_kwargs)
+
+#the item save_to_dynamo (and async_client) writes for a cleaned note
+def note_item(user_id, original_note, cleaned_note, request_id, agent_version=None, retention_policy=None,
+              processing_time_ms=0, note_id=None, created_at=None, status='completed'):
+    #note_id and created_at are passed in when a retried request must land on the same
+    #note; otherwise created_at is stamped here, when the note is written
+    note_id = note_id or str(uuid.uuid4()) # Unique ID for this session/note
+
+    item = {
+        #primary key fields
+        'note_id': note_id, #unique identfier
+        'user_id': user_id,  #who owns note
+             
+        #note content
+        'original_note': original_note, #what user submitted
+        'cleaned_note': cleaned_note,   #AI proccessed result
+        'agent_version': agent_version, #which agent/alias produced cleaned_note
+        
+        #metadata
+        'created_at': created_at or datetime.utcnow().isoformat(), #when it was proccessed
+        'request_id': request_id,                    #for debugging
+        'original_length': len(original_note),       #stats for analysis
+        'cleaned_length': len(cleaned_note), 
+            
+        #status tracking
+        'status': status,
+        'proccessing_time_ms': processing_time_ms  #agent call time, 0 when not measured
+    }
+    if status != 'completed':
+        item.update({'pending_status': status, 'retry_at': item['created_at'], 'attempts': 0})
+
+    #retention - DynamoDB TTL deletes the note once expires_at has passed
+    expires_at = expires_at_for(retention_policy)
+    if expires_at:
+        item['expires_at'] = expires_at
+    return item
 
 #save to DynamoBD
-def save_to_dynamo(user_id, original_note, cleaned_note, context):
-    note_id = str(uuid.uuid4()) # Unique ID for this session/note
+def save_to_dynamo(user_id, original_note, cleaned_note, context, agent_version=None, retention_policy=None,
+                   processing_time_ms=0, deadline=None, note_id=None, created_at=None, status='completed', once=False):
+    #once: an earlier attempt may already have saved note_id under created_at (a
+    #request taking over a crashed one, a journal replay) - the note is only written
+    #if it didnt, and a note the user has since deleted is not brought back
+    item = note_item(user_id, original_note, cleaned_note, context.aws_request_id, agent_version, retention_policy,
+                     processing_time_ms, note_id, created_at, status)
+    note_id = item['note_id']
 
+    #each step gets what is left of the request's budget (no deadline: no limit)
+    written = True
     try:
-        notes_table.put_item(Item={
-            #primary key fields
-            'note_id': note_id, #unique identfier
-            'user_id': user_id,  #who owns note
-                 
-            #note content
-            'original_note': original_note, #what user submitted
-            'cleaned_note': cleaned_note,   #AI proccessed result
-            
-            #metadata
-            'created_at': datetime.utcnow().isoformat(), #when it was proccessed
-            'request_id': context.aws_request_id,        #for debugging
-            'original_length': len(original_note),       #stats for analysis
-            'cleaned_length': len(cleaned_note), 
-                
-            #status tracking
-            'status': 'completed',
-            'proccessing_time_ms': 0  #track proccessing time
-        })
-    
-        return note_id
-    
+        if once and call_with_deadline(deadline, was_deleted, user_id, note_id):
+            written = False
+        elif once and not created_at and NOTES_TABLE_PHASE != 'legacy' and call_with_deadline(
+                deadline, load_note, note_id, user_id):
+            #records from before created_at was fixed up front: the v2 key carries created_at,
+            #so the condition below cant see the earlier copy without it
+            written = False
+        elif once:
+            written = call_with_deadline(deadline, run_note_writes,
+                                         note_write_actions(None, item, 'attribute_not_exists(note_id)'))
+        elif NOTES_TABLE_PHASE == 'legacy':
+            call_with_deadline(deadline, notes_table.put_item, Item=item)
+        else:
+            call_with_deadline(deadline, run_note_writes, note_write_actions(None, item))
     except Exception as e:
         #log error, dont crash whole request
         print(f"Database save failed: {str(e)}")
         raise Exception("Failed to save note to database")
+
+    if written:
+        note_saved(user_id, note_id, deadline, created_at)
+    return note_id
+
+#follow-ups once a new note is saved; failures are logged, the note itself is in.
+#search indexing follows from the notes stream (search_index.index_stream_handler)
+def note_saved(user_id, note_id, deadline=None, created_at=None):
+    #history ETags depend on this
+    try:
+        call_with_deadline(deadline, bump_user_version, user_id)
+    except Exception as e:
+        print(f"Failed to bump version for user {user_id}: {str(e)}")
+
+    #a note written well after the created_at fixed for it (a retry, a journal replay)
+    #is behind cursors that moved on meanwhile - delta sync finds it in the change log
+    if created_at and created_at < (datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)).isoformat():
+        try:
+            call_with_deadline(deadline, record_change, user_id, note_id, created_at)
+        except Exception as e:
+            print(f"Failed to record late save of note {note_id}: {str(e)}")
+
+#keep the version counter and delta sync in step after cleaned_note changed in place
+def sync_cleaned_note_change(user_id, note_id, created_at=None):
+    try:
+        record_change(user_id, note_id, created_at)
+    except Exception as e:
+        print(f"Failed to record change to note {note_id}: {str(e)}")
+    try:
+        bump_user_version(user_id)
+    except Exception as e:
+        print(f"Failed to bump version for user {user_id}: {str(e)}")
+
+#migration helpers - which table serves reads and how a note is addressed in each
+def reads_v2():
+    return NOTES_TABLE_PHASE in ('v2_reads', 'v2')
+
+def notes_read_table():
+    return notes_v2_table if reads_v2() else notes_table
+
+def note_sort_key(created_at, note_id):
+    return f"{created_at}#{note_id}"
+
+def legacy_note_key(item):
+    return {'note_id': item['note_id']}
+
+def v2_note_key(item):
+    return {'user_id': item['user_id'], 'note_key': note_sort_key(item['created_at'], item['note_id'])}
+
+def legacy_note_item(item):
+    return {name: value for name, value in item.items() if name != 'note_key'}
+
+def v2_note_item(item):
+    return dict(item, note_key=note_sort_key(item['created_at'], item['note_id']))
+
+def _note_targets():
+    #(table, key builder, item builder, serves reads) for every table this phase writes to
+    targets = []
+    if NOTES_TABLE_PHASE != 'v2':
+        targets.append((notes_table, legacy_note_key, legacy_note_item, not reads_v2()))
+    if NOTES_TABLE_PHASE != 'legacy':
+        targets.append((notes_v2_table, v2_note_key, v2_note_item, reads_v2()))
+    return targets
+
+def note_keys_by_table(items):
+    #table name -> primary keys of these notes in every table this phase writes to
+    return {table.name: [key_of(item) for item in items] for table, key_of, _, _ in _note_targets()}
+
+def note_write_actions(old_item, new_item=None, condition=None, values=None):
+    #TransactWriteItems actions that put new_item (or delete old_item when new_item
+    #is None) in every table this phase writes to. The condition is checked on the
+    #table serving reads, the other copy follows it inside the same transaction
+    actions = []
+    for table, key_of, item_of, serves_reads in _note_targets():
+        if new_item is None:
+            operation, params = 'Delete', {'TableName': table.name, 'Key': key_of(old_item)}
+        else:
+            operation, params = 'Put', {'TableName': table.name, 'Item': item_of(new_item)}
+        if condition and serves_reads:
+            params['ConditionExpression'] = condition
+            if values:
+                params['ExpressionAttributeValues'] = values
+        actions.append({operation: params})
+    return actions
+
+def run_note_writes(actions):
+    #True once written, False if a condition failed. A single action skips the
+    #transaction (transactional writes cost twice as much)
+    client = dynamodb.meta.client
+    try:
+        if len(actions) == 1:
+            (operation, params), = actions[0].items()
+            if operation == 'Put':
+                client.put_item(**params)
+            else:
+                client.delete_item(**params)
+        else:
+            client.transact_write_items(TransactItems=actions)
+    except client.exceptions.ConditionalCheckFailedException:
+        return False
+    except client.exceptions.TransactionCanceledException as e:
+        reasons = e.response.get('CancellationReasons', [])
+        if any(reason.get('Code') == 'ConditionalCheckFailed' for reason in reasons):
+            return False
+        raise
+    return True
+
+def find_v2_note_key(note_id, user_id, created_at=None):
+    if created_at:
+        #the key carries user_id, so another user's note simply isnt found
+        return {'user_id': user_id, 'note_key': note_sort_key(created_at, note_id)}
+    #note-id-index is KEYS_ONLY and eventually consistent - pass created_at where it is known
+    response = notes_v2_table.query(
+        IndexName='note-id-index',
+        KeyConditionExpression=Key('note_id').eq(note_id)
+    )
+    for item in response['Items']:
+        if item['user_id'] == user_id:
+            return {'user_id': user_id, 'note_key': item['note_key']}
+    return None
+
+def load_note(note_id, user_id, created_at=None):
+    #full stored item, strongly consistent, from the table serving reads
+    #returns None if the note doesnt exist or belongs to someone else
+    if reads_v2():
+        key = find_v2_note_key(note_id, user_id, created_at)
+        if not key:
+            return None
+        return notes_v2_table.get_item(Key=key, ConsistentRead=True).get('Item')
+
+    item = notes_table.get_item(Key={'note_id': note_id}, ConsistentRead=True).get('Item')
+    if not item or item['user_id'] != user_id:
+        return None
+    return item
+
+def user_notes_query(user_id, created_after=None):
+    #(table, query parameters) for one user's notes in created_at order: the GSI
+    #on medical-notes, or a strongly consistent query of the medical-notes-v2 base table
+    if reads_v2():
+        condition = Key('user_id').eq(user_id)
+        if created_after:
+            #'~' sorts after every character of a note_id, so notes created exactly at created_after are skipped
+            condition = condition & Key('note_key').gt(f"{created_after}#~")
+        return notes_v2_table, {'KeyConditionExpression': condition, 'ConsistentRead': True}
+
+    condition = Key('user_id').eq(user_id)
+    if created_after:
+        condition = condition & Key('created_at').gt(created_after)
+    return notes_table, {'IndexName': 'user-notes-index', 'KeyConditionExpression': condition}
+
+def query_user_notes(user_id, created_after=None, **query_kwargs):
+    table, params = user_notes_query(user_id, created_after)
+    return table.query(**params, **query_kwargs)
+
+#per-user version, bumped on every save/delete so history can be cached by ETag
+def bump_user_version(user_id):
+    now = time.time()
+    response = versions_table.update_item(
+        Key={'user_id': user_id},
+        UpdateExpression='SET updated_at = :now ADD note_version :one',
+        ExpressionAttributeValues={':now': Decimal(str(round(now, 3))), ':one': 1},
+        ReturnValues='ALL_NEW'
+    )
+    version = int(response['Attributes']['note_version'])
+    _version_cache[user_id] = (version, now, now)
+    return version
+
+def get_user_version(user_id):
+    #returns (version, updated_at epoch seconds), 0/0.0 for users that never saved
+    cached = _version_cache.get(user_id)
+    if cached and time.time() - cached[2] < VERSION_CACHE_SECONDS:
+        return cached[0], cached[1]
+
+    response = versions_table.get_item(Key={'user_id': user_id})
+    item = response.get('Item', {})
+    version = int(item.get('note_version', 0))
+    updated_at = float(item.get('updated_at', 0))
+    _version_cache[user_id] = (version, updated_at, time.time())
+    return version, updated_at
     
-def get_user_notes(user_id, limit=20):
+def get_user_notes(user_id, limit=20, raise_errors=False):
     try:
         #query notes for THIS user
-        #Note: This requires a global secondary index on user_id
-        response = notes_table.query(
-            IndexName='user-notes-index', #Need to create this index
-            KeyConditionExpression=Key('user_id').eq(user_id),
+        response = query_user_notes(
+            user_id,
             ScanIndexForward=False, #Newest first
             Limit=limit 
         )
 
-        #Format for frontend (remove sensitive fields)
-        notes = []
-        for item in response['Item']:
-            notes.append({
-                'note_id': item['note_id'],
-                'cleaned_note': item['cleaned_note'],
-                'created_at': item['created_at'],
-                'original_length': item.get('original_length', 0),
-                'cleaned_length': item.get('cleaned_length', 0),
-                #dont return original_note for privacy
-                #dont return request_id (internal debugging info)
-
-            })
-        return notes
+        items = [item for item in response['Items'] if not is_expired(item)]
+
+        #serve what is stored now, outdated cleanings are redone in the background
+        reclean_queue.enqueue_outdated(items)
+        return [format_note(item) for item in items]
     except Exception as e:
         print(f"Failed to get user notes: {str(e)}")
+        if raise_errors:
+            raise
         return[]
+
+#TTL deletes lazily (can take days), so reads skip notes that are past expires_at
+def is_expired(item, now=None):
+    expires_at = item.get('expires_at')
+    return expires_at is not None and int(expires_at) <= (now or time.time())
+
+#Format for frontend (remove sensitive fields)
+def format_note(item):
+    return {
+        'note_id': item['note_id'],
+        'cleaned_note': item['cleaned_note'],
+        'created_at': item['created_at'],
+        'original_length': item.get('original_length', 0),
+        'cleaned_length': item.get('cleaned_length', 0),
+        #dont return original_note for privacy
+        #dont return request_id (internal debugging info)
+    }
+
+#delta sync - notes created, changed and deleted after the client's cursor
+def get_user_changes_since(user_id, since, limit=100):
+    now = datetime.utcnow()
+    if since < (now - timedelta(days=TOMBSTONE_RETENTION_DAYS)).isoformat():
+        #deletes older than this are gone, client has to reload everything
+        return {'full_resync': True, 'notes': [], 'deleted': [], 'has_more': False, 'next_since': None}
+
+    response = query_user_notes(
+        user_id,
+        created_after=since,
+        ScanIndexForward=True, #Oldest first so the cursor only moves forward
+        Limit=limit
+    )
+    items = [item for item in response['Items'] if not is_expired(item)]
+    reclean_queue.enqueue_outdated(items)
+    notes = [format_note(item) for item in items]
+    has_more = 'LastEvaluatedKey' in response
+
+    #deletes are rare, read all of them in one go
+    deleted = []
+    query_kwargs = {'KeyConditionExpression': Key('user_id').eq(user_id) & Key('tombstone_key').gt(since)}
+    while True:
+        page = tombstones_table.query(**query_kwargs)
+        deleted.extend(item['note_id'] for item in page['Items'])
+        if 'LastEvaluatedKey' not in page:
+            break
+        query_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+    #notes changed in place keep their created_at, so they come from the change
+    #log; a note changed several times is sent once, as it is now
+    notes.extend(_changed_notes(user_id, since, {note['note_id'] for note in notes} | set(deleted)))
+
+    #cursor follows what was read, including expired notes that were filtered out
+    latest = response['Items'][-1]['created_at'] if response['Items'] else since
+    if has_more:
+        #continue exactly where this page stopped
+        next_since = latest
+    else:
+        #everything up to now was read - move up to a few seconds ago (even when
+        #nothing new came back, or idle cursors would age into a full resync), held
+        #back so late GSI entries (and notes stamped just before a slow write
+        #landed) are picked up next time
+        settled = (now - timedelta(seconds=SYNC_SETTLE_SECONDS)).isoformat()
+        next_since = max(since, settled)
+
+    return {
+        'full_resync': False,
+        'notes': notes,
+        'deleted': deleted,
+        'has_more': has_more,
+        'next_since': next_since
+    }
+
+def record_tombstone(user_id, note_id):
+    deleted_at = datetime.utcnow()
+    tombstones_table.put_item(Item={
+        'user_id': user_id,
+        'tombstone_key': f"{deleted_at.isoformat()}#{note_id}", #sorts by delete time
+        'note_id': note_id,
+        'deleted_at': deleted_at.isoformat(),
+        'expires_at': int(time.time()) + TOMBSTONE_RETENTION_DAYS * 86400 #DynamoDB TTL
+    })
     
-def get_note_by_id(note_id, user_id):
-    try: 
-        response = notes_table.get_item(Key={'note_id': note_id})
+def record_change(user_id, note_id, created_at=None):
+    changed_at = datetime.utcnow()
+    item = {
+        'user_id': user_id,
+        'change_key': f"{changed_at.isoformat()}#{note_id}", #sorts by change time
+        'note_id': note_id,
+        'changed_at': changed_at.isoformat(),
+        'expires_at': int(time.time()) + TOMBSTONE_RETENTION_DAYS * 86400 #DynamoDB TTL
+    }
+    if created_at:
+        item['created_at'] = created_at #addresses the note in medical-notes-v2 without the GSI
+    changes_table.put_item(Item=item)
 
-        if 'Item' not in response:
+def _changed_notes(user_id, since, skip):
+    #formatted notes changed after since, except the note_ids in skip
+    changed = {}
+    query_kwargs = {'KeyConditionExpression': Key('user_id').eq(user_id) & Key('change_key').gt(since)}
+    while True:
+        page = changes_table.query(**query_kwargs)
+        for item in page['Items']:
+            if item['note_id'] not in skip:
+                changed[item['note_id']] = item.get('created_at')
+        if 'LastEvaluatedKey' not in page:
+            break
+        query_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+    notes = []
+    for note_id, created_at in changed.items():
+        item = load_note(note_id, user_id, created_at)
+        if item and not is_expired(item):
+            notes.append(format_note(item))
+    return notes
+
+def was_deleted(user_id, note_id):
+    #True if the user deleted note_id (within TOMBSTONE_RETENTION_DAYS); deletes are rare, read them all
+    query_kwargs = {'KeyConditionExpression': Key('user_id').eq(user_id),
+                    'FilterExpression': Attr('note_id').eq(note_id)}
+    while True:
+        page = tombstones_table.query(**query_kwargs)
+        if page['Items']:
+            return True
+        if 'LastEvaluatedKey' not in page:
+            return False
+        query_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+    
+def get_note_by_id(note_id, user_id, created_at=None):
+    try: 
+        #Security check: load_note only returns notes this user owns
+        note = load_note(note_id, user_id, created_at)
+        if note is None:
             return None 
-        
-        note = response['Item']
 
-        #Security check: ensure user owns this note
-        if note['user_id'] != user_id:
-            return None #user doesnt own this note
+        if is_expired(note):
+            return None
+
+        reclean_queue.enqueue_outdated([note])
+        return note
         
     except Exception as e: 
         print(f"Failed to get note {note_id}: {str(e)}")
         return None 
     
-def delete_user_note(note_id, user_id):
-    try: 
-        #First verify the user owns this note
-        note = get_note_by_id('note_id', user_id)
-        if not note:
-            return False #Note: doesnt exist or user doesnt own it
-        
-        #delete the note
-        notes_table.delete_item(Key={'note_id': note_id})
-        return True
-        
+def _single_table_note(note_id, user_id, created_at=None):
+    #(table, key) while only one table is written to, key None if the note isnt the user's
+    if NOTES_TABLE_PHASE == 'legacy':
+        return notes_table, {'note_id': note_id}
+    return notes_v2_table, find_v2_note_key(note_id, user_id, created_at)
+
+def delete_user_note(note_id, user_id, created_at=None):
+    try:
+        if NOTES_TABLE_PHASE in ('legacy', 'v2'):
+            #ownership is checked by DynamoDB inside the delete - one round trip, no race
+            table, key = _single_table_note(note_id, user_id, created_at)
+            if not key:
+                return False
+            table.delete_item(
+                Key=key,
+                ConditionExpression='user_id = :uid',
+                ExpressionAttributeValues={':uid': user_id}
+            )
+        else:
+            #mid-migration: read the note for its keys, then delete both copies in one transaction
+            note = load_note(note_id, user_id, created_at)
+            if not note:
+                return False
+            if not run_note_writes(note_write_actions(note, None, 'user_id = :uid', {':uid': user_id})):
+                return False
+    except notes_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False #Note doesnt exist or user doesnt own it
     except Exception as e:
         print(f"Failed to delete note {note_id}: {str(e)}")
-        return True
+        raise Exception("Failed to delete note")
+
+    #derived state - the note itself is gone either way
+    try:
+        record_tombstone(user_id, note_id)
+        bump_user_version(user_id)
+    except Exception as e:
+        print(f"Failed to update derived state for deleted note {note_id}: {str(e)}")
+    return True
+
+def update_user_note(note_id, user_id, cleaned_note, created_at=None):
+    #edit the cleaned text; same single round trip ownership check as delete
+    now = datetime.utcnow().isoformat()
+    try:
+        if NOTES_TABLE_PHASE in ('legacy', 'v2'):
+            table, key = _single_table_note(note_id, user_id, created_at)
+            if not key:
+                return None
+            response = table.update_item(
+                Key=key,
+                UpdateExpression='SET cleaned_note = :text, cleaned_length = :len, edited_at = :now',
+                ConditionExpression='user_id = :uid',
+                ExpressionAttributeValues={
+                    ':text': cleaned_note,
+                    ':len': len(cleaned_note),
+                    ':now': now,
+                    ':uid': user_id
+                },
+                ReturnValues='ALL_OLD'
+            )
+            old = response['Attributes']
+        else:
+            #mid-migration: both copies are replaced in one transaction, retried if a
+            #re-clean changed the note between the read and the write
+            for attempt in range(3):
+                old = load_note(note_id, user_id, created_at)
+                if not old:
+                    return None
+                new = dict(old, cleaned_note=cleaned_note, cleaned_length=len(cleaned_note), edited_at=now)
+                if run_note_writes(note_write_actions(old, new, 'cleaned_note = :old', {':old': old['cleaned_note']})):
+                    break
+            else:
+                raise Exception("Note kept changing during the update")
+    except notes_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None #Note doesnt exist or user doesnt own it
+    except Exception as e:
+        print(f"Failed to update note {note_id}: {str(e)}")
+        raise Exception("Failed to update note")
+
+    sync_cleaned_note_change(user_id, note_id, old.get('created_at'))
+
+    updated = dict(old, cleaned_note=cleaned_note, cleaned_length=len(cleaned_note), edited_at=now)
+    return dict(format_note(updated), edited_at=now)
         
 def get_user_stats(user_id):
     try:
 
          #Get all notes for user (for counting)
-        response = notes_table.query(
-            IndexName='user-notes-index',
-            KeyConditionExpression=Key('user_id').eq(user_id)
-        )
+        response = query_user_notes(user_id)
 
         notes = response['Items']
 
@@ -0,0 +1,68 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+
+#Request-scoped deadlines. lambda_handler builds one from the Lambda
+#context's remaining time, keeping RESPONSE_RESERVE_SECONDS back to build
+#the response, and hands it down; downstream calls run with whatever budget
+#is left instead of running into the function timeout (which API Gateway
+#turns into a bare 502/504 instead of our JSON error_response).
+#A call that runs out of budget is abandoned, not cancelled - its thread
+#finishes in the background.
+
+DEFAULT_BUDGET_MS = int(os.environ.get("REQUEST_BUDGET_MS", "29000")) #no Lambda context (local/container)
+RESPONSE_RESERVE_SECONDS = 0.5
+SAVE_RESERVE_SECONDS = 1.5      #kept back from the agent call so the note can still be saved
+MIN_CALL_SECONDS = 0.05
+
+#threads running calls under a deadline (plus abandoned ones still finishing);
+#a long-lived server sizes this to its handler workers (asgi_app.py)
+DEADLINE_WORKERS = int(os.environ.get("DEADLINE_WORKERS", "64"))
+_executor = ThreadPoolExecutor(max_workers=DEADLINE_WORKERS, thread_name_prefix='deadline')
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self.clock = clock
+        self.expires_at = clock() + seconds
+
+    @classmethod
+    def from_context(cls, context, reserve=RESPONSE_RESERVE_SECONDS):
+        remaining = getattr(context, 'get_remaining_time_in_millis', None)
+        remaining_ms = remaining() if callable(remaining) else DEFAULT_BUDGET_MS
+        return cls(remaining_ms / 1000 - reserve)
+
+    def remaining(self):
+        return max(self.expires_at - self.clock(), 0.0)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, what="request"):
+        if self.expired():
+            raise DeadlineExceeded(f"No time left for {what}")
+
+    def reserve(self, seconds):
+        #a deadline `seconds` earlier, leaving room for work after the call
+        child = Deadline(0, self.clock)
+        child.expires_at = self.expires_at - seconds
+        return child
+
+
+def call_with_deadline(deadline, fn, *args, **kwargs):
+    #fn(*args, **kwargs), raising DeadlineExceeded once the deadline passes; no deadline runs it inline
+    if deadline is None:
+        return fn(*args, **kwargs)
+    timeout = deadline.remaining()
+    if timeout < MIN_CALL_SECONDS:
+        raise DeadlineExceeded(f"No time left for {getattr(fn, '__name__', 'call')}")
+    future = _executor.submit(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=timeout)
+    except FuturesTimeout:
+        raise DeadlineExceeded(f"{getattr(fn, '__name__', 'call')} did not finish within {timeout:.2f}s")
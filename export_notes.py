@@ -0,0 +1,218 @@
+import argparse
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+import db_client
+import json_codec
+from checkpoints import load_checkpoint, save_checkpoint
+
+#Streaming export of all of a user's notes as gzip-compressed NDJSON.
+#Pages through the user's notes while the next page is prefetched, writes
+#each page as its own gzip member (concatenated members are a valid .gz
+#file) and checkpoints the query cursor once the sink has made the page
+#durable, so an interrupted export resumes without duplicates.
+#
+#Usage:
+#  python export_notes.py USER_ID --out notes.ndjson.gz --checkpoint export.ckpt
+#  python export_notes.py USER_ID --bucket exports --key user.ndjson.gz --checkpoint export.ckpt
+
+PAGE_SIZE = 500
+COMPRESS_LEVEL = 6
+
+
+class FileSink:
+    #local file; resuming truncates back to the last checkpointed offset
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def open(self, state=None):
+        offset = (state or {}).get('offset', 0)
+        if offset and os.path.exists(self.path):
+            self.file = open(self.path, 'r+b')
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        else:
+            self.file = open(self.path, 'wb')
+
+    def write(self, data):
+        self.file.write(data)
+
+    def commit(self):
+        #returns the state to checkpoint, or None if nothing is durable yet
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {'offset': self.file.tell()}
+
+    def close(self):
+        self.file.close()
+        return self.path
+
+
+class MultipartUploadSink:
+    #S3-style multipart upload. Works with a boto3 s3 client or LocalObjectStore.
+    #Memory is bounded by part_size plus one page. S3 needs parts >= 5MB (except the last).
+
+    def __init__(self, client, bucket, key, part_size=8 * 1024 * 1024):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.upload_id = None
+        self.parts = []
+        self.buffer = bytearray()
+
+    def open(self, state=None):
+        if state:
+            self.upload_id = state['upload_id']
+            self.parts = state['parts']
+        else:
+            response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)
+            self.upload_id = response['UploadId']
+
+    def write(self, data):
+        self.buffer += data
+
+    def _upload_buffer(self):
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=bytes(self.buffer)
+        )
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+        self.buffer = bytearray()
+
+    def commit(self):
+        #only whole parts are durable - smaller buffers wait for the next page
+        if len(self.buffer) < self.part_size:
+            return None
+        self._upload_buffer()
+        return {'upload_id': self.upload_id, 'parts': list(self.parts)}
+
+    def close(self):
+        if self.buffer or not self.parts:
+            self._upload_buffer()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+        return f"{self.bucket}/{self.key}"
+
+
+class LocalObjectStore:
+    #object-store stand-in for development: parts are files in a directory,
+    #completing an upload concatenates them into bucket/key
+
+    def __init__(self, root):
+        self.root = root
+
+    def _upload_dir(self, upload_id):
+        return os.path.join(self.root, '.uploads', upload_id)
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = f"{int(time.time() * 1000)}-{os.getpid()}"
+        os.makedirs(self._upload_dir(upload_id), exist_ok=True)
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with open(os.path.join(self._upload_dir(UploadId), f"{PartNumber:05d}"), 'wb') as f:
+            f.write(Body)
+        return {'ETag': f'"{zlib.crc32(Body):08x}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        target = os.path.join(self.root, Bucket, Key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        upload_dir = self._upload_dir(UploadId)
+        with open(target, 'wb') as out:
+            for part in MultipartUpload['Parts']:
+                part_path = os.path.join(upload_dir, f"{part['PartNumber']:05d}")
+                with open(part_path, 'rb') as f:
+                    out.write(f.read())
+                os.remove(part_path)
+        os.rmdir(upload_dir)
+        return {'Location': target}
+
+
+def fetch_page(user_id, cursor, page_size=PAGE_SIZE):
+    query_kwargs = {'Limit': page_size}
+    if cursor:
+        query_kwargs['ExclusiveStartKey'] = cursor
+    response = db_client.query_user_notes(user_id, **query_kwargs)
+    return response['Items'], response.get('LastEvaluatedKey')
+
+
+def export_user_notes(user_id, sink, checkpoint_path=None, page_size=PAGE_SIZE, progress=None):
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint and checkpoint['user_id'] != user_id:
+        raise ValueError("Checkpoint belongs to a different user")
+    if checkpoint and checkpoint.get('done'):
+        return checkpoint
+
+    cursor = checkpoint['cursor'] if checkpoint else None
+    exported = checkpoint['exported'] if checkpoint else 0
+    sink.open(checkpoint['sink_state'] if checkpoint else None)
+
+    start = time.time()
+    written = 0
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        next_page = prefetcher.submit(fetch_page, user_id, cursor, page_size)
+        while next_page is not None:
+            items, cursor = next_page.result()
+            #fetch the following page while this one is compressed and written
+            next_page = prefetcher.submit(fetch_page, user_id, cursor, page_size) if cursor else None
+
+            if items:
+                compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31) #31 = gzip container
+                for item in items:
+                    sink.write(compressor.compress((json_codec.dumps(item) + '\n').encode('utf-8')))
+                sink.write(compressor.flush())
+                exported += len(items)
+                written += len(items)
+
+            sink_state = sink.commit()
+            if checkpoint_path and sink_state is not None and cursor:
+                save_checkpoint(checkpoint_path, {
+                    'user_id': user_id, 'cursor': cursor, 'exported': exported,
+                    'sink_state': sink_state, 'done': False
+                })
+            if progress:
+                elapsed = max(time.time() - start, 1e-6)
+                progress(f"\rExported {exported} notes ({written / elapsed:.0f} notes/s)")
+
+    location = sink.close()
+    result = {'user_id': user_id, 'exported': exported, 'location': location, 'done': True,
+              'seconds': round(time.time() - start, 3)}
+    if checkpoint_path:
+        save_checkpoint(checkpoint_path, result)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a user's notes as gzip-compressed NDJSON")
+    parser.add_argument('user_id')
+    parser.add_argument('--out', help="local output file")
+    parser.add_argument('--bucket', help="object store bucket (multipart upload)")
+    parser.add_argument('--key', help="object key inside the bucket")
+    parser.add_argument('--local-object-store', help="directory to use as a stand-in for S3")
+    parser.add_argument('--checkpoint', help="checkpoint file for resuming")
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    args = parser.parse_args()
+
+    if args.out:
+        sink = FileSink(args.out)
+    elif args.bucket and args.key:
+        client = LocalObjectStore(args.local_object_store) if args.local_object_store else boto3.client('s3')
+        sink = MultipartUploadSink(client, args.bucket, args.key)
+    else:
+        parser.error("either --out or --bucket and --key are required")
+
+    result = export_user_notes(args.user_id, sink, args.checkpoint, args.page_size,
+                               progress=lambda line: print(line, end='', flush=True))
+    print(f"\nExport complete: {result['exported']} notes -> {result['location']}")
+
+
+if __name__ == "__main__":
+    main()
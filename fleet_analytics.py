@@ -0,0 +1,261 @@
+import argparse
+import functools
+import gzip
+import math
+import time
+import numpy as np
+import json_codec
+from parallel_scan import parallel_scan, table_by_name
+
+#Capacity planning report over note metadata. Notes are loaded into
+#columnar NumPy arrays - from a parallel scan of the notes table, from
+#export_notes.py files, or from a saved .npz - and every statistic is
+#computed on whole columns, so the report itself takes seconds on tens of
+#millions of rows. The sizing section feeds Lambda memory and reserved
+#concurrency settings.
+#
+#Usage:
+#  python fleet_analytics.py --table medical-notes --segments 16 --save columns.npz
+#  python fleet_analytics.py --columns columns.npz --json report.json
+#  python fleet_analytics.py --export user1.ndjson.gz user2.ndjson.gz
+
+PERCENTILES = (50, 90, 95, 99, 99.9)
+COLUMNS = ('user_id', 'created_at', 'original_length', 'cleaned_length', 'proccessing_time_ms')
+EXPORT_CHUNK = 50000
+CONCURRENCY_HEADROOM = 1.5
+MAX_SECOND_BINS = 400 * 86400    #per-second counts via bincount up to ~400 days of data
+
+
+class ColumnBuilder:
+    #accumulates pages of items as NumPy chunks; user ids become int32 codes
+
+    def __init__(self):
+        self.users = {}
+        self.chunks = {'user': [], 'created': [], 'original_length': [], 'cleaned_length': [], 'latency_ms': []}
+
+    def add_items(self, items):
+        if not items:
+            return self
+        codes = self.users
+        self.chunks['user'].append(np.fromiter((codes.setdefault(item['user_id'], len(codes)) for item in items),
+                                               dtype=np.int32, count=len(items)))
+        #ISO strings are parsed in C; created_at is UTC without an offset
+        created = np.array([item['created_at'] for item in items], dtype='datetime64[us]')
+        self.chunks['created'].append(created.astype('datetime64[s]').astype(np.int64))
+        self.chunks['original_length'].append(np.array([int(item.get('original_length', 0)) for item in items], dtype=np.int32))
+        self.chunks['cleaned_length'].append(np.array([int(item.get('cleaned_length', 0)) for item in items], dtype=np.int32))
+        latency = np.array([float(item.get('proccessing_time_ms', 0)) for item in items], dtype=np.float32)
+        latency[latency <= 0] = np.nan #notes saved before latency was recorded
+        self.chunks['latency_ms'].append(latency)
+        return self
+
+    def merge(self, other):
+        #other's user codes are remapped onto ours
+        remap = np.empty(len(other.users), dtype=np.int32)
+        for user_id, code in other.users.items():
+            remap[code] = self.users.setdefault(user_id, len(self.users))
+        for name, chunks in other.chunks.items():
+            self.chunks[name].extend(remap[chunk] if name == 'user' else chunk for chunk in chunks)
+        return self
+
+    def columns(self):
+        columns = {name: np.concatenate(chunks) if chunks else np.empty(0, dtype=np.float32 if name == 'latency_ms' else np.int64)
+                   for name, chunks in self.chunks.items()}
+        users = [None] * len(self.users)
+        for user_id, code in self.users.items():
+            users[code] = user_id
+        columns['users'] = np.array(users, dtype=str)
+        return columns
+
+
+def _add_page(builder, items):
+    return builder.add_items(items)
+
+
+def _merge_builders(a, b):
+    return a.merge(b)
+
+
+def load_from_table(table_name, segments=8, processes=False, progress=None):
+    started = time.time()
+    scan = parallel_scan(functools.partial(table_by_name, table_name), segments,
+                         projection=list(COLUMNS), reducer=_add_page, initial=ColumnBuilder(),
+                         combine=_merge_builders, processes=processes)
+    if progress:
+        progress(f"Loaded {scan['count']} notes from {table_name} in {time.time() - started:.1f}s\n")
+    return scan['result'].columns()
+
+
+def load_from_exports(paths):
+    #gzip NDJSON written by export_notes.py (concatenated gzip members read as one stream)
+    builder = ColumnBuilder()
+    for path in paths:
+        with gzip.open(path, 'rb') as f:
+            batch = []
+            for line in f:
+                batch.append(json_codec.loads(line))
+                if len(batch) == EXPORT_CHUNK:
+                    builder.add_items(batch)
+                    batch = []
+            builder.add_items(batch)
+    return builder.columns()
+
+
+def save_columns(path, columns):
+    np.savez(path, **columns)
+
+
+def load_columns(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def percentiles(values):
+    values = values[~np.isnan(values)] if values.dtype.kind == 'f' else values
+    if not len(values):
+        return None
+    points = np.percentile(values, PERCENTILES)
+    summary = {f"p{p:g}": round(float(v), 2) for p, v in zip(PERCENTILES, points)}
+    summary.update(mean=round(float(values.mean()), 2), max=round(float(values.max()), 2), count=int(len(values)))
+    return summary
+
+
+def run_lengths(keys):
+    #(distinct keys, how often each occurs) - sorting beats np.unique's hashing on int64 keys
+    keys = np.sort(keys)
+    starts = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+    return keys[starts], np.diff(np.append(starts, len(keys)))
+
+
+def log2_histogram(values):
+    #bucket upper bounds are powers of two: {"<=256": n, "<=512": n, ...}
+    values = values[values > 0]
+    if not len(values):
+        return {}
+    top = int(math.ceil(math.log2(values.max()))) + 1
+    counts, edges = np.histogram(values, bins=np.concatenate(([0], 2.0 ** np.arange(top + 1))))
+    return {f"<={int(edge)}": int(count) for edge, count in zip(edges[1:], counts) if count}
+
+
+def build_report(columns):
+    created = columns['created']
+    original = columns['original_length'].astype(np.float64)
+    cleaned = columns['cleaned_length'].astype(np.float64)
+    latency = columns['latency_ms']
+    report = {'notes': int(len(created)), 'users': int(len(columns['users']))}
+    if not len(created):
+        return report
+
+    has_original = original > 0
+    ratio = cleaned[has_original] / original[has_original]
+    report['first_note'] = str(np.datetime64(int(created.min()), 's'))
+    report['last_note'] = str(np.datetime64(int(created.max()), 's'))
+    report['original_length'] = percentiles(columns['original_length'])
+    report['cleaned_length'] = percentiles(columns['cleaned_length'])
+    report['expansion_ratio'] = percentiles(ratio)
+    report['agent_latency_ms'] = percentiles(latency)
+    ratio_counts, ratio_edges = np.histogram(np.minimum(ratio, 5.0), bins=np.arange(0, 5.01, 0.5)) #5 = 5 or more
+    report['histograms'] = {
+        'original_length': log2_histogram(original),
+        'cleaned_length': log2_histogram(cleaned),
+        'expansion_ratio': {f"<={edge:g}": int(count) for edge, count in zip(ratio_edges[1:], ratio_counts)}
+    }
+
+    #notes per user per day: one combined (user, day) key, sorted once
+    day_index = created // 86400 - created.min() // 86400
+    days = int(day_index.max()) + 1
+    user_days, per_user_day = run_lengths(columns['user'].astype(np.int64) * days + day_index)
+    report['notes_per_user_per_day'] = percentiles(per_user_day)
+    daily_notes = np.bincount(day_index, minlength=days)
+    active_per_day = np.bincount(user_days % days, minlength=days)
+    report['daily'] = {
+        'notes': percentiles(daily_notes),
+        'active_users': percentiles(active_per_day)
+    }
+
+    #arrival rates for concurrency: busiest hour, minute and second
+    offset = created - created.min()
+    hourly = np.bincount(offset // 3600)
+    hour_of_day = np.bincount((created // 3600) % 24, minlength=24)
+    per_minute = np.bincount(offset // 60)
+    per_second = np.bincount(offset) if offset.max() < MAX_SECOND_BINS else run_lengths(created)[1]
+    report['rollups'] = {
+        'peak_hour_notes': int(hourly.max()),
+        'peak_minute_notes': int(per_minute.max()),
+        'peak_second_notes': int(per_second.max()),
+        'notes_by_hour_of_day_utc': [int(count) for count in hour_of_day]
+    }
+    report['sizing'] = sizing(report, original, cleaned)
+    return report
+
+
+def sizing(report, original, cleaned):
+    #arrival rate x duration = requests in flight (Little's law)
+    sizing = {}
+    latency = report.get('agent_latency_ms')
+    if latency:
+        peak_rate = report['rollups']['peak_minute_notes'] / 60.0
+        sizing['concurrency_at_peak_minute_p99'] = round(peak_rate * latency['p99'] / 1000.0, 2)
+        sizing['suggested_reserved_concurrency'] = max(1, int(math.ceil(
+            report['rollups']['peak_second_notes'] * latency['p99'] / 1000.0 * CONCURRENCY_HEADROOM)))
+    #a request holds the original, the cleaned text and their JSON copies; UTF-8 is up to 4 bytes/char
+    request_chars = original + cleaned
+    sizing['p99_request_chars'] = int(np.percentile(request_chars, 99))
+    sizing['max_request_kb_utf8_worst_case'] = round(float(request_chars.max()) * 4 * 2 / 1024, 1)
+    return sizing
+
+
+def format_report(report):
+    lines = [f"Notes: {report['notes']}  users: {report['users']}"]
+    if not report['notes']:
+        return '\n'.join(lines)
+    lines.append(f"Range: {report['first_note']} .. {report['last_note']}")
+    for name in ('original_length', 'cleaned_length', 'expansion_ratio', 'agent_latency_ms', 'notes_per_user_per_day'):
+        stats = report[name]
+        if stats is None:
+            lines.append(f"{name}: no data")
+            continue
+        lines.append(f"{name}: " + '  '.join(f"{key} {value:g}" for key, value in stats.items()))
+    lines.append(f"daily notes: p50 {report['daily']['notes']['p50']:g} max {report['daily']['notes']['max']:g}  "
+                 f"daily active users: p50 {report['daily']['active_users']['p50']:g} max {report['daily']['active_users']['max']:g}")
+    rollups = report['rollups']
+    lines.append(f"peaks: {rollups['peak_hour_notes']}/hour {rollups['peak_minute_notes']}/minute "
+                 f"{rollups['peak_second_notes']}/second")
+    lines.append("original length histogram: " + '  '.join(f"{k}: {v}" for k, v in report['histograms']['original_length'].items()))
+    lines.append("sizing: " + '  '.join(f"{k} {v}" for k, v in report['sizing'].items()))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capacity planning report over note metadata")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--table', help="scan this notes table")
+    source.add_argument('--export', nargs='+', help="export_notes.py output files")
+    source.add_argument('--columns', help=".npz saved by an earlier run")
+    parser.add_argument('--segments', type=int, default=8)
+    parser.add_argument('--processes', action='store_true', help="scan segments in worker processes")
+    parser.add_argument('--save', help="save the loaded columns to this .npz")
+    parser.add_argument('--json', help="also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    progress = lambda line: print(line, end='', flush=True)
+    if args.table:
+        columns = load_from_table(args.table, args.segments, args.processes, progress)
+    elif args.export:
+        columns = load_from_exports(args.export)
+    else:
+        columns = load_columns(args.columns)
+    if args.save:
+        save_columns(args.save, columns)
+
+    started = time.time()
+    report = build_report(columns)
+    print(format_report(report))
+    print(f"(report computed in {time.time() - started:.2f}s)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(json_codec.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+#Hedged agent calls. If the first chunk of a call has not arrived after the
+#recent p95 time-to-first-chunk, a second call is started and whichever
+#finishes first wins; the other stream is closed. Every call earns `budget`
+#hedge credits (capped at MAX_CREDITS) and a hedge spends one, so hedges
+#add at most `budget` (e.g. 5%) extra calls even when the agent is slow
+#across the board. Until MIN_SAMPLES first-chunk times have been seen
+#nothing is hedged.
+
+QUANTILE = 0.95
+MIN_SAMPLES = 20
+SAMPLE_WINDOW = 500
+MIN_DELAY_SECONDS = 0.05
+MAX_CREDITS = 5
+
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='hedge')
+
+
+class _Attempt:
+
+    def __init__(self):
+        self.first_chunk = threading.Event() #also set when the attempt ends without one
+        self.stream = None
+        self.cancelled = False
+
+
+class Hedger:
+
+    def __init__(self, budget=0.05, quantile=QUANTILE, min_samples=MIN_SAMPLES, min_delay=MIN_DELAY_SECONDS):
+        self.budget = budget
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._samples = deque(maxlen=SAMPLE_WINDOW)
+        self._credits = 0.0
+        self._lock = threading.Lock()
+        self.metrics = {'calls': 0, 'hedges': 0, 'hedge_wins': 0, 'cancelled': 0}
+
+    def delay(self):
+        #seconds to wait for a first chunk before hedging, None while there are too few samples
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        return max(samples[min(int(len(samples) * self.quantile), len(samples) - 1)], self.min_delay)
+
+    def _spend_credit(self):
+        with self._lock:
+            if self._credits < 1:
+                return False
+            self._credits -= 1
+            self.metrics['hedges'] += 1
+            return True
+
+    def _run(self, start, attempt, primary):
+        #start() -> invoke_agent response; returns the raw bytes of its completion stream
+        started = time.monotonic()
+        try:
+            response = start()
+            attempt.stream = response['completion']
+            if attempt.cancelled:
+                _close(attempt.stream)
+                raise Exception("Hedged call cancelled")
+            raw = b""
+            for event in attempt.stream:
+                if not attempt.first_chunk.is_set():
+                    if primary:
+                        with self._lock:
+                            self._samples.append(time.monotonic() - started)
+                    attempt.first_chunk.set()
+                if "chunk" in event and "bytes" in event["chunk"]:
+                    raw += event["chunk"]["bytes"]
+            if attempt.cancelled:
+                raise Exception("Hedged call cancelled")
+            return raw
+        finally:
+            attempt.first_chunk.set()
+
+    def call(self, start):
+        #raw completion bytes of start() or of a hedged second start(), whichever finishes first
+        with self._lock:
+            self.metrics['calls'] += 1
+            self._credits = min(self._credits + self.budget, MAX_CREDITS)
+        delay = self.delay()
+        primary = _Attempt()
+        attempts = {_executor.submit(self._run, start, primary, True): primary}
+        if delay is not None and not primary.first_chunk.wait(delay) and self._spend_credit():
+            hedge = _Attempt()
+            attempts[_executor.submit(self._run, start, hedge, False)] = hedge
+
+        pending, error = set(attempts), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self._cancel(attempts, pending)
+                    if attempts[future] is not primary:
+                        with self._lock:
+                            self.metrics['hedge_wins'] += 1
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _cancel(self, attempts, pending):
+        for future in pending:
+            attempt = attempts[future]
+            attempt.cancelled = True
+            if attempt.stream is not None:
+                _close(attempt.stream)
+            with self._lock:
+                self.metrics['cancelled'] += 1
+
+
+def _close(stream):
+    close = getattr(stream, 'close', None)
+    if close:
+        try:
+            close()
+        except Exception:
+            pass
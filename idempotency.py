@@ -0,0 +1,173 @@
+import hashlib
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+import boto3
+import json_codec
+
+#Idempotency-Key support for POST /process-note. The first request with a key
+#claims a record (user_id#key) and, once it has answered, stores its response
+#there for TTL_SECONDS - without the note text, which the caller reads back
+#from the notes table. A retry with the same key gets that response back
+#without calling the agent; a retry that arrives while the first request is
+#still running polls the record until it is done. The record also fixes the
+#note_id and created_at the note is saved under - its full key - so a request
+#that takes over from a crashed one (once its lease expires) saves that note
+#only if the crashed one didnt, instead of adding another.
+
+TTL_SECONDS = 24 * 3600
+LEASE_SECONDS = 35      #longer than a request can run
+POLL_SECONDS = 0.2
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    #the key was already used for a different request
+    pass
+
+
+def fingerprint(note):
+    return hashlib.sha256(note.encode('utf-8')).hexdigest()
+
+
+class DynamoIdempotencyStore:
+    #records: record_key, owner, fingerprint, status (running|done), note_id, created_at, response,
+    #lease_expires_at, expires_at (TTL)
+
+    def __init__(self, table_name):
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    def acquire(self, record):
+        client = self.table.meta.client
+        try:
+            #TTL deletes lag behind, an expired record counts as gone
+            self.table.put_item(Item=record, ConditionExpression='attribute_not_exists(record_key) OR expires_at < :now',
+                                ExpressionAttributeValues={':now': record['lease_expires_at'] - LEASE_SECONDS})
+            return True
+        except client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def take_over(self, key, old_owner, owner, now):
+        client = self.table.meta.client
+        try:
+            self.table.update_item(
+                Key={'record_key': key},
+                UpdateExpression='SET #owner = :owner, lease_expires_at = :lease',
+                ConditionExpression='#owner = :old_owner AND #status = :running AND lease_expires_at < :now',
+                ExpressionAttributeNames={'#owner': 'owner', '#status': 'status'},
+                ExpressionAttributeValues={':owner': owner, ':old_owner': old_owner, ':running': 'running',
+                                           ':lease': now + LEASE_SECONDS, ':now': now}
+            )
+            return True
+        except client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def complete(self, key, owner, response, now):
+        client = self.table.meta.client
+        try:
+            self.table.update_item(
+                Key={'record_key': key},
+                UpdateExpression='SET #status = :done, #response = :response, expires_at = :expires_at',
+                ConditionExpression='#owner = :owner',
+                ExpressionAttributeNames={'#status': 'status', '#response': 'response', '#owner': 'owner'},
+                ExpressionAttributeValues={':done': 'done', ':response': response, ':owner': owner,
+                                           ':expires_at': now + TTL_SECONDS}
+            )
+        except client.exceptions.ConditionalCheckFailedException:
+            pass #our lease expired and another request took over
+
+    def release(self, key, owner):
+        client = self.table.meta.client
+        try:
+            self.table.delete_item(Key={'record_key': key}, ConditionExpression='#owner = :owner',
+                                   ExpressionAttributeNames={'#owner': 'owner'},
+                                   ExpressionAttributeValues={':owner': owner})
+        except client.exceptions.ConditionalCheckFailedException:
+            pass
+
+    def read(self, key):
+        return self.table.get_item(Key={'record_key': key}, ConsistentRead=True).get('Item')
+
+
+class LocalIdempotencyStore:
+    #in-memory stand-in: one container's view, for local runs and tests
+
+    def __init__(self):
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, record):
+        with self._lock:
+            item = self.items.get(record['record_key'])
+            if item and item['expires_at'] >= time.time():
+                return False
+            self.items[record['record_key']] = dict(record)
+            return True
+
+    def take_over(self, key, old_owner, owner, now):
+        with self._lock:
+            item = self.items.get(key)
+            if item and item['owner'] == old_owner and item['status'] == 'running' and item['lease_expires_at'] < now:
+                item.update({'owner': owner, 'lease_expires_at': now + LEASE_SECONDS})
+                return True
+            return False
+
+    def complete(self, key, owner, response, now):
+        with self._lock:
+            item = self.items.get(key)
+            if item and item['owner'] == owner:
+                item.update({'status': 'done', 'response': response, 'expires_at': now + TTL_SECONDS})
+
+    def release(self, key, owner):
+        with self._lock:
+            if self.items.get(key, {}).get('owner') == owner:
+                del self.items[key]
+
+    def read(self, key):
+        with self._lock:
+            item = self.items.get(key)
+            return dict(item) if item and item['expires_at'] >= time.time() else None
+
+
+def claim(store, user_id, key, note_fingerprint, deadline=None, clock=time.time, sleep=time.sleep):
+    #('run', record) when this request does the work, ('replay', response) when an earlier one did
+    record_key = f"{user_id}#{key}"
+    owner = uuid.uuid4().hex
+    while True:
+        now = int(clock())
+        record = {
+            'record_key': record_key,
+            'owner': owner,
+            'fingerprint': note_fingerprint,
+            'status': 'running',
+            'note_id': str(uuid.uuid4()),
+            'created_at': datetime.fromtimestamp(clock(), timezone.utc).replace(tzinfo=None).isoformat(),
+            'lease_expires_at': now + LEASE_SECONDS,
+            'expires_at': now + TTL_SECONDS
+        }
+        if store.acquire(record):
+            return 'run', record
+
+        existing = store.read(record_key)
+        if existing is None:
+            continue #expired or released in between
+        if existing['fingerprint'] != note_fingerprint:
+            raise IdempotencyConflict("Idempotency-Key was already used for a different note")
+        if existing['status'] == 'done':
+            return 'replay', json_codec.loads(existing['response'])
+        if existing['lease_expires_at'] < now and store.take_over(record_key, existing['owner'], owner, now):
+            #the earlier request died - finish its work under the same note_id, which it may have saved
+            return 'run', dict(existing, owner=owner, lease_expires_at=now + LEASE_SECONDS, resumed=True)
+        if deadline:
+            deadline.check("earlier request with the same Idempotency-Key")
+        sleep(POLL_SECONDS)
+
+
+def complete(store, record, response, clock=time.time):
+    store.complete(record['record_key'], record['owner'], json_codec.dumps(response), int(clock()))
+
+
+def release(store, record):
+    #the request failed - let a retry run it again
+    store.release(record['record_key'], record['owner'])
@@ -58,6 +58,10 @@ resource "aws_dynamodb_table" "notes" {
   billing_mode   = "PAY_PER_REQUEST"
   hash_key       = "note_id"
   
+  # change stream for usage rollups (usage_rollups.py) and the search index (search_index.py)
+  stream_enabled   = true
+  stream_view_type = "NEW_AND_OLD_IMAGES"
+  
   attribute {
     name = "note_id"
     type = "S"
@@ -68,9 +72,267 @@ resource "aws_dynamodb_table" "notes" {
     type = "S"
   }
   
+  attribute {
+    name = "created_at"
+    type = "S"
+  }
+  
+  attribute {
+    name = "pending_status"
+    type = "S"
+  }
+  
+  attribute {
+    name = "retry_at"
+    type = "S"
+  }
+  
+  global_secondary_index {
+    name            = "user-notes-index"
+    hash_key        = "user_id"
+    range_key       = "created_at"
+    projection_type = "ALL"
+  }
+  
+  # sparse - only notes whose cleaning is not final carry pending_status (status_sweeper.py)
   global_secondary_index {
-    name     = "user-notes-index"
-    hash_key = "user_id"
+    name            = "pending-status-index"
+    hash_key        = "pending_status"
+    range_key       = "retry_at"
+    projection_type = "ALL"
+  }
+  
+  # retention - notes are deleted once expires_at (epoch seconds) has passed
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+  
+  tags = local.common_tags
+}
+
+# Notes keyed by owner: user_id + note_key (created_at#note_id).
+# Replaces the notes table - see NOTES_TABLE_PHASE and migrate_notes.py
+resource "aws_dynamodb_table" "notes_v2" {
+  name           = "${var.project_name}-notes-v2"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "user_id"
+  range_key      = "note_key"
+  
+  # change stream for usage rollups and the search index once this table is the source of truth
+  stream_enabled   = true
+  stream_view_type = "NEW_AND_OLD_IMAGES"
+  
+  attribute {
+    name = "user_id"
+    type = "S"
+  }
+  
+  attribute {
+    name = "note_key"
+    type = "S"
+  }
+  
+  attribute {
+    name = "note_id"
+    type = "S"
+  }
+  
+  attribute {
+    name = "pending_status"
+    type = "S"
+  }
+  
+  attribute {
+    name = "retry_at"
+    type = "S"
+  }
+  
+  # only to find a note's key from its id - user reads go to the base table
+  global_secondary_index {
+    name            = "note-id-index"
+    hash_key        = "note_id"
+    projection_type = "KEYS_ONLY"
+  }
+  
+  # sparse - only notes whose cleaning is not final carry pending_status (status_sweeper.py)
+  global_secondary_index {
+    name            = "pending-status-index"
+    hash_key        = "pending_status"
+    range_key       = "retry_at"
+    projection_type = "ALL"
+  }
+  
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+  
+  tags = local.common_tags
+}
+
+# DynamoDB table for per-user note versions (history ETags)
+resource "aws_dynamodb_table" "note_versions" {
+  name           = "${var.project_name}-note-versions"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "user_id"
+  
+  attribute {
+    name = "user_id"
+    type = "S"
+  }
+  
+  tags = local.common_tags
+}
+
+# DynamoDB table for deleted-note tombstones (history delta sync)
+resource "aws_dynamodb_table" "note_tombstones" {
+  name           = "${var.project_name}-note-tombstones"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "user_id"
+  range_key      = "tombstone_key"
+  
+  attribute {
+    name = "user_id"
+    type = "S"
+  }
+  
+  attribute {
+    name = "tombstone_key"
+    type = "S"
+  }
+  
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+  
+  tags = local.common_tags
+}
+
+# DynamoDB table for notes changed in place - edits, re-cleans (history delta sync)
+resource "aws_dynamodb_table" "note_changes" {
+  name           = "${var.project_name}-note-changes"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "user_id"
+  range_key      = "change_key"
+  
+  attribute {
+    name = "user_id"
+    type = "S"
+  }
+  
+  attribute {
+    name = "change_key"
+    type = "S"
+  }
+  
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+  
+  tags = local.common_tags
+}
+
+# DynamoDB table for the per-user full-text search index
+resource "aws_dynamodb_table" "note_search" {
+  name           = "${var.project_name}-note-search"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "user_id"
+  range_key      = "term"
+  
+  attribute {
+    name = "user_id"
+    type = "S"
+  }
+  
+  attribute {
+    name = "term"
+    type = "S"
+  }
+  
+  tags = local.common_tags
+}
+
+# Hourly and daily usage rollups per user and fleet-wide, from the notes change stream
+resource "aws_dynamodb_table" "note_usage" {
+  name           = "${var.project_name}-note-usage"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "scope"
+  range_key      = "bucket"
+  
+  attribute {
+    name = "scope"
+    type = "S"
+  }
+  
+  attribute {
+    name = "bucket"
+    type = "S"
+  }
+  
+  # hourly rollups and replay markers expire, daily rollups are kept
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+  
+  tags = local.common_tags
+}
+
+# Short-lived lock items that let containers share one agent call for identical notes
+resource "aws_dynamodb_table" "agent_flights" {
+  name           = "${var.project_name}-agent-flights"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "flight_key"
+  
+  attribute {
+    name = "flight_key"
+    type = "S"
+  }
+  
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+  
+  tags = local.common_tags
+}
+
+# Per-user and per-tenant request counters behind the rate limiter (throttle.py)
+resource "aws_dynamodb_table" "rate_limits" {
+  name           = "${var.project_name}-rate-limits"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "limit_key"
+  
+  attribute {
+    name = "limit_key"
+    type = "S"
+  }
+  
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+  
+  tags = local.common_tags
+}
+
+# Idempotency-Key records for POST /process-note: in-progress lease, then the stored response
+resource "aws_dynamodb_table" "idempotency" {
+  name           = "${var.project_name}-idempotency"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "record_key"
+  
+  attribute {
+    name = "record_key"
+    type = "S"
+  }
+  
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
   }
   
   tags = local.common_tags
@@ -103,6 +365,14 @@ resource "aws_lambda_function" "backend" {
     variables = {
       USERS_TABLE = aws_dynamodb_table.users.name
       NOTES_TABLE = aws_dynamodb_table.notes.name
+      NOTES_TABLE_PHASE = var.notes_table_phase
+      RECLEAN_QUEUE_URL = aws_sqs_queue.reclean.url
+      SINGLE_FLIGHT_TABLE = aws_dynamodb_table.agent_flights.name
+      RATE_LIMIT_TABLE = aws_dynamodb_table.rate_limits.name
+      IDEMPOTENCY_TABLE = aws_dynamodb_table.idempotency.name
+      RATE_LIMIT_TENANT_PLANS = var.rate_limit_tenant_plans
+      LOCAL_EXPANSION_DICT = var.local_expansion_dict
+      LOCAL_EXPANSION_MIN_CONFIDENCE = var.local_expansion_min_confidence
     }
   }
   
@@ -111,6 +381,163 @@ resource "aws_lambda_function" "backend" {
   tags = local.common_tags
 }
 
+# Queue of notes cleaned by an outdated agent version, filled on read
+resource "aws_sqs_queue" "reclean" {
+  name                       = "${var.project_name}-reclean"
+  visibility_timeout_seconds = 180
+  message_retention_seconds  = 86400
+  
+  tags = local.common_tags
+}
+
+# Worker that re-cleans queued notes (same image, different handler)
+resource "aws_lambda_function" "reclean_worker" {
+  package_type  = "Image"
+  function_name = "${var.project_name}-reclean-worker"
+  role         = aws_iam_role.lambda_role.arn
+  
+  image_uri = "${aws_ecr_repository.backend.repository_url}:latest"
+  
+  image_config {
+    command = ["reclean_queue.reclean_handler"]
+  }
+  
+  timeout = 60
+  memory_size = 512
+  
+  environment {
+    variables = {
+      NOTES_TABLE_PHASE = var.notes_table_phase
+    }
+  }
+  
+  # keep lazy re-cleaning from crowding out interactive agent calls
+  reserved_concurrent_executions = 2
+  
+  tags = local.common_tags
+}
+
+resource "aws_lambda_event_source_mapping" "reclean" {
+  event_source_arn        = aws_sqs_queue.reclean.arn
+  function_name           = aws_lambda_function.reclean_worker.arn
+  batch_size              = 5
+  function_response_types = ["ReportBatchItemFailures"]
+}
+
+# Stream consumer maintaining the usage rollups (same image, different handler)
+resource "aws_lambda_function" "usage_rollups" {
+  package_type  = "Image"
+  function_name = "${var.project_name}-usage-rollups"
+  role         = aws_iam_role.lambda_role.arn
+  
+  image_uri = "${aws_ecr_repository.backend.repository_url}:latest"
+  
+  image_config {
+    command = ["usage_rollups.usage_stream_handler"]
+  }
+  
+  timeout = 60
+  memory_size = 256
+  
+  tags = local.common_tags
+}
+
+# During dual writes both notes tables see every change - only one stream may feed the rollups.
+# Moving to phase v2 replaces this mapping with one on the v2 stream. It starts at LATEST: the
+# v2 stream's last 24h are notes the legacy stream already counted, TRIM_HORIZON would count
+# them twice. Apply the cutover at a quiet time - notes created between the old mapping's last
+# batch and the new mapping's first read are not counted.
+resource "aws_lambda_event_source_mapping" "usage_rollups" {
+  event_source_arn  = var.notes_table_phase == "v2" ? aws_dynamodb_table.notes_v2.stream_arn : aws_dynamodb_table.notes.stream_arn
+  function_name     = aws_lambda_function.usage_rollups.arn
+  starting_position = "LATEST"
+  batch_size        = 500
+  maximum_batching_window_in_seconds = 5
+  
+  # only note creations and deletions change usage
+  filter_criteria {
+    filter {
+      pattern = jsonencode({ eventName = ["INSERT", "REMOVE"] })
+    }
+  }
+}
+
+# Stream consumer maintaining the search index (same image, different handler)
+resource "aws_lambda_function" "search_indexer" {
+  package_type  = "Image"
+  function_name = "${var.project_name}-search-indexer"
+  role         = aws_iam_role.lambda_role.arn
+  
+  image_uri = "${aws_ecr_repository.backend.repository_url}:latest"
+  
+  image_config {
+    command = ["search_index.index_stream_handler"]
+  }
+  
+  timeout = 60
+  memory_size = 256
+  
+  tags = local.common_tags
+}
+
+# Fed by the same stream as the usage rollups. Index updates are idempotent and each shard is
+# applied in order, so the v2 mapping can start at TRIM_HORIZON: replaying the v2 stream's last
+# 24h converges on the same index and leaves no gap at the cutover.
+resource "aws_lambda_event_source_mapping" "search_index" {
+  event_source_arn  = var.notes_table_phase == "v2" ? aws_dynamodb_table.notes_v2.stream_arn : aws_dynamodb_table.notes.stream_arn
+  function_name     = aws_lambda_function.search_indexer.arn
+  starting_position = var.notes_table_phase == "v2" ? "TRIM_HORIZON" : "LATEST"
+  batch_size        = 100
+  maximum_batching_window_in_seconds = 1
+}
+
+# Retries or expires notes left pending/failed (same image, different handler)
+resource "aws_lambda_function" "status_sweeper" {
+  package_type  = "Image"
+  function_name = "${var.project_name}-status-sweeper"
+  role         = aws_iam_role.lambda_role.arn
+  
+  image_uri = "${aws_ecr_repository.backend.repository_url}:latest"
+  
+  image_config {
+    command = ["status_sweeper.status_sweeper_handler"]
+  }
+  
+  timeout = 120
+  memory_size = 256
+  
+  environment {
+    variables = {
+      NOTES_TABLE_PHASE = var.notes_table_phase
+    }
+  }
+  
+  # one sweep at a time
+  reserved_concurrent_executions = 1
+  
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_event_rule" "status_sweeper" {
+  name                = "${var.project_name}-status-sweeper"
+  schedule_expression = "rate(5 minutes)"
+  
+  tags = local.common_tags
+}
+
+resource "aws_cloudwatch_event_target" "status_sweeper" {
+  rule = aws_cloudwatch_event_rule.status_sweeper.name
+  arn  = aws_lambda_function.status_sweeper.arn
+}
+
+resource "aws_lambda_permission" "status_sweeper" {
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.status_sweeper.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.status_sweeper.arn
+}
+
 # IAM role for Lambda
 resource "aws_iam_role" "lambda_role" {
   name = "${var.project_name}-lambda-role"
@@ -152,17 +579,53 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Effect = "Allow"
         Action = [
           "dynamodb:GetItem",
+          "dynamodb:BatchGetItem",
           "dynamodb:PutItem",
           "dynamodb:Query",
           "dynamodb:Scan",
           "dynamodb:UpdateItem",
-          "dynamodb:DeleteItem"
+          "dynamodb:DeleteItem",
+          "dynamodb:BatchWriteItem",
+          "dynamodb:ConditionCheckItem"
         ]
         Resource = [
           aws_dynamodb_table.users.arn,
           aws_dynamodb_table.notes.arn,
-          "${aws_dynamodb_table.notes.arn}/index/*"
+          "${aws_dynamodb_table.notes.arn}/index/*",
+          aws_dynamodb_table.notes_v2.arn,
+          "${aws_dynamodb_table.notes_v2.arn}/index/*",
+          aws_dynamodb_table.note_versions.arn,
+          aws_dynamodb_table.note_tombstones.arn,
+          aws_dynamodb_table.note_changes.arn,
+          aws_dynamodb_table.note_search.arn,
+          aws_dynamodb_table.note_usage.arn,
+          aws_dynamodb_table.agent_flights.arn,
+          aws_dynamodb_table.rate_limits.arn,
+          aws_dynamodb_table.idempotency.arn
+        ]
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "dynamodb:DescribeStream",
+          "dynamodb:GetRecords",
+          "dynamodb:GetShardIterator",
+          "dynamodb:ListStreams"
+        ]
+        Resource = [
+          "${aws_dynamodb_table.notes.arn}/stream/*",
+          "${aws_dynamodb_table.notes_v2.arn}/stream/*"
+        ]
+      },
+      {
+        Effect = "Allow"
+        Action = [
+          "sqs:SendMessage",
+          "sqs:ReceiveMessage",
+          "sqs:DeleteMessage",
+          "sqs:GetQueueAttributes"
         ]
+        Resource = aws_sqs_queue.reclean.arn
       },
       {
         Effect = "Allow"
@@ -16,4 +16,27 @@ variable "project_name" {
   description = "Name of the project (used in resource names)"
   type        = string
   default     = "medical-notes"
-}
\ No newline at end of file
+}
+variable "notes_table_phase" {
+  description = "notes -> notes-v2 migration phase (legacy, dual_write, v2_reads, v2)"
+  type        = string
+  default     = "legacy"
+}
+
+variable "local_expansion_dict" {
+  description = "Path inside the image of the abbrev_mining.py dictionary; empty sends every note to the agent"
+  type        = string
+  default     = ""
+}
+
+variable "local_expansion_min_confidence" {
+  description = "Minimum entry confidence for serving a note without the agent"
+  type        = string
+  default     = "0.95"
+}
+
+variable "rate_limit_tenant_plans" {
+  description = "JSON map of tenant (email domain) to rate limit plan, e.g. {\"mercy.org\": \"enterprise\"}"
+  type        = string
+  default     = "{}"
+}
@@ -0,0 +1,81 @@
+import json
+import os
+from decimal import Decimal
+
+#JSON encode/decode used by every handler
+#Prefers orjson when it is installed, falls back to the stdlib otherwise.
+#Both backends understand the Decimal values boto3 returns from DynamoDB.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#raised on malformed input by every backend (orjson's error subclasses it)
+DecodeError = json.JSONDecodeError
+
+
+def _default(value):
+    #DynamoDB hands numbers back as Decimal - keep ints as ints
+    if isinstance(value, Decimal):
+        if value == value.to_integral_value():
+            return int(value)
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _stdlib_loads(data):
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode("utf-8")
+    return json.loads(data)
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False)
+
+
+def _orjson_loads(data):
+    return orjson.loads(data)
+
+
+def _orjson_dumps(obj):
+    #orjson returns bytes, Lambda proxy bodies must be str
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+
+BACKENDS = {
+    "stdlib": (_stdlib_loads, _stdlib_dumps),
+}
+if orjson is not None:
+    BACKENDS["orjson"] = (_orjson_loads, _orjson_dumps)
+
+_loads = _stdlib_loads
+_dumps = _stdlib_dumps
+backend_name = "stdlib"
+
+
+def register_backend(name, loads_fn, dumps_fn):
+    #dumps_fn must return str and call _default-style handling for Decimal
+    BACKENDS[name] = (loads_fn, dumps_fn)
+
+
+def use_backend(name):
+    global _loads, _dumps, backend_name
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown JSON backend: {name}")
+    _loads, _dumps = BACKENDS[name]
+    backend_name = name
+
+
+def loads(data):
+    return _loads(data)
+
+
+def dumps(obj):
+    return _dumps(obj)
+
+
+#JSON_BACKEND env var pins a backend, otherwise pick the fastest available
+use_backend(os.environ.get("JSON_BACKEND") or ("orjson" if orjson is not None else "stdlib"))
@@ -1,14 +1,82 @@
-import json
 import logging
-from datetime import datetime
-from agent_client import get_cleaned_note
-from db_client import save_to_dynamo
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from agent_client import get_cleaned_note, AGENT_VERSION
+from db_client import save_to_dynamo, load_note, is_expired
+from local_expander import expand_locally, expand_partially, DEGRADED_VERSION
+from deadline import Deadline, DeadlineExceeded, SAVE_RESERVE_SECONDS
+from throttle import RateLimiter, DynamoRateStore, tenant_for
+import idempotency
+import write_journal
+from idempotency import DynamoIdempotencyStore, LocalIdempotencyStore, IdempotencyConflict, fingerprint, MAX_KEY_LENGTH
+from near_duplicate import index as near_duplicates
 from auth import verify_token
+import json_codec
 
 # Safe logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+#a freshly bumped version may not be visible in the notes GSI yet,
+#so no ETag is handed out until the version has been stable this long
+ETAG_SETTLE_SECONDS = float(os.environ.get("ETAG_SETTLE_SECONDS", "2"))
+
+#user_id -> (etag, body) for the last history response built in this container
+HISTORY_CACHE_SIZE = int(os.environ.get("HISTORY_CACHE_SIZE", "256"))
+_history_cache = OrderedDict()
+_history_cache_lock = threading.Lock() #handlers share it across threads when served by asgi_app.py
+
+#per-user and per-tenant request buckets, shared across containers through RATE_LIMIT_TABLE
+RATE_LIMIT_TABLE = os.environ.get("RATE_LIMIT_TABLE")
+rate_limiter = RateLimiter(DynamoRateStore(RATE_LIMIT_TABLE) if RATE_LIMIT_TABLE else None)
+
+#Idempotency-Key records, shared across containers through IDEMPOTENCY_TABLE
+IDEMPOTENCY_TABLE = os.environ.get("IDEMPOTENCY_TABLE")
+idempotency_store = DynamoIdempotencyStore(IDEMPOTENCY_TABLE) if IDEMPOTENCY_TABLE else LocalIdempotencyStore()
+
+def get_header(event, name):
+    #API Gateway passes headers through with the client's casing
+    headers = event.get('headers') or {}
+    if name in headers:
+        return headers[name]
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+def normalize_timestamp(value):
+    #created_at is stored as naive UTC isoformat, compare against the same shape
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat()
+
+def history_response(status_code, body, etag=None):
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization, If-None-Match'
+    }
+    if etag:
+        headers['ETag'] = etag
+        headers['Cache-Control'] = 'private, no-cache'
+        headers['Access-Control-Expose-Headers'] = 'ETag'
+    return {'statusCode': status_code, 'headers': headers, 'body': body}
+
 def error_response(status_code, message):
     return {
         'statusCode': status_code,
@@ -17,17 +85,144 @@ def error_response(status_code, message):
             'Access-Control-Allow-Origin': '*', 
             'Access-Control-Allow-Headers': 'Content-Type, Authorization'
         },
-        'body': json.dumps({
+        'body': json_codec.dumps({
             'error': message, 
             'timestamp': datetime.utcnow().isoformat()
         })
     }
 
+def rate_limited_response(retry_after):
+    response = error_response(429, "Too many requests - please slow down")
+    response['headers']['Retry-After'] = str(max(math.ceil(retry_after), 1))
+    response['headers']['Access-Control-Expose-Headers'] = 'Retry-After'
+    return response
+
+# Cleans one note and saves it; note_id and created_at are fixed by an idempotency
+# record, and resumed when that record was taken over from a request that may have saved it
+def process_note(user_id, original_note, context, deadline, note_id=None, created_at=None, resumed=False):
+    request_id = context.aws_request_id
+    # Chosen here, not by the DB layer, so a journaled save replays onto the same note
+    note_id = note_id or str(uuid.uuid4())
+
+    # Log processing start
+    logger.info(f"Processing note - User: {user_id}, Request: {request_id}, Length: {len(original_note)}")
+
+    # Notes the mined dictionary fully covers, or that only differ from a
+    # recent note in numbers/dates, skip the agent
+    agent_version = AGENT_VERSION
+    agent_ms = 0
+    degraded = False
+    local = expand_locally(original_note)
+    reused = None if local else near_duplicates.lookup(original_note, owner=user_id)
+    if local:
+        cleaned_note, agent_version = local
+        logger.info(f"Expanded locally - Request: {request_id}")
+    elif reused:
+        cleaned_note, agent_version = reused
+        logger.info(f"Reused near duplicate - Request: {request_id}, Version: {agent_version}")
+    else:
+        # Send to Bedrock for cleaning, keeping enough time back to save the note
+        try:
+            agent_started = time.perf_counter()
+            cleaned_note = get_cleaned_note(original_note, deadline=deadline.reserve(SAVE_RESERVE_SECONDS))
+            agent_ms = int((time.perf_counter() - agent_started) * 1000) #stored for capacity planning
+            near_duplicates.add(original_note, cleaned_note, AGENT_VERSION, owner=user_id)
+        except DeadlineExceeded:
+            # Out of time - answer with what the dictionary knows, the note is re-cleaned later
+            logger.warning(f"AI service out of time - Request: {request_id}")
+            cleaned_note = expand_partially(original_note)
+            agent_version = DEGRADED_VERSION
+            degraded = True
+        except Exception as e:
+            logger.error(f"AI service error - Request: {request_id}, Error: {type(e).__name__}")
+            return error_response(500, "AI service is temporarily unavailable")
+
+    # Save to DB/ store both original and cleaned version with user association;
+    # a failed save is journaled under the same key
+    save_status = 'saved'
+    created_at = created_at or datetime.utcnow().isoformat()
+    try:
+        note_id = save_to_dynamo(
+            user_id=user_id, 
+            original_note=original_note, 
+            cleaned_note=cleaned_note, 
+            context=context,
+            agent_version=agent_version,
+            processing_time_ms=agent_ms,
+            deadline=deadline,
+            note_id=note_id,
+            created_at=created_at,
+            status='pending' if degraded else 'completed',
+            once=resumed
+        )
+    except Exception as e: 
+        logger.error(f"Database error - Request: {request_id}, Error: {type(e).__name__}")
+        # Don't fault the request if db save fails - user still gets result, and
+        # the note goes to the write journal to be saved by a later invocation
+        # under this note_id
+        saved = write_journal.record({
+            'note_id': note_id, 'created_at': created_at, 'user_id': user_id, 'original_note': original_note,
+            'cleaned_note': cleaned_note, 'agent_version': agent_version, 'processing_time_ms': agent_ms,
+            'request_id': request_id, 'status': 'pending' if degraded else 'completed'
+        })
+        save_status = 'pending' if saved else 'failed'
+        if not saved:
+            note_id = None
+
+    logger.info(f"Successfully processed - User: {user_id}, Request: {request_id}")
+
+    result = {
+        'cleaned_note': cleaned_note,
+        'note_id': note_id, 
+        'created_at': created_at if note_id else None, #with note_id, the note's key in medical-notes-v2
+        'original_length': len(original_note),
+        'cleaned_length': len(cleaned_note),
+        'save_status': save_status,
+        'processing_time': datetime.utcnow().isoformat()
+    }
+    if degraded:
+        result['degraded'] = True
+    return {
+        'statusCode': 200, 
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*', 
+            'Access-Control-Allow-Headers': 'Content-Type, Authorization'             
+        },
+        'body': json_codec.dumps(result)
+    }
+
+# Idempotency records keep the response without the note text; a replay reads
+# it back from the notes table, so the records hold no PHI and a note deleted
+# (or purged) since is not served from them
+def stored_response(response):
+    body = json_codec.loads(response['body'])
+    body['cleaned_note'] = None
+    return dict(response, body=json_codec.dumps(body))
+
+def replayed_response(user_id, stored):
+    body = json_codec.loads(stored['body'])
+    note = load_note(body['note_id'], user_id, body.get('created_at'))
+    if note is None or is_expired(note):
+        if body['save_status'] == 'pending':
+            # Journaled by the first request and not saved yet
+            response = error_response(409, "The note from this request is still being saved, please retry")
+            response['headers']['Retry-After'] = '5'
+            return response
+        return error_response(410, "The note from this request has been deleted")
+    body.update(cleaned_note=note['cleaned_note'], cleaned_length=len(note['cleaned_note']), save_status='saved')
+    return dict(stored, headers=dict(stored['headers'], **{'Idempotent-Replayed': 'true'}), body=json_codec.dumps(body))
+
 def lambda_handler(event, context):
     # Prod Lambda handler - HIPAA Comp.
     request_id = context.aws_request_id
+    # Everything below shares what is left of the Lambda timeout
+    deadline = Deadline.from_context(context)
     
     try:
+        # Saves an earlier invocation could not make; a stat() when there are none
+        write_journal.replay_pending(deadline)
+
         # Authenticate check/ extract 'Bearer token' from header
         auth_header = event.get('headers', {}).get('Authorization', '')
         if not auth_header.startswith('Bearer '):
@@ -35,16 +230,22 @@ def lambda_handler(event, context):
             return error_response(401, "Authorization header required")
         
         token = auth_header.replace('Bearer ', '')
-        user_id, email = verify_token(token)
+        user_id, email = verify_token(token, deadline)
 
         if not user_id:
             logger.warning(f"Invalid token - Request: {request_id}")
             return error_response(401, "Invalid or expired token")
+
+        # Keep one client in a retry loop from using up the agent for everyone
+        retry_after = rate_limiter.check(user_id, tenant_for(email))
+        if retry_after:
+            logger.warning(f"Rate limited - User: {user_id}, Request: {request_id}")
+            return rate_limited_response(retry_after)
         
         # Input validation / parse JSON body from request
         try: 
-            body = json.loads(event['body'])
-        except json.JSONDecodeError:
+            body = json_codec.loads(event['body'])
+        except json_codec.DecodeError:
             return error_response(400, "Invalid JSON in request body")
         
         if 'note' not in body:
@@ -55,46 +256,47 @@ def lambda_handler(event, context):
         if not original_note:
             return error_response(400, "Note cannot be empty")
         
-        # Log processing start 
-        logger.info(f"Processing note - User: {user_id}, Request: {request_id}, Length: {len(original_note)}")
+        idempotency_key = get_header(event, 'Idempotency-Key')
+        if not idempotency_key:
+            return process_note(user_id, original_note, context, deadline)
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            return error_response(400, f"Idempotency-Key too long (max {MAX_KEY_LENGTH} characters)")
 
-        # Send to Bedrock for cleaning 
+        # A retry with the same key gets the first request's response, or waits for it
         try:
-            cleaned_note = get_cleaned_note(original_note)
+            outcome, value = idempotency.claim(idempotency_store, user_id, idempotency_key,
+                                               fingerprint(original_note), deadline)
+        except IdempotencyConflict as e:
+            return error_response(422, str(e))
+        except DeadlineExceeded:
+            return error_response(409, "A request with this Idempotency-Key is still being processed, please retry")
         except Exception as e:
-            logger.error(f"AI service error - Request: {request_id}, Error: {type(e).__name__}")
-            return error_response(500, "AI service is temporarily unavailable")
-        
-        # Save to DB/ store both original and cleaned version with user association
-        try:
-            note_id = save_to_dynamo(
-                user_id=user_id, 
-                original_note=original_note, 
-                cleaned_note=cleaned_note, 
-                context=context
-            )
-        except Exception as e: 
-            logger.error(f"Database error - Request: {request_id}, Error: {type(e).__name__}")
-            # Don't fault the request if db save fails - user still gets result
-            note_id = None 
-
-        logger.info(f"Successfully processed - User: {user_id}, Request: {request_id}")
+            logger.warning(f"Idempotency store unavailable - Request: {request_id}, Error: {type(e).__name__}")
+            return process_note(user_id, original_note, context, deadline)
 
-        return {
-            'statusCode': 200, 
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*', 
-                'Access-Control-Allow-Headers': 'Content-Type, Authorization'             
-            },
-            'body': json.dumps({
-                'cleaned_note': cleaned_note,
-                'note_id': note_id, 
-                'original_length': len(original_note),
-                'cleaned_length': len(cleaned_note),
-                'processing_time': datetime.utcnow().isoformat()
-            })
-        }
+        if outcome == 'replay':
+            logger.info(f"Replayed idempotent response - User: {user_id}, Request: {request_id}")
+            return replayed_response(user_id, value)
+
+        record = value
+        try:
+            response = process_note(user_id, original_note, context, deadline, record['note_id'],
+                                    record.get('created_at'), record.get('resumed', False))
+        except Exception:
+            idempotency.release(idempotency_store, record)
+            raise
+        try:
+            # Only a saved (or journaled) note is final - anything else may be retried
+            if response['statusCode'] == 200 and json_codec.loads(response['body'])['note_id']:
+                idempotency.complete(idempotency_store, record, stored_response(response))
+            else:
+                idempotency.release(idempotency_store, record)
+        except Exception as e:
+            logger.warning(f"Idempotency record not updated - Request: {request_id}, Error: {type(e).__name__}")
+        return response
+    except DeadlineExceeded:
+        logger.error(f"Out of time - Request: {request_id}")
+        return error_response(503, "Request timed out, please retry")
     except Exception as e:
         # Catch unexpected errors
         logger.error(f"Unexpected error - Request: {request_id}, Error: {str(e)}")
@@ -118,9 +320,150 @@ def history_lambda_handler(event, context):
             logger.warning(f"Invalid token - Request: {request_id}")
             return error_response(401, "Invalid or expired token")
         
+        from db_client import get_user_notes, get_user_version, get_user_changes_since
+
+        # Delta sync - only what changed after the client's cursor
+        since = (event.get('queryStringParameters') or {}).get('since')
+        if since:
+            try:
+                since = normalize_timestamp(since)
+            except ValueError:
+                return error_response(400, "Invalid 'since' timestamp")
+
+            changes = get_user_changes_since(user_id, since)
+            changes['count'] = len(changes['notes'])
+            return history_response(200, json_codec.dumps(changes))
+
+        # Current version of the user's notes, used as the ETag
+        etag = None
+        try:
+            version, updated_at = get_user_version(user_id)
+            if time.time() - updated_at >= ETAG_SETTLE_SECONDS:
+                etag = f'"v{version}"'
+        except Exception as e:
+            logger.warning(f"Version lookup failed - Request: {request_id}, Error: {type(e).__name__}")
+
+        if etag:
+            # Client already has this version - skip the notes query entirely
+            if etag_matches(get_header(event, 'If-None-Match'), etag):
+                return history_response(304, '', etag)
+
+            with _history_cache_lock:
+                cached = _history_cache.get(user_id)
+                if cached and cached[0] == etag:
+                    _history_cache.move_to_end(user_id)
+            if cached and cached[0] == etag:
+                return history_response(200, cached[1], etag)
+
         # Get user's notes from the db (in db_client)
-        from db_client import get_user_notes
-        notes = get_user_notes(user_id, limit=20)
+        notes = get_user_notes(user_id, limit=20, raise_errors=True)
+        body = json_codec.dumps({
+            'notes': notes,
+            'count': len(notes)
+        })
+
+        if etag:
+            with _history_cache_lock:
+                _history_cache[user_id] = (etag, body)
+                _history_cache.move_to_end(user_id)
+                while len(_history_cache) > HISTORY_CACHE_SIZE:
+                    _history_cache.popitem(last=False)
+
+        return history_response(200, body, etag)
+        
+    except Exception as e:
+        logger.error(f"Unexpected error in history handler - Request: {request_id}, Error: {str(e)}")
+        return error_response(500, f"Failed to get history: {str(e)}")
+
+# Handler for editing the cleaned text of one of the user's notes
+def update_note_lambda_handler(event, context):
+    request_id = context.aws_request_id
+
+    try:
+        # Authenticate check
+        auth_header = get_header(event, 'Authorization') or ''
+        if not auth_header.startswith('Bearer '):
+            logger.warning(f"Missing auth header - Request: {request_id}")
+            return error_response(401, "Authorization header required")
+
+        token = auth_header.replace('Bearer ', '')
+        user_id, email = verify_token(token)
+
+        if not user_id:
+            logger.warning(f"Invalid token - Request: {request_id}")
+            return error_response(401, "Invalid or expired token")
+
+        try:
+            body = json_codec.loads(event['body'])
+        except json_codec.DecodeError:
+            return error_response(400, "Invalid JSON in request body")
+
+        # note id from the path (PUT /notes/{note_id}) or the body
+        note_id = (event.get('pathParameters') or {}).get('note_id') or body.get('note_id')
+        if not note_id:
+            return error_response(400, "Missing 'note_id'")
+
+        cleaned_note = (body.get('cleaned_note') or '').strip()
+        if not cleaned_note:
+            return error_response(400, "Missing 'cleaned_note' field in request")
+        if len(cleaned_note) > 20000:
+            return error_response(400, "Cleaned note too long (max 20,000 characters)")
+
+        from db_client import update_user_note
+        #created_at (as returned by /history) saves a lookup once notes live in medical-notes-v2
+        note = update_user_note(note_id, user_id, cleaned_note, body.get('created_at'))
+        if note is None:
+            # Not found and not owned look the same - don't leak which notes exist
+            return error_response(404, "Note not found")
+
+        logger.info(f"Note updated - User: {user_id}, Request: {request_id}")
+
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization'
+            },
+            'body': json_codec.dumps({'note': note})
+        }
+
+    except Exception as e:
+        logger.error(f"Unexpected error in update handler - Request: {request_id}, Error: {type(e).__name__}")
+        return error_response(500, "Failed to update note")
+
+# Handler for full-text search over the user's cleaned notes
+def search_lambda_handler(event, context):
+    request_id = context.aws_request_id
+
+    try:
+        # Authenticate check
+        auth_header = get_header(event, 'Authorization') or ''
+        if not auth_header.startswith('Bearer '):
+            logger.warning(f"Missing auth header - Request: {request_id}")
+            return error_response(401, "Authorization header required")
+
+        token = auth_header.replace('Bearer ', '')
+        user_id, email = verify_token(token)
+
+        if not user_id:
+            logger.warning(f"Invalid token - Request: {request_id}")
+            return error_response(401, "Invalid or expired token")
+
+        params = event.get('queryStringParameters') or {}
+        query = (params.get('q') or '').strip()
+        if not query:
+            return error_response(400, "Missing 'q' query parameter")
+        if len(query) > 200:
+            return error_response(400, "Search query too long (max 200 characters)")
+
+        try:
+            limit = min(max(int(params.get('limit', 10)), 1), 50)
+        except ValueError:
+            return error_response(400, "Invalid 'limit' parameter")
+
+        from search_index import search_notes
+        results = search_notes(user_id, query, limit=limit)
 
         return {
             'statusCode': 200,
@@ -129,12 +472,12 @@ def history_lambda_handler(event, context):
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Headers': 'Content-Type, Authorization'
             },
-            'body': json.dumps({
-                'notes': notes,
-                'count': len(notes)
+            'body': json_codec.dumps({
+                'results': results,
+                'count': len(results)
             })
         }
-        
+
     except Exception as e:
-        logger.error(f"Unexpected error in history handler - Request: {request_id}, Error: {str(e)}")
-        return error_response(500, f"Failed to get history: {str(e)}")
\ No newline at end of file
+        logger.error(f"Unexpected error in search handler - Request: {request_id}, Error: {type(e).__name__}")
+        return error_response(500, "Search is temporarily unavailable")
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+
+#Stand-in for the bedrock-agent-runtime client, for local/container runs and
+#benchmarks without AWS. invoke_agent answers like the real agent - an event
+#stream of chunks carrying {"outputText": ...} whose first chunk arrives after
+#`latency` seconds (+- jitter, and `straggler_factor` times longer for a
+#`stragglers` share of calls), expanding a few common abbreviations, and
+#counts the calls it served and the streams closed before they finished.
+#Selected in agent_client (and, as AsyncLocalAgent, in async_client) with
+#LOCAL_AGENT_LATENCY_MS.
+
+EXPANSIONS = {
+    'pt': 'patient', 'w/': 'with', 'cp': 'chest pain', 'sob': 'shortness of breath', 'c/o': 'complains of',
+    'f/u': 'follow up', 'hx': 'history of', 'htn': 'hypertension', 'dm': 'diabetes', 'bp': 'blood pressure',
+    'hr': 'heart rate', 'prn': 'as needed', 'bid': 'twice daily', 'labs': 'laboratory tests'
+}
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[/.'][a-z0-9]+)*/?", re.IGNORECASE)
+CHUNK_CHARS = 64
+
+
+class _Completion:
+    #event stream that can be closed from another thread, like botocore's EventStream
+
+    def __init__(self, agent, chunks, latency):
+        self.agent = agent
+        self.chunks = chunks
+        self.latency = latency
+        self.closed = threading.Event()
+        self.finished = False
+
+    def __iter__(self):
+        if self.closed.wait(self.latency):
+            return
+        for chunk in self.chunks:
+            if self.closed.is_set():
+                return
+            yield chunk
+        self.finished = True
+
+    def close(self):
+        if not self.closed.is_set() and not self.finished:
+            self.closed.set()
+            with self.agent._lock:
+                self.agent.cancelled += 1
+
+
+class LocalAgent:
+
+    def __init__(self, latency=0.8, failure=None, jitter=0.0, stragglers=0.0, straggler_factor=10, seed=None):
+        self.latency = latency
+        self.failure = failure #exception raised by every call, to simulate outages
+        self.jitter = jitter
+        self.stragglers = stragglers
+        self.straggler_factor = straggler_factor
+        self.calls = 0
+        self.cancelled = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def _latency(self):
+        with self._lock:
+            latency = self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter))
+            if self._rng.random() < self.stragglers:
+                latency *= self.straggler_factor
+        return latency
+
+    def _chunks(self, input_text):
+        with self._lock:
+            self.calls += 1
+        cleaned = TOKEN_RE.sub(lambda match: EXPANSIONS.get(match.group(0).lower(), match.group(0)), input_text)
+        cleaned = cleaned[:1].upper() + cleaned[1:]
+        body = json.dumps({'outputText': cleaned}).encode('utf-8')
+        return [{'chunk': {'bytes': body[i:i + CHUNK_CHARS]}} for i in range(0, len(body), CHUNK_CHARS)]
+
+    def invoke_agent(self, agentId=None, agentAliasId=None, sessionId=None, inputText='', enableTrace=False):
+        chunks = self._chunks(inputText)
+        if self.failure:
+            time.sleep(self.latency)
+            raise self.failure
+        return {'completion': _Completion(self, chunks, self._latency()), 'contentType': 'application/json',
+                'sessionId': sessionId}
+
+
+class _AsyncCompletion:
+    #async event stream, like aiobotocore's - waiting costs no thread
+
+    def __init__(self, chunks, latency):
+        self.chunks = chunks
+        self.latency = latency
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.latency)
+        for chunk in self.chunks:
+            yield chunk
+
+
+class AsyncLocalAgent(LocalAgent):
+    #the same simulator for asyncio callers (async_client.py): invoke_agent is a coroutine
+
+    async def invoke_agent(self, agentId=None, agentAliasId=None, sessionId=None, inputText='', enableTrace=False):
+        chunks = self._chunks(inputText)
+        if self.failure:
+            await asyncio.sleep(self.latency)
+            raise self.failure
+        return {'completion': _AsyncCompletion(chunks, self._latency()), 'contentType': 'application/json',
+                'sessionId': sessionId}
@@ -0,0 +1,112 @@
+import logging
+import os
+import re
+import threading
+import json_codec
+
+#Serves notes from the abbreviation dictionary mined by abbrev_mining.py
+#without calling the Bedrock agent. A note is only expanded here when every
+#token in it has an entry at or above LOCAL_EXPANSION_MIN_CONFIDENCE -
+#anything unknown or ambiguous sends the whole note to the agent.
+#Off unless LOCAL_EXPANSION_DICT points at a dictionary file.
+
+logger = logging.getLogger(__name__)
+
+DICTIONARY_PATH = os.environ.get("LOCAL_EXPANSION_DICT")
+MIN_CONFIDENCE = float(os.environ.get("LOCAL_EXPANSION_MIN_CONFIDENCE", "0.95"))
+
+#agent_version of locally expanded notes is LOCAL_VERSION_PREFIX + dictionary version
+LOCAL_VERSION_PREFIX = "local:"
+#agent_version of best-effort notes served when the agent ran out of time;
+#it never matches a real agent version, so reclean_queue re-cleans them
+DEGRADED_VERSION = "degraded"
+#agent_version of notes near_duplicate.py patched from an earlier note is this
+#prefix + that note's agent_version; re-cleaned the same way
+NEAR_VERSION_PREFIX = "near:"
+
+#words, dotted/slashed abbreviations (b.i.d, h/o, w/) and numbers (120/80, 98.6)
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[/.'&+][a-z0-9]+)*/?", re.IGNORECASE)
+NUMBER_RE = re.compile(r"[0-9][0-9/.]*")
+SENTENCE_START_RE = re.compile(r"(^|[.!?]\s+)([a-z])")
+
+_dictionary = None
+_dictionary_lock = threading.Lock()
+
+
+def is_agent_output(agent_version):
+    #False for text the agent did not write for this note as it stands: local
+    #expansions, degraded partial expansions and patched near duplicates
+    version = str(agent_version or '')
+    return not (version.startswith(LOCAL_VERSION_PREFIX) or version.startswith(NEAR_VERSION_PREFIX)
+                or version == DEGRADED_VERSION)
+
+
+def tokenize(text):
+    return [match.group(0).lower() for match in TOKEN_RE.finditer(text)]
+
+
+def load_dictionary(path, min_confidence=MIN_CONFIDENCE):
+    #(version, token -> rendering) for the entries confident enough to use
+    with open(path, 'rb') as f:
+        data = json_codec.loads(f.read())
+    renderings = {entry['token']: entry['rendering'] for entry in data['entries']
+                  if entry['confidence'] >= min_confidence}
+    return data['version'], renderings
+
+
+def get_dictionary():
+    global _dictionary
+    if not DICTIONARY_PATH:
+        return None
+    with _dictionary_lock:
+        if _dictionary is None:
+            try:
+                _dictionary = load_dictionary(DICTIONARY_PATH)
+                logger.info(f"Loaded local expansion dictionary {_dictionary[0]} ({len(_dictionary[1])} entries)")
+            except Exception as e:
+                logger.warning(f"Local expansion disabled, dictionary failed to load: {type(e).__name__}")
+                _dictionary = (None, {})
+        return _dictionary
+
+
+def expand(note, renderings, partial=False):
+    #cleaned note, or None if any token lacks a confident rendering (partial: left as written)
+    pieces, last = [], 0
+    for match in TOKEN_RE.finditer(note):
+        surface = match.group(0)
+        token = surface.lower()
+        if NUMBER_RE.fullmatch(token):
+            rendering = surface
+        elif token in renderings:
+            rendering = surface if renderings[token] == token else renderings[token]
+        elif partial:
+            rendering = surface
+        else:
+            return None
+        pieces.append(note[last:match.start()])
+        pieces.append(rendering)
+        last = match.end()
+    if not pieces:
+        return None
+    pieces.append(note[last:])
+    #dropped tokens leave double spaces behind
+    text = re.sub(r"[ \t]{2,}", " ", ''.join(pieces)).strip()
+    return SENTENCE_START_RE.sub(lambda m: m.group(1) + m.group(2).upper(), text)
+
+
+def expand_locally(note):
+    #(cleaned_note, agent_version) when the dictionary covers the whole note, else None
+    dictionary = get_dictionary()
+    if not dictionary or not dictionary[1]:
+        return None
+    version, renderings = dictionary
+    cleaned = expand(note, renderings)
+    if cleaned is None:
+        return None
+    return cleaned, LOCAL_VERSION_PREFIX + version
+
+
+def expand_partially(note):
+    #best effort when the agent is out of time: whatever the dictionary knows, the rest as written
+    dictionary = get_dictionary()
+    return expand(note, dictionary[1] if dictionary else {}, partial=True) or note
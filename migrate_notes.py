@@ -0,0 +1,272 @@
+import argparse
+import hashlib
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+import db_client
+import json_codec
+from checkpoints import load_checkpoint, save_checkpoint
+from parallel_scan import parallel_scan, worker_tables
+
+#Online migration of medical-notes (keyed by note_id) to medical-notes-v2
+#(user_id + created_at#note_id, see NOTES_TABLE_PHASE in db_client.py):
+#  1. deploy with NOTES_TABLE_PHASE=dual_write so every write lands in both tables
+#  2. backfill: parallel segment scan of medical-notes copied into medical-notes-v2
+#  3. verify: per-bucket checksums of both tables, drilling down to note ids on a mismatch
+#  4. deploy with NOTES_TABLE_PHASE=v2_reads, then v2 once a rollback is no longer needed
+#Each copy is a transaction that checks the medical-notes item still holds what
+#was scanned and that medical-notes-v2 has no copy yet, so the backfill can
+#neither resurrect a deleted note nor overwrite a newer dual write.
+#
+#Usage:
+#  python migrate_notes.py backfill --segments 16 --checkpoint backfill.ckpt
+#  python migrate_notes.py verify --segments 16 --repair
+
+dynamodb = boto3.resource("dynamodb")
+legacy_table = db_client.notes_table
+v2_table = db_client.notes_v2_table
+
+PAGE_SIZE = 500
+COPY_BATCH_SIZE = 25        #two actions per note, TransactWriteItems takes up to 100
+COPY_ATTEMPTS = 5
+CHECKSUM_BUCKETS = 1024
+
+
+def _unchanged_check(item):
+    #the medical-notes item still exists and has not been edited or re-cleaned since it was read
+    return {'ConditionCheck': {
+        'TableName': legacy_table.name,
+        'Key': {'note_id': item['note_id']},
+        'ConditionExpression': 'cleaned_note = :seen',
+        'ExpressionAttributeValues': {':seen': item['cleaned_note']}
+    }}
+
+
+def _copy_actions(item, overwrite=False):
+    put = {'TableName': v2_table.name, 'Item': db_client.v2_note_item(item)}
+    if not overwrite:
+        put['ConditionExpression'] = 'attribute_not_exists(note_key)' #a dual write got there first
+    return [_unchanged_check(item), {'Put': put}]
+
+
+def copy_batch(items, overwrite=False):
+    #copies up to COPY_BATCH_SIZE notes, returns (copied, skipped)
+    client = dynamodb.meta.client
+    skipped = 0
+    for attempt in range(COPY_ATTEMPTS):
+        if not items:
+            return 0, skipped
+        actions = [action for item in items for action in _copy_actions(item, overwrite)]
+        try:
+            client.transact_write_items(TransactItems=actions)
+            return len(items), skipped
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons', [])
+            failed = {i // 2 for i, reason in enumerate(reasons) if reason.get('Code') == 'ConditionalCheckFailed'}
+            if failed:
+                #deleted, changed or already dual-written - nothing to copy for those
+                skipped += len(failed)
+                items = [item for i, item in enumerate(items) if i not in failed]
+                continue
+            time.sleep(0.1 * 2 ** attempt) #transaction conflict or throttling
+    raise Exception("Failed to copy notes after retries")
+
+
+def copy_notes(items, overwrite=False):
+    copied = skipped = 0
+    for start in range(0, len(items), COPY_BATCH_SIZE):
+        done, missed = copy_batch(items[start:start + COPY_BATCH_SIZE], overwrite)
+        copied += done
+        skipped += missed
+    return copied, skipped
+
+
+def backfill(segments=8, checkpoint_path=None, progress=None):
+    checkpoint = load_checkpoint(checkpoint_path) or {'segments': segments, 'cursors': {}, 'finished': [],
+                                                      'copied': 0, 'skipped': 0, 'expired': 0}
+    if checkpoint['segments'] != segments:
+        raise ValueError("Checkpoint was written with a different number of segments")
+
+    lock = threading.Lock()
+    started = time.time()
+
+    def copy_page(segment, items, cursor):
+        #TTL removes these from both tables anyway
+        live = [item for item in items if not db_client.is_expired(item)]
+        copied, skipped = copy_notes(live)
+        with lock:
+            checkpoint['copied'] += copied
+            checkpoint['skipped'] += skipped
+            checkpoint['expired'] += len(items) - len(live)
+            checkpoint['cursors'][str(segment)] = cursor
+            if not cursor:
+                checkpoint['finished'].append(segment)
+            if checkpoint_path:
+                save_checkpoint(checkpoint_path, checkpoint)
+            if progress:
+                elapsed = max(time.time() - started, 1e-6)
+                progress(f"\rCopied {checkpoint['copied']} skipped {checkpoint['skipped']} "
+                         f"| {len(checkpoint['finished'])}/{segments} segments done "
+                         f"| {checkpoint['copied'] / elapsed:.0f} notes/s")
+
+    parallel_scan(
+        worker_tables(legacy_table), segments,
+        callback=copy_page, page_size=PAGE_SIZE,
+        only_segments=[segment for segment in range(segments) if segment not in checkpoint['finished']],
+        start_cursors={int(segment): cursor for segment, cursor in checkpoint['cursors'].items()}
+    )
+    return checkpoint
+
+
+def note_digest(item):
+    #stable digest of a stored note; note_key only exists in medical-notes-v2 and is left out
+    canonical = json_codec.dumps({name: item[name] for name in sorted(item) if name != 'note_key'})
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).digest()
+
+
+def checksum_bucket(note_id):
+    return zlib.crc32(note_id.encode('utf-8')) % CHECKSUM_BUCKETS
+
+
+def _bucket_sums(sums, items):
+    for item in items:
+        if db_client.is_expired(item):
+            continue #TTL deletes these at different times in the two tables
+        bucket = checksum_bucket(item['note_id'])
+        count, total = sums.get(bucket, (0, 0))
+        sums[bucket] = (count + 1, (total + int.from_bytes(note_digest(item), 'big')) % 2 ** 128)
+    return sums
+
+
+def _merge_bucket_sums(a, b):
+    merged = dict(a)
+    for bucket, (count, total) in b.items():
+        merged_count, merged_total = merged.get(bucket, (0, 0))
+        merged[bucket] = (merged_count + count, (merged_total + total) % 2 ** 128)
+    return merged
+
+
+def table_checksums(table, segments, buckets=None):
+    #bucket -> (count, sum of digests); with buckets given, note_id -> (digest, item)
+    #for just the notes in those buckets, to find which notes differ
+    if buckets is None:
+        reducer, combine = _bucket_sums, _merge_bucket_sums
+    else:
+        def reducer(found, items):
+            for item in items:
+                if not db_client.is_expired(item) and checksum_bucket(item['note_id']) in buckets:
+                    found[item['note_id']] = (note_digest(item), item)
+            return found
+
+        def combine(a, b):
+            return dict(a, **b)
+
+    scan = parallel_scan(worker_tables(table), segments, reducer=reducer, initial={}, combine=combine,
+                         page_size=PAGE_SIZE, consistent=True)
+    return scan['result']
+
+
+def _recheck(note_id, v2_key):
+    #a second, strongly consistent look - in-flight dual writes settle by now
+    legacy = legacy_table.get_item(Key={'note_id': note_id}, ConsistentRead=True).get('Item')
+    copy = v2_table.get_item(Key=v2_key, ConsistentRead=True).get('Item') if v2_key else None
+    if legacy and db_client.is_expired(legacy):
+        legacy = None
+    if copy and db_client.is_expired(copy):
+        copy = None
+    return legacy, copy
+
+
+def repair_note(legacy, copy):
+    client = dynamodb.meta.client
+    try:
+        if legacy:
+            client.transact_write_items(TransactItems=_copy_actions(legacy, overwrite=True))
+        else:
+            #only delete the orphan while medical-notes still has no such note
+            client.transact_write_items(TransactItems=[
+                {'ConditionCheck': {'TableName': legacy_table.name, 'Key': {'note_id': copy['note_id']},
+                                    'ConditionExpression': 'attribute_not_exists(note_id)'}},
+                {'Delete': {'TableName': v2_table.name, 'Key': db_client.v2_note_key(copy)}}
+            ])
+    except client.exceptions.TransactionCanceledException:
+        return False #changed again meanwhile, the next verify will tell
+    return True
+
+
+def verify(segments=8, repair=False, progress=None):
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        legacy_future = pool.submit(table_checksums, legacy_table, segments)
+        v2_future = pool.submit(table_checksums, v2_table, segments)
+        legacy_sums, v2_sums = legacy_future.result(), v2_future.result()
+
+    result = {
+        'notes': sum(count for count, _ in legacy_sums.values()),
+        'v2_notes': sum(count for count, _ in v2_sums.values()),
+        'mismatched_buckets': 0, 'missing': [], 'different': [], 'orphaned': [], 'repaired': 0
+    }
+    mismatched = {bucket for bucket in range(CHECKSUM_BUCKETS) if legacy_sums.get(bucket) != v2_sums.get(bucket)}
+    result['mismatched_buckets'] = len(mismatched)
+    if not mismatched:
+        return result
+    if progress:
+        progress(f"{len(mismatched)} of {CHECKSUM_BUCKETS} buckets differ, comparing their notes\n")
+
+    legacy_notes = table_checksums(legacy_table, segments, mismatched)
+    v2_notes = table_checksums(v2_table, segments, mismatched)
+    suspects = {note_id for note_id in legacy_notes.keys() | v2_notes.keys()
+                if legacy_notes.get(note_id, (None,))[0] != v2_notes.get(note_id, (None,))[0]}
+
+    for note_id in sorted(suspects):
+        found = legacy_notes.get(note_id) or v2_notes[note_id]
+        legacy, copy = _recheck(note_id, db_client.v2_note_key(found[1]))
+        if legacy and copy:
+            if note_digest(legacy) == note_digest(copy):
+                continue
+            result['different'].append(note_id)
+        elif legacy:
+            result['missing'].append(note_id)
+        elif copy:
+            result['orphaned'].append(note_id)
+        else:
+            continue
+        if repair and repair_note(legacy, copy):
+            result['repaired'] += 1
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate medical-notes to medical-notes-v2")
+    parser.add_argument('command', choices=['backfill', 'verify'])
+    parser.add_argument('--segments', type=int, default=8, help="parallel scan segments")
+    parser.add_argument('--checkpoint', help="checkpoint file for resuming the backfill")
+    parser.add_argument('--repair', action='store_true', help="copy missing/different notes and delete orphans")
+    args = parser.parse_args()
+
+    if db_client.NOTES_TABLE_PHASE == 'legacy':
+        print("Warning: NOTES_TABLE_PHASE is legacy here - make sure the deployed API is dual writing first")
+
+    if args.command == 'backfill':
+        result = backfill(args.segments, args.checkpoint, progress=lambda line: print(line, end='', flush=True))
+        print(f"\nBackfill complete: copied {result['copied']}, skipped {result['skipped']} "
+              f"(already copied or changed), expired {result['expired']}")
+        return
+
+    result = verify(args.segments, args.repair, progress=lambda line: print(line, end='', flush=True))
+    print(f"medical-notes: {result['notes']} notes, medical-notes-v2: {result['v2_notes']} notes")
+    for name in ('missing', 'different', 'orphaned'):
+        if result[name]:
+            print(f"{name}: {len(result[name])} e.g. {', '.join(result[name][:5])}")
+    if args.repair:
+        print(f"repaired: {result['repaired']}")
+    mismatches = len(result['missing']) + len(result['different']) + len(result['orphaned'])
+    if mismatches and not args.repair:
+        raise SystemExit(1)
+    if not mismatches:
+        print("Tables match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import difflib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from local_expander import NEAR_VERSION_PREFIX, TOKEN_RE
+
+#Index over recently cleaned notes, so a note that differs from an earlier
+#one only in numbers/dates ("f/u 1wk" vs "f/u 2wk") reuses that note's
+#cleaned output as a template instead of calling the agent.
+#Notes are grouped by shape: tokens with digit runs folded to '#', and the
+#symbols between tokens ("+fever" vs "-fever", "> 38" vs "< 38", "?") kept
+#as they are, since a flipped sign or comparison means the opposite. Only a
+#note of the same shape is a template, so every token that differs differs
+#in its digits alone - a changed word ("fever" -> "sob") always goes to the
+#agent. The changed tokens are only patched in when that is unambiguous -
+#each old token (or each changed number inside it) must occur exactly once
+#in the cleaned text, and a number changing to or from 1 is left to the
+#agent (plurals). Patched output is stamped NEAR_VERSION_PREFIX + the
+#template's agent_version, so it is re-cleaned like any outdated note and
+#never mined as agent output. The index lives in the container, and shapes
+#are kept per owner (the user), so one clinician's cleaned text is never
+#served to another; least recently used shapes are evicted past MAX_ENTRIES.
+
+MAX_ENTRIES = int(os.environ.get("NEAR_DUPLICATE_MAX_ENTRIES", "2000"))
+MAX_PATCHED_TOKENS = 3
+VARIANTS_PER_SHAPE = 4
+
+_DIGITS_RE = re.compile(r"[0-9]+")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def _replace_once(text, pattern, replacement, taken):
+    #span of the single match of pattern in text, None if it matches 0 or 2+ times
+    #or overlaps a span already being replaced
+    matches = list(re.finditer(pattern, text, re.IGNORECASE))
+    if len(matches) != 1:
+        return None
+    span = matches[0].span()
+    if any(start < span[1] and span[0] < end for start, end, _ in taken):
+        return None
+    return span[0], span[1], replacement
+
+
+def patch_template(tokens, template_tokens, template_cleaned):
+    #template_cleaned with the tokens that differ swapped in, None when that isnt safe
+    matcher = difflib.SequenceMatcher(None, [t.lower() for t in template_tokens], [t.lower() for t in tokens],
+                                      autojunk=False)
+    changes = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        if tag != 'replace' or i2 - i1 != j2 - j1:
+            return None #words added or removed - the agent has to see it
+        changes.extend(zip(template_tokens[i1:i2], tokens[j1:j2]))
+    if len(changes) > MAX_PATCHED_TOKENS:
+        return None
+    if any(_DIGITS_RE.sub('#', old.lower()) != _DIGITS_RE.sub('#', new.lower()) for old, new in changes):
+        return None #only numbers may differ - a changed word needs the agent
+
+    replacements = []
+    for old, new in changes:
+        whole = _replace_once(template_cleaned, rf"(?<![\w/.]){re.escape(old)}(?![\w/])", new, replacements)
+        if whole:
+            replacements.append(whole)
+            continue
+        #the agent rewrote the token ("1wk" -> "1 week"): patch the numbers in it
+        for old_number, new_number in zip(_DIGITS_RE.findall(old), _DIGITS_RE.findall(new)):
+            if old_number == new_number:
+                continue
+            if 1 in (int(old_number), int(new_number)):
+                return None #"1 week" vs "2 weeks" - the words around it change too
+            number = _replace_once(template_cleaned, rf"(?<!\d){old_number}(?!\d)", new_number, replacements)
+            if not number:
+                return None
+            replacements.append(number)
+
+    patched = template_cleaned
+    for start, end, replacement in sorted(replacements, reverse=True):
+        patched = patched[:start] + replacement + patched[end:]
+    return patched
+
+
+class NearDuplicateIndex:
+    #a shape keeps its VARIANTS_PER_SHAPE most recent notes, so a new one is
+    #likely to share most numbers with one of them. MAX_ENTRIES bounds the number of shapes
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._shapes = OrderedDict() #(owner, shape) -> [(tokens, key, cleaned, agent_version)] newest first
+        self._lock = threading.Lock()
+        self.metrics = {'lookups': 0, 'hits': 0, 'exact_hits': 0, 'patches_rejected': 0,
+                        'evictions': 0, 'lookup_seconds': 0.0}
+
+    def _parse(self, note, owner):
+        #tokens, (lowered tokens, separators) - the exact key - and (owner, shape)
+        tokens, separators, end = [], [], 0
+        for match in TOKEN_RE.finditer(note):
+            tokens.append(match.group(0))
+            separators.append(_SPACE_RE.sub(' ', note[end:match.start()]).strip(' ') or ' ')
+            end = match.end()
+        separators.append(_SPACE_RE.sub(' ', note[end:]).strip(' '))
+        lowered = [token.lower() for token in tokens]
+        shape = ''.join(separator + _DIGITS_RE.sub('#', token) for separator, token in zip(separators, lowered))
+        return tokens, (tuple(lowered), tuple(separators)), (owner, shape + separators[-1])
+
+    def add(self, note, cleaned, agent_version=None, owner=None):
+        tokens, key, shape = self._parse(note, owner)
+        if not tokens:
+            return
+        with self._lock:
+            variants = self._shapes.setdefault(shape, [])
+            self._shapes.move_to_end(shape)
+            variants[:] = [variant for variant in variants if variant[1] != key]
+            variants.insert(0, (tokens, key, cleaned, agent_version))
+            del variants[VARIANTS_PER_SHAPE:]
+            while len(self._shapes) > self.max_entries:
+                self._shapes.popitem(last=False)
+                self.metrics['evictions'] += 1
+
+    def lookup(self, note, owner=None):
+        #(cleaned_note, agent_version) from one of owner's notes - as it is for
+        #the same note, patched and stamped NEAR_VERSION_PREFIX for a near duplicate - or None
+        started = time.perf_counter()
+        try:
+            return self._lookup(note, owner)
+        finally:
+            with self._lock:
+                self.metrics['lookups'] += 1
+                self.metrics['lookup_seconds'] += time.perf_counter() - started
+
+    def _lookup(self, note, owner):
+        tokens, key, shape = self._parse(note, owner)
+        if not tokens:
+            return None
+        with self._lock:
+            if shape not in self._shapes:
+                return None
+            self._shapes.move_to_end(shape)
+            variants = list(self._shapes[shape])
+            for template_tokens, template_key, cleaned, agent_version in variants:
+                if template_key == key:
+                    self.metrics['hits'] += 1
+                    self.metrics['exact_hits'] += 1
+                    return cleaned, agent_version
+
+        for template_tokens, template_key, cleaned, agent_version in variants:
+            patched = patch_template(tokens, template_tokens, cleaned)
+            if patched is not None:
+                with self._lock:
+                    self.metrics['hits'] += 1
+                return patched, f"{NEAR_VERSION_PREFIX}{agent_version}"
+        with self._lock:
+            self.metrics['patches_rejected'] += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics, entries=len(self._shapes))
+        stats['hit_rate'] = round(stats['hits'] / stats['lookups'], 4) if stats['lookups'] else 0.0
+        stats['mean_lookup_ms'] = round(stats.pop('lookup_seconds') * 1000 / max(stats['lookups'], 1), 3)
+        return stats
+
+
+#shared by every request this container serves, partitioned by owner
+index = NearDuplicateIndex()
@@ -0,0 +1,286 @@
+import argparse
+import copy
+import functools
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import boto3
+from boto3.dynamodb.conditions import Attr, AttributeBase, Size
+
+#Parallel Segment/TotalSegments scans for fleet-wide questions (note counts,
+#size distributions, active users) and bulk tools (migrate_notes.py).
+#Every segment is scanned by its own worker, with projection and filter
+#pushed down to DynamoDB. Pages are either streamed to a callback or folded
+#into a per-segment partial by a reducer, then the partials are combined.
+#With processes=True the table factory, reducer, combine and callback are
+#pickled into the worker processes, so they have to be module level functions
+#(or functools.partial of them), and the callback runs in the worker.
+#
+#Usage:
+#  python parallel_scan.py medical-notes --segments 16
+#  python parallel_scan.py medical-notes --segments 16 --since 2025-06-01 --processes
+
+PAGE_SIZE = None    #let DynamoDB fill 1MB pages
+
+
+def table_by_name(name):
+    #picklable table factory - each worker builds its own session and resource
+    #(boto3 sessions and resources arent thread safe)
+    return boto3.session.Session().resource("dynamodb").Table(name)
+
+
+def worker_tables(table):
+    #table factory for a Table object the caller already has: a boto3 Table is
+    #rebuilt by name in every worker, a LocalTable (safe across threads) is shared
+    if isinstance(table, LocalTable):
+        return lambda: table
+    return functools.partial(table_by_name, table.name)
+
+
+def projection_kwargs(projection):
+    #attribute names -> ProjectionExpression with placeholders (status, size, ... are reserved words)
+    names = {f"#p{i}": name for i, name in enumerate(projection)}
+    return {'ProjectionExpression': ', '.join(names), 'ExpressionAttributeNames': names}
+
+
+def scan_segment(table, segment, total_segments, projection=None, filter_expression=None,
+                 page_size=PAGE_SIZE, consistent=False, cursor=None):
+    #yields (items, cursor, scanned) per page; cursor is None after the last page.
+    #With a filter a page can be empty while more pages follow
+    kwargs = {'Segment': segment, 'TotalSegments': total_segments}
+    if projection:
+        kwargs.update(projection_kwargs(projection))
+    if filter_expression is not None:
+        kwargs['FilterExpression'] = filter_expression
+    if page_size:
+        kwargs['Limit'] = page_size
+    if consistent:
+        kwargs['ConsistentRead'] = True
+    while True:
+        if cursor:
+            kwargs['ExclusiveStartKey'] = cursor
+        response = table.scan(**kwargs)
+        cursor = response.get('LastEvaluatedKey')
+        yield response['Items'], cursor, response.get('ScannedCount', len(response['Items']))
+        if not cursor:
+            return
+
+
+def _scan_worker(table_factory, segment, total_segments, options, reducer, initial, callback, cursor):
+    table = table_factory()
+    result = copy.deepcopy(initial)
+    scanned = count = pages = 0
+    for items, next_cursor, page_scanned in scan_segment(table, segment, total_segments, cursor=cursor, **options):
+        scanned += page_scanned
+        count += len(items)
+        pages += 1
+        if reducer:
+            result = reducer(result, items)
+        if callback:
+            callback(segment, items, next_cursor)
+    return {'segment': segment, 'result': result, 'scanned': scanned, 'count': count, 'pages': pages}
+
+
+def parallel_scan(table_factory, segments=8, projection=None, filter_expression=None,
+                  reducer=None, initial=None, combine=None, callback=None,
+                  processes=False, workers=None, page_size=PAGE_SIZE, consistent=False,
+                  only_segments=None, start_cursors=None):
+    #reducer(partial, items) -> partial runs inside the workers, starting from a copy of
+    #initial; combine(a, b) merges the partials (without it 'result' is the list of them).
+    #callback(segment, items, cursor) sees every page, cursor being where to resume.
+    #only_segments/start_cursors resume a scan that was checkpointed from the callback
+    options = {'projection': projection, 'filter_expression': filter_expression,
+               'page_size': page_size, 'consistent': consistent}
+    todo = sorted(only_segments) if only_segments is not None else list(range(segments))
+    start_cursors = start_cursors or {}
+    started = time.time()
+
+    outcomes = []
+    if todo:
+        pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        with pool_class(max_workers=min(workers or len(todo), len(todo))) as pool:
+            futures = [pool.submit(_scan_worker, table_factory, segment, segments, options,
+                                   reducer, initial, callback, start_cursors.get(segment))
+                       for segment in todo]
+            outcomes = [future.result() for future in futures]
+
+    partials = [outcome['result'] for outcome in outcomes]
+    if reducer and combine:
+        result = functools.reduce(combine, partials) if partials else copy.deepcopy(initial)
+    else:
+        result = partials if reducer else None
+    return {
+        'result': result,
+        'scanned': sum(outcome['scanned'] for outcome in outcomes),
+        'count': sum(outcome['count'] for outcome in outcomes),
+        'pages': sum(outcome['pages'] for outcome in outcomes),
+        'seconds': round(time.time() - started, 3)
+    }
+
+
+class LocalTable:
+    #in-memory stand-in for a table's scan API, for tests and benchmarks.
+    #Items are split into segments by a hash of the partition key like DynamoDB
+    #does, Limit counts items scanned before the filter, and latency is slept
+    #on every request to model the round trip
+
+    def __init__(self, items, hash_key='note_id', range_key=None, latency=0.0, max_page_items=1000, name='local'):
+        self.items = list(items)
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.latency = latency
+        self.max_page_items = max_page_items
+        self.name = name
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    def _key(self, item):
+        key = {self.hash_key: item[self.hash_key]}
+        if self.range_key:
+            key[self.range_key] = item[self.range_key]
+        return key
+
+    def _position_key(self, key):
+        return key[self.hash_key], key.get(self.range_key)
+
+    def _segment(self, segment, total_segments):
+        #(items, key -> position) of one segment, split once per TotalSegments
+        with self._lock:
+            if total_segments not in self._segments:
+                split = [[] for _ in range(total_segments)]
+                for item in self.items:
+                    split[zlib.crc32(str(item[self.hash_key]).encode('utf-8')) % total_segments].append(item)
+                self._segments[total_segments] = [
+                    (items, {self._position_key(item): i for i, item in enumerate(items)}) for items in split
+                ]
+            return self._segments[total_segments][segment]
+
+    def scan(self, Segment=0, TotalSegments=1, Limit=None, ExclusiveStartKey=None, ProjectionExpression=None,
+             ExpressionAttributeNames=None, FilterExpression=None, ConsistentRead=False):
+        if self.latency:
+            time.sleep(self.latency)
+        items, positions = self._segment(Segment, TotalSegments)
+        start = positions[self._position_key(ExclusiveStartKey)] + 1 if ExclusiveStartKey else 0
+        limit = min(Limit or self.max_page_items, self.max_page_items)
+        page = items[start:start + limit]
+
+        if FilterExpression is not None:
+            matched = [item for item in page if matches(FilterExpression, item)]
+        else:
+            matched = page
+        if ProjectionExpression:
+            names = ExpressionAttributeNames or {}
+            attributes = [names.get(name.strip(), name.strip()) for name in ProjectionExpression.split(',')]
+            matched = [{name: item[name] for name in attributes if name in item} for item in matched]
+
+        response = {'Items': [dict(item) for item in matched], 'Count': len(matched), 'ScannedCount': len(page)}
+        if start + limit < len(items):
+            response['LastEvaluatedKey'] = self._key(page[-1])
+        return response
+
+
+def _operand(value, item):
+    if isinstance(value, Size):
+        return len(item.get(value.get_expression()['values'][0].name, ()))
+    if isinstance(value, AttributeBase):
+        return item.get(value.name)
+    return value
+
+
+def matches(condition, item):
+    #evaluates a boto3 condition (Attr(...)) against a plain item, for LocalTable
+    expression = condition.get_expression()
+    operator, values = expression['operator'], expression['values']
+    if operator == 'AND':
+        return matches(values[0], item) and matches(values[1], item)
+    if operator == 'OR':
+        return matches(values[0], item) or matches(values[1], item)
+    if operator == 'NOT':
+        return not matches(values[0], item)
+    if operator == 'attribute_exists':
+        return values[0].name in item
+    if operator == 'attribute_not_exists':
+        return values[0].name not in item
+
+    left = _operand(values[0], item)
+    if operator == '<>':
+        return left != _operand(values[1], item)
+    if left is None:
+        return False
+    if operator == '=':
+        return left == _operand(values[1], item)
+    if operator == '<':
+        return left < _operand(values[1], item)
+    if operator == '<=':
+        return left <= _operand(values[1], item)
+    if operator == '>':
+        return left > _operand(values[1], item)
+    if operator == '>=':
+        return left >= _operand(values[1], item)
+    if operator == 'BETWEEN':
+        return _operand(values[1], item) <= left <= _operand(values[2], item)
+    if operator == 'IN':
+        return left in values[1]
+    if operator == 'begins_with':
+        return left.startswith(values[1])
+    if operator == 'contains':
+        return values[1] in left
+    raise ValueError(f"Unsupported condition for LocalTable: {operator}")
+
+
+#fleet summary used by the CLI - module level so it works with processes=True
+
+def new_summary():
+    return {'notes': 0, 'original_chars': 0, 'cleaned_chars': 0, 'users': set(), 'size_histogram': {}}
+
+
+def summarize_page(summary, items):
+    for item in items:
+        original_length = int(item.get('original_length', 0))
+        summary['notes'] += 1
+        summary['original_chars'] += original_length
+        summary['cleaned_chars'] += int(item.get('cleaned_length', 0))
+        summary['users'].add(item['user_id'])
+        bucket = 1 << max(original_length - 1, 0).bit_length() #next power of two
+        summary['size_histogram'][bucket] = summary['size_histogram'].get(bucket, 0) + 1
+    return summary
+
+
+def merge_summaries(a, b):
+    merged = {name: a[name] + b[name] for name in ('notes', 'original_chars', 'cleaned_chars')}
+    merged['users'] = a['users'] | b['users']
+    merged['size_histogram'] = dict(a['size_histogram'])
+    for bucket, count in b['size_histogram'].items():
+        merged['size_histogram'][bucket] = merged['size_histogram'].get(bucket, 0) + count
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fleet-wide summary of a notes table via a parallel scan")
+    parser.add_argument('table', help="e.g. medical-notes or medical-notes-v2")
+    parser.add_argument('--segments', type=int, default=8)
+    parser.add_argument('--since', help="only notes created at or after this ISO timestamp")
+    parser.add_argument('--processes', action='store_true', help="scan segments in worker processes")
+    args = parser.parse_args()
+
+    filter_expression = Attr('created_at').gte(args.since) if args.since else None
+    scan = parallel_scan(
+        functools.partial(table_by_name, args.table), args.segments,
+        projection=['user_id', 'original_length', 'cleaned_length'],
+        filter_expression=filter_expression,
+        reducer=summarize_page, initial=new_summary(), combine=merge_summaries,
+        processes=args.processes
+    )
+    summary = scan['result']
+    print(f"Scanned {scan['scanned']} items in {scan['seconds']}s "
+          f"({scan['scanned'] / max(scan['seconds'], 1e-6):.0f} items/s, {args.segments} segments)")
+    print(f"Notes: {summary['notes']}  active users: {len(summary['users'])}")
+    print(f"Characters: {summary['original_chars']} original, {summary['cleaned_chars']} cleaned")
+    print("Original length (chars <= bucket): notes")
+    for bucket in sorted(summary['size_histogram']):
+        print(f"  {bucket:>8}: {summary['size_histogram'][bucket]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.dynamodb.conditions import Key
+import db_client
+import usage_rollups
+from checkpoints import load_checkpoint, save_checkpoint
+
+#Deletes everything stored for one account: notes (paged through the notes
+#table serving reads, removed with parallel BatchWriteItem from every notes
+#table the migration phase writes to), the user's search
+#index, tombstones, change log, version counter and usage rollups, and finally
+#the medical-users record. Deleting a missing item is a no-op, so the purge is
+#idempotent; the notes cursor is checkpointed after every page so it can resume
+#after a crash.
+#Some data can come back after a purge. The notes stream lags behind: the
+#notes' REMOVE records reach usage_rollups.py afterwards and count 'deleted'
+#for the user again, and search_index.py may still index notes saved shortly
+#before the purge. A note still in a container's write journal is saved again
+#when it is replayed (a purge leaves no tombstones). Run the purge again once the
+#stream has caught up and the journals are empty (python write_journal.py status).
+#
+#Usage:
+#  python purge_account.py USER_ID --email doctor@hospital.com --checkpoint purge.ckpt
+
+dynamodb = boto3.resource("dynamodb")
+users_table = dynamodb.Table("medical-users")
+search_table = dynamodb.Table("medical-note-search")
+tombstones_table = dynamodb.Table("medical-note-tombstones")
+changes_table = dynamodb.Table("medical-note-changes")
+versions_table = dynamodb.Table("medical-note-versions")
+
+PAGE_SIZE = 500
+BATCH_SIZE = 25          #BatchWriteItem limit
+MAX_BATCH_ATTEMPTS = 8
+VERIFY_PASSES = 3
+
+
+def batch_delete(table_name, keys):
+    #deletes up to 25 keys, retrying whatever DynamoDB leaves unprocessed
+    pending = {table_name: [{'DeleteRequest': {'Key': key}} for key in keys]}
+    for attempt in range(MAX_BATCH_ATTEMPTS):
+        response = dynamodb.batch_write_item(RequestItems=pending)
+        pending = response.get('UnprocessedItems') or {}
+        if not pending:
+            return len(keys)
+        time.sleep(min(0.05 * 2 ** attempt, 2)) #throttled, back off
+    raise Exception(f"Batch delete on {table_name} did not complete after retries")
+
+
+def delete_keys(pool, table_name, keys):
+    futures = [pool.submit(batch_delete, table_name, keys[start:start + BATCH_SIZE])
+               for start in range(0, len(keys), BATCH_SIZE)]
+    return sum(future.result() for future in futures)
+
+
+def _note_keys_page(user_id, cursor):
+    kwargs = {'ProjectionExpression': 'note_id, user_id, created_at', 'Limit': PAGE_SIZE}
+    if cursor:
+        kwargs['ExclusiveStartKey'] = cursor
+    response = db_client.query_user_notes(user_id, **kwargs)
+    return response['Items'], response.get('LastEvaluatedKey')
+
+
+def delete_notes(pool, notes):
+    #mid-migration every note has a copy in both tables
+    for table_name, keys in db_client.note_keys_by_table(notes).items():
+        delete_keys(pool, table_name, keys)
+    return len(notes)
+
+
+def _partition_keys(table, user_id, range_key, hash_key='user_id'):
+    #every item in a partition, keys only
+    keys = []
+    kwargs = {'KeyConditionExpression': Key(hash_key).eq(user_id), 'ProjectionExpression': '#hash, #range',
+              'ExpressionAttributeNames': {'#hash': hash_key, '#range': range_key}}
+    while True:
+        response = table.query(**kwargs)
+        keys.extend({hash_key: user_id, range_key: item[range_key]} for item in response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return keys
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def purge_user(user_id, email=None, concurrency=4, checkpoint_path=None, progress=None):
+    checkpoint = load_checkpoint(checkpoint_path) or {'user_id': user_id, 'cursor': None, 'deleted': 0, 'stage': 'notes'}
+    if checkpoint['user_id'] != user_id:
+        raise ValueError("Checkpoint belongs to a different user")
+
+    started = time.time()
+    deleted_this_run = 0
+
+    def report():
+        if progress:
+            elapsed = max(time.time() - started, 1e-6)
+            progress(f"\rDeleted {checkpoint['deleted']} notes ({deleted_this_run / elapsed:.0f} items/s)")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        if checkpoint['stage'] == 'notes':
+            cursor = checkpoint['cursor']
+            while True:
+                notes, cursor = _note_keys_page(user_id, cursor)
+                deleted = delete_notes(pool, notes)
+                checkpoint['deleted'] += deleted
+                deleted_this_run += deleted
+                checkpoint['cursor'] = cursor
+                if checkpoint_path:
+                    save_checkpoint(checkpoint_path, checkpoint)
+                report()
+                if not cursor:
+                    break
+
+            #the GSI is eventually consistent and notes may have been saved meanwhile
+            for _ in range(VERIFY_PASSES):
+                notes, _cursor = _note_keys_page(user_id, None)
+                if not notes:
+                    break
+                deleted = delete_notes(pool, notes)
+                checkpoint['deleted'] += deleted
+                deleted_this_run += deleted
+                report()
+
+            checkpoint['stage'] = 'derived'
+            if checkpoint_path:
+                save_checkpoint(checkpoint_path, checkpoint)
+
+        if checkpoint['stage'] == 'derived':
+            #search postings, tombstones, the change log, the version counter and usage all carry the user's data
+            delete_keys(pool, search_table.name, _partition_keys(search_table, user_id, 'term'))
+            delete_keys(pool, tombstones_table.name, _partition_keys(tombstones_table, user_id, 'tombstone_key'))
+            delete_keys(pool, changes_table.name, _partition_keys(changes_table, user_id, 'change_key'))
+            usage_table = usage_rollups.usage_table
+            delete_keys(pool, usage_table.name,
+                        _partition_keys(usage_table, usage_rollups.user_scope(user_id), 'bucket', hash_key='scope'))
+            versions_table.delete_item(Key={'user_id': user_id})
+            checkpoint['stage'] = 'user'
+            if checkpoint_path:
+                save_checkpoint(checkpoint_path, checkpoint)
+
+    if checkpoint['stage'] == 'user':
+        if email:
+            users_table.delete_item(Key={'email': email})
+            checkpoint['user_record_deleted'] = True
+        checkpoint['stage'] = 'done'
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, checkpoint)
+
+    checkpoint['seconds'] = round(time.time() - started, 3)
+    return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete all data stored for one account")
+    parser.add_argument('user_id')
+    parser.add_argument('--email', help="account email, needed to delete the medical-users record")
+    parser.add_argument('--concurrency', type=int, default=4, help="parallel BatchWriteItem calls")
+    parser.add_argument('--checkpoint', help="checkpoint file for resuming")
+    args = parser.parse_args()
+
+    if not args.email:
+        print("No --email given: notes and derived data will be purged, the medical-users record will not")
+
+    result = purge_user(args.user_id, args.email, args.concurrency, args.checkpoint,
+                        progress=lambda line: print(line, end='', flush=True))
+    rate = result['deleted'] / max(result['seconds'], 1e-6)
+    print(f"\nPurge complete: {result['deleted']} notes in {result['seconds']}s ({rate:.0f} notes/s)")
+
+
+if __name__ == "__main__":
+    main()
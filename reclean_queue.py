@@ -0,0 +1,175 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+import boto3
+import json_codec
+from deadline import Deadline, DeadlineExceeded, SAVE_RESERVE_SECONDS
+from local_expander import DEGRADED_VERSION, LOCAL_VERSION_PREFIX
+
+#Lazy re-cleaning of notes produced by an outdated agent version.
+#Reads serve the stored cleaned_note immediately and hand outdated notes to
+#enqueue_outdated(). With RECLEAN_QUEUE_URL set they go to SQS and are
+#processed by reclean_handler; without it (local/container mode) a
+#background thread in this process works through them. Notes whose cleaning
+#is not final (pending_status set, e.g. degraded answers) belong to
+#status_sweeper.py and are not enqueued here.
+
+logger = logging.getLogger(__name__)
+
+RECLEAN_QUEUE_URL = os.environ.get("RECLEAN_QUEUE_URL")
+
+#a worker stops taking messages from its batch with less time than this left,
+#and hands them back to the queue instead of timing out on all of them
+RECLEAN_MIN_SECONDS = float(os.environ.get("RECLEAN_MIN_SECONDS", "20"))
+
+#the same hot note is read over and over - only enqueue it once per window
+DEDUP_SECONDS = int(os.environ.get("RECLEAN_DEDUP_SECONDS", "900"))
+DEDUP_MAX_ENTRIES = 10000
+
+_recent = OrderedDict() #note_id -> enqueued_at
+_recent_lock = threading.Lock()
+_local_queue = queue.Queue(maxsize=1000)
+_worker = None
+_sqs = None
+
+
+def current_agent_version():
+    try:
+        from agent_client import AGENT_VERSION
+        return AGENT_VERSION
+    except Exception:
+        return None #agent not configured here, nothing can be judged outdated
+
+
+def is_outdated(item, current=None):
+    #notes saved before versions were recorded count as outdated too, notes the
+    #user edited by hand never are, nor are notes served by the local expander
+    #or waiting for the status sweeper
+    current = current or current_agent_version()
+    if not current or not item.get('original_note') or item.get('edited_at') or item.get('pending_status'):
+        return False
+    version = str(item.get('agent_version') or '')
+    if version.startswith(LOCAL_VERSION_PREFIX) or version == DEGRADED_VERSION:
+        return False
+    return item.get('agent_version') != current
+
+
+def _claim(note_id):
+    now = time.time()
+    with _recent_lock:
+        enqueued_at = _recent.get(note_id)
+        if enqueued_at is not None and now - enqueued_at < DEDUP_SECONDS:
+            return False
+        _recent[note_id] = now
+        _recent.move_to_end(note_id)
+        while len(_recent) > DEDUP_MAX_ENTRIES:
+            _recent.popitem(last=False)
+        return True
+
+
+def enqueue_outdated(items):
+    #items: raw note items as read from DynamoDB; returns how many were enqueued
+    current = current_agent_version()
+    if not current:
+        return 0
+    #created_at lets the worker address the note directly in medical-notes-v2
+    messages = [{'note_id': item['note_id'], 'user_id': item['user_id'], 'created_at': item.get('created_at')}
+                for item in items if is_outdated(item, current) and _claim(item['note_id'])]
+    if not messages:
+        return 0
+
+    try:
+        if RECLEAN_QUEUE_URL:
+            _send_to_sqs(messages)
+        else:
+            _ensure_worker()
+            for message in messages:
+                _local_queue.put_nowait(message)
+    except Exception as e:
+        #best effort - the note will be picked up on a later read
+        logger.warning(f"Failed to enqueue re-clean: {type(e).__name__}")
+        with _recent_lock:
+            for message in messages:
+                _recent.pop(message['note_id'], None)
+        return 0
+    return len(messages)
+
+
+def _send_to_sqs(messages):
+    global _sqs
+    if _sqs is None:
+        _sqs = boto3.client("sqs")
+    for start in range(0, len(messages), 10): #SendMessageBatch takes up to 10 entries
+        batch = messages[start:start + 10]
+        _sqs.send_message_batch(
+            QueueUrl=RECLEAN_QUEUE_URL,
+            Entries=[{'Id': str(i), 'MessageBody': json_codec.dumps(message)} for i, message in enumerate(batch)]
+        )
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        _worker = threading.Thread(target=_drain_local_queue, name="reclean-worker", daemon=True)
+        _worker.start()
+
+
+def _drain_local_queue():
+    while True:
+        message = _local_queue.get()
+        try:
+            reclean_note(message['note_id'], message['user_id'], message.get('created_at'))
+        except Exception as e:
+            logger.warning(f"Re-clean failed for note {message['note_id']}: {type(e).__name__}")
+        finally:
+            _local_queue.task_done()
+
+
+def reclean_note(note_id, user_id, created_at=None, deadline=None):
+    #returns True if the note was re-cleaned, False if it no longer needs it
+    from agent_client import get_cleaned_note, AGENT_VERSION
+    from db_client import load_note, note_write_actions, run_note_writes, sync_cleaned_note_change, settled_item
+
+    item = load_note(note_id, user_id, created_at)
+    if not item or not is_outdated(item, AGENT_VERSION):
+        return False
+
+    cleaned_note = get_cleaned_note(item['original_note'], lane='bulk',
+                                    deadline=deadline.reserve(SAVE_RESERVE_SECONDS) if deadline else None)
+    recleaned = settled_item(item, cleaned_note=cleaned_note, cleaned_length=len(cleaned_note),
+                             agent_version=AGENT_VERSION, recleaned_at=time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()))
+    #lose the race gracefully if the note was edited, deleted or re-cleaned meanwhile
+    written = run_note_writes(note_write_actions(
+        item, recleaned,
+        'cleaned_note = :old AND attribute_not_exists(edited_at)',
+        {':old': item['cleaned_note']}
+    ))
+    if not written:
+        return False
+
+    sync_cleaned_note_change(user_id, note_id, item.get('created_at'))
+    return True
+
+
+def reclean_handler(event, context):
+    #SQS consumer; failed messages, and those there was no time left for, are
+    #reported back so only they are retried
+    deadline = Deadline.from_context(context)
+    failures = []
+    for record in event.get('Records', []):
+        if deadline.remaining() < RECLEAN_MIN_SECONDS:
+            failures.append({'itemIdentifier': record.get('messageId')})
+            continue
+        try:
+            message = json_codec.loads(record['body'])
+            reclean_note(message['note_id'], message['user_id'], message.get('created_at'), deadline)
+        except DeadlineExceeded:
+            logger.warning(f"Re-clean out of time - Message: {record.get('messageId')}")
+            failures.append({'itemIdentifier': record.get('messageId')})
+        except Exception as e:
+            logger.warning(f"Re-clean failed - Message: {record.get('messageId')}, Error: {type(e).__name__}")
+            failures.append({'itemIdentifier': record.get('messageId')})
+    return {'batchItemFailures': failures}
@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import boto3
+import db_client
+from agent_client import get_cleaned_note, AGENT_VERSION
+from checkpoints import load_checkpoint, save_checkpoint
+from db_client import note_write_actions, sync_cleaned_note_change, settled_item
+from throttle import TokenBucket
+
+#Re-cleans stored notes through the Bedrock agent, e.g. after publishing a
+#new agent alias. Scans the notes table serving reads (or queries one user's notes), runs
+#original_note through get_cleaned_note with bounded concurrency and a rate
+#limit, and writes changed results back in conditional transaction batches.
+#The scan cursor is checkpointed after every page, so a crash resumes there.
+#With --async a whole page is cleaned at once on one event loop
+#(async_client.py) instead of `concurrency` threads - use a bigger page size
+#to keep hundreds of agent calls in flight.
+#
+#Usage:
+#  python reprocess_notes.py --checkpoint reprocess.ckpt --concurrency 8 --rate 5
+#  python reprocess_notes.py --async --page-size 500 --rate 100
+#  python reprocess_notes.py --user-id USER_ID --dry-run
+
+dynamodb = boto3.resource("dynamodb")
+
+PAGE_SIZE = 100
+WRITE_BATCH_SIZE = 25   #TransactWriteItems takes up to 100 actions
+AGENT_ATTEMPTS = 3
+WRITE_ATTEMPTS = 5
+
+
+def fetch_page(cursor, user_id=None, page_size=PAGE_SIZE):
+    #whole items - the write back replaces the note, guarded by a condition
+    kwargs = {'Limit': page_size}
+    if cursor:
+        kwargs['ExclusiveStartKey'] = cursor
+    if user_id:
+        response = db_client.query_user_notes(user_id, **kwargs)
+    else:
+        response = db_client.notes_read_table().scan(**kwargs)
+    return response['Items'], response.get('LastEvaluatedKey')
+
+
+def clean_with_retry(original_note, bucket):
+    for attempt in range(AGENT_ATTEMPTS):
+        bucket.acquire()
+        try:
+            return get_cleaned_note(original_note, lane='bulk')
+        except ValueError:
+            raise #bad input, retrying will not help
+        except Exception:
+            if attempt == AGENT_ATTEMPTS - 1:
+                raise
+            time.sleep(2 ** attempt)
+
+
+async def _clean_async(original_note, bucket):
+    import async_client
+    for attempt in range(AGENT_ATTEMPTS):
+        wait = bucket.try_acquire()
+        while wait:
+            await asyncio.sleep(wait)
+            wait = bucket.try_acquire()
+        try:
+            return await async_client.get_cleaned_note(original_note)
+        except ValueError:
+            raise
+        except Exception:
+            if attempt == AGENT_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
+
+def clean_page_async(notes, bucket):
+    #one finished Future per note, all cleaned concurrently on one event loop
+    import async_client
+
+    async def run():
+        try:
+            return await asyncio.gather(*(_clean_async(note, bucket) for note in notes), return_exceptions=True)
+        finally:
+            await async_client.close()
+
+    futures = []
+    for result in asyncio.run(run()):
+        future = Future()
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+        futures.append(future)
+    return futures
+
+
+def _write_actions(item, cleaned_note):
+    reprocessed = settled_item(item, cleaned_note=cleaned_note, cleaned_length=len(cleaned_note),
+                               agent_version=AGENT_VERSION, reprocessed_at=time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()))
+    #skip notes deleted or edited since they were read
+    return note_write_actions(item, reprocessed, 'cleaned_note = :old AND attribute_not_exists(edited_at)',
+                              {':old': item['cleaned_note']})
+
+
+def write_batch(updates):
+    #updates: [(item, cleaned_note)], returns (written, skipped)
+    client = dynamodb.meta.client
+    skipped = 0
+    for attempt in range(WRITE_ATTEMPTS):
+        if not updates:
+            return 0, skipped
+        #mid-migration each note is one action per table, remember which update each came from
+        actions, owners = [], []
+        for i, (item, cleaned) in enumerate(updates):
+            for action in _write_actions(item, cleaned):
+                actions.append(action)
+                owners.append(i)
+        try:
+            client.transact_write_items(TransactItems=actions)
+            #delta sync and history ETags depend on cleaned_note
+            for item, _ in updates:
+                sync_cleaned_note_change(item['user_id'], item['note_id'], item.get('created_at'))
+            return len(updates), skipped
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons', [])
+            failed = {owners[i] for i, reason in enumerate(reasons) if reason.get('Code') == 'ConditionalCheckFailed'}
+            if failed:
+                #drop the notes that changed underneath us and retry the rest right away
+                skipped += len(failed)
+                updates = [update for i, update in enumerate(updates) if i not in failed]
+                continue
+            time.sleep(0.1 * 2 ** attempt) #transaction conflict or throttling
+    raise Exception("Failed to write reprocessed notes after retries")
+
+
+def format_progress(stats, total, started, processed_this_run):
+    elapsed = max(time.time() - started, 1e-6)
+    rate = processed_this_run / elapsed
+    line = f"\rProcessed {stats['processed']}"
+    if total:
+        line += f"/{total}"
+    line += f" | {rate:.1f} notes/s | updated {stats['updated']} skipped {stats['skipped']} failed {stats['failed']}"
+    if total and rate > 0:
+        remaining = max(total - stats['processed'], 0) / rate
+        line += f" | ETA {int(remaining // 3600):d}:{int(remaining % 3600 // 60):02d}:{int(remaining % 60):02d}"
+    return line
+
+
+def reprocess_notes(user_id=None, concurrency=8, rate=5.0, checkpoint_path=None,
+                    page_size=PAGE_SIZE, total=None, dry_run=False, progress=None, use_async=False):
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint and checkpoint.get('user_id') != user_id:
+        raise ValueError("Checkpoint belongs to a different run")
+    if checkpoint and checkpoint.get('done'):
+        return checkpoint['stats']
+
+    cursor = checkpoint['cursor'] if checkpoint else None
+    stats = checkpoint['stats'] if checkpoint else {'processed': 0, 'updated': 0, 'unchanged': 0,
+                                                    'skipped': 0, 'failed': 0}
+    bucket = TokenBucket(rate, capacity=concurrency)
+    started = time.time()
+    processed_this_run = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            items, cursor = fetch_page(cursor, user_id, page_size)
+            items = [item for item in items if item.get('original_note') and not item.get('edited_at')]
+            if use_async:
+                futures = list(zip(items, clean_page_async([item['original_note'] for item in items], bucket)))
+            else:
+                futures = [(item, pool.submit(clean_with_retry, item['original_note'], bucket)) for item in items]
+
+            updates = []
+            for item, future in futures:
+                try:
+                    cleaned_note = future.result()
+                    if cleaned_note == item.get('cleaned_note'):
+                        stats['unchanged'] += 1
+                    else:
+                        updates.append((item, cleaned_note))
+                except Exception:
+                    stats['failed'] += 1
+                stats['processed'] += 1
+                processed_this_run += 1
+
+                if len(updates) >= WRITE_BATCH_SIZE:
+                    if not dry_run:
+                        written, skipped = write_batch(updates)
+                        stats['updated'] += written
+                        stats['skipped'] += skipped
+                    updates = []
+                if progress:
+                    progress(format_progress(stats, total, started, processed_this_run))
+
+            if updates and not dry_run:
+                written, skipped = write_batch(updates)
+                stats['updated'] += written
+                stats['skipped'] += skipped
+
+            #page fully written - safe to move the cursor
+            if checkpoint_path:
+                save_checkpoint(checkpoint_path, {'user_id': user_id, 'cursor': cursor,
+                                                  'stats': stats, 'done': cursor is None})
+            if not cursor:
+                break
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-clean stored notes through the Bedrock agent")
+    parser.add_argument('--user-id', help="only reprocess this user's notes")
+    parser.add_argument('--concurrency', type=int, default=8, help="agent calls in flight")
+    parser.add_argument('--rate', type=float, default=5.0, help="max agent calls per second")
+    parser.add_argument('--checkpoint', help="checkpoint file for resuming")
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help="clean notes but do not write them back")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="clean each page concurrently on an event loop instead of threads")
+    args = parser.parse_args()
+
+    #table item count is refreshed roughly every 6 hours - good enough for an ETA
+    total = None if args.user_id else db_client.notes_read_table().item_count
+
+    stats = reprocess_notes(args.user_id, args.concurrency, args.rate, args.checkpoint,
+                            args.page_size, total, args.dry_run,
+                            progress=lambda line: print(line, end='', flush=True), use_async=args.use_async)
+    print(f"\nDone: {stats}")
+
+
+if __name__ == "__main__":
+    main()
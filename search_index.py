@@ -0,0 +1,267 @@
+import heapq
+import math
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer
+
+#Per-user inverted index over cleaned notes.
+#One item per (user_id, term) holding a Binary Set of postings; each posting
+#is the 16 byte note UUID followed by one byte of term frequency. Saves add
+#postings with atomic ADD updates, so indexing is incremental and idempotent.
+#The per-user document count only moves when a note's marker item (#doc#<note_id>)
+#is created or deleted, so re-saves and journal replays dont count a note twice.
+#Queries touch one item per query term plus the top results, so latency does
+#not grow with the number of notes a user has.
+#The index is kept up from the notes table's change stream (index_stream_handler),
+#not on the save path - a note shows up in search once its stream batch is
+#applied, usually within seconds. Every update above is idempotent, so a retried
+#batch or a stream replayed from its trim horizon leaves the index as it was.
+
+dynamodb = boto3.resource("dynamodb")
+search_table = dynamodb.Table("medical-note-search")
+
+STATS_TERM = "#stats"           #per-user document count, used for idf
+DOC_TERM_PREFIX = "#doc#"       #one marker per indexed note
+MAX_TERM_LENGTH = 64
+PREFIX_EXPANSION_LIMIT = 50     #max index terms a prefix query expands to
+INDEX_WRITE_CONCURRENCY = int(os.environ.get("SEARCH_INDEX_CONCURRENCY", "8"))
+
+#BM25 term-frequency saturation
+BM25_K1 = 1.2
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have in is it its of on or that the
+their there this to was were will with
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+_index_pool = ThreadPoolExecutor(max_workers=INDEX_WRITE_CONCURRENCY)
+_deserializer = TypeDeserializer()
+
+
+def tokenize(text):
+    return [token[:MAX_TERM_LENGTH] for token in _TOKEN_RE.findall(text.lower())
+            if token not in STOPWORDS]
+
+
+def term_frequencies(text):
+    counts = {}
+    for token in tokenize(text):
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+def encode_posting(note_id, tf):
+    return uuid.UUID(note_id).bytes + bytes([min(tf, 255)])
+
+
+def decode_postings(postings):
+    #{note_id: tf}; the same note can appear twice if it was re-indexed with a new tf
+    decoded = {}
+    for posting in postings:
+        raw = getattr(posting, 'value', posting)
+        note_id = str(uuid.UUID(bytes=bytes(raw[:16])))
+        decoded[note_id] = max(decoded.get(note_id, 0), raw[16])
+    return decoded
+
+
+def _update_term(user_id, term, action, posting):
+    update = {}
+    if action == 'DELETE':
+        #an update creates missing items - a removal arriving after a purge must not
+        update['ConditionExpression'] = 'attribute_exists(term)'
+    try:
+        search_table.update_item(
+            Key={'user_id': user_id, 'term': term},
+            UpdateExpression=f'{action} postings :p',
+            ExpressionAttributeValues={':p': {posting}},
+            **update
+        )
+    except search_table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+    except Exception as e:
+        #a term present in almost every note can outgrow the 400KB item limit;
+        #its idf is ~0 anyway so it simply stops being indexed
+        print(f"Failed to update search term for user {user_id}: {type(e).__name__}")
+
+
+def _mark_document(user_id, note_id, action):
+    #True if the note's marker was created ('ADD') or deleted ('DELETE') just now
+    client = search_table.meta.client
+    key = {'user_id': user_id, 'term': f"{DOC_TERM_PREFIX}{note_id}"}
+    try:
+        if action == 'ADD':
+            search_table.put_item(Item=key, ConditionExpression='attribute_not_exists(term)')
+        else:
+            search_table.delete_item(Key=key, ConditionExpression='attribute_exists(term)')
+        return True
+    except client.exceptions.ConditionalCheckFailedException:
+        return False
+
+
+def _update_note(user_id, note_id, text, action, doc_delta):
+    counts = term_frequencies(text)
+    if not counts:
+        return 0
+    futures = [_index_pool.submit(_update_term, user_id, term, action, encode_posting(note_id, tf))
+               for term, tf in counts.items()]
+    for future in futures:
+        future.result()
+
+    if _mark_document(user_id, note_id, action):
+        search_table.update_item(
+            Key={'user_id': user_id, 'term': STATS_TERM},
+            UpdateExpression='ADD doc_count :d',
+            ExpressionAttributeValues={':d': doc_delta}
+        )
+    return len(counts)
+
+
+def index_note(user_id, note_id, cleaned_note):
+    #returns the number of distinct terms written
+    return _update_note(user_id, note_id, cleaned_note, 'ADD', 1)
+
+
+def remove_note(user_id, note_id, cleaned_note):
+    #cleaned_note must be the text that was indexed, so the postings match exactly
+    return _update_note(user_id, note_id, cleaned_note, 'DELETE', -1)
+
+
+def _image(record, name):
+    image = record['dynamodb'].get(name) or {}
+    return {key: _deserializer.deserialize(value) for key, value in image.items()}
+
+
+def apply_record(record):
+    #one notes stream record; returns the number of distinct terms written
+    old, new = _image(record, 'OldImage'), _image(record, 'NewImage')
+    old_text, new_text = old.get('cleaned_note'), new.get('cleaned_note')
+    if old_text == new_text:
+        return 0 #status and bookkeeping updates leave the text alone
+    note = new or old
+    written = 0
+    if old_text:
+        #edits, re-cleans and deletes - TTL expiry included - drop the old postings
+        written += remove_note(note['user_id'], note['note_id'], old_text)
+    if new_text:
+        written += index_note(note['user_id'], note['note_id'], new_text)
+    return written
+
+
+def index_stream_handler(event, context):
+    #DynamoDB stream consumer; records are applied in order, an exception retries the whole batch
+    records = event.get('Records', [])
+    return {'records': len(records), 'terms': sum(apply_record(record) for record in records)}
+
+
+def parse_query(query):
+    #"chest pa*" -> [('chest', False), ('pa', True)]
+    terms = []
+    for raw in query.lower().split():
+        if raw.endswith('*'):
+            #prefixes skip the stopword filter - "the*" should still find "therapy"
+            tokens = _TOKEN_RE.findall(raw)
+            terms.extend((token, False) for token in tokens[:-1])
+            if tokens:
+                terms.append((tokens[-1][:MAX_TERM_LENGTH], True))
+        else:
+            terms.extend((token, False) for token in tokenize(raw))
+    return terms
+
+
+def _batch_get(table_name, keys, projection=None):
+    items = []
+    for start in range(0, len(keys), 100):
+        request = {'Keys': keys[start:start + 100]}
+        if projection:
+            request['ProjectionExpression'] = projection
+        pending = {table_name: request}
+        while pending:
+            response = dynamodb.batch_get_item(RequestItems=pending)
+            items.extend(response['Responses'].get(table_name, []))
+            pending = response.get('UnprocessedKeys') or {}
+    return items
+
+
+def _prefix_postings(user_id, prefix):
+    #merge the postings of the first index terms starting with prefix
+    response = search_table.query(
+        KeyConditionExpression=Key('user_id').eq(user_id) & Key('term').begins_with(prefix),
+        Limit=PREFIX_EXPANSION_LIMIT
+    )
+    merged = {}
+    for item in response['Items']:
+        for note_id, tf in decode_postings(item.get('postings', ())).items():
+            merged[note_id] = max(merged.get(note_id, 0), tf)
+    return merged
+
+
+def make_snippet(text, terms, width=60):
+    pattern = '|'.join(re.escape(term) + (r'\w*' if is_prefix else r'\b') for term, is_prefix in terms)
+    match = re.search(r'\b(?:' + pattern + ')', text, re.IGNORECASE)
+    if not match:
+        return text[:width * 2] + ('...' if len(text) > width * 2 else '')
+    start = max(0, match.start() - width)
+    end = min(len(text), match.end() + width)
+    return ('...' if start > 0 else '') + text[start:end] + ('...' if end < len(text) else '')
+
+
+def search_notes(user_id, query, limit=10):
+    terms = parse_query(query)
+    if not terms:
+        return []
+
+    #exact terms and the stats item in one round trip, prefixes as range queries
+    exact = sorted({term for term, is_prefix in terms if not is_prefix})
+    keys = [{'user_id': user_id, 'term': term} for term in exact + [STATS_TERM]]
+    items = {item['term']: item for item in _batch_get(search_table.name, keys)}
+    doc_count = int(items.get(STATS_TERM, {}).get('doc_count', 0))
+
+    scores = {}
+    for term, is_prefix in terms:
+        if is_prefix:
+            postings = _prefix_postings(user_id, term)
+        else:
+            postings = decode_postings(items.get(term, {}).get('postings', ()))
+        if not postings:
+            continue
+        df = len(postings)
+        idf = math.log(1 + (max(doc_count, df) - df + 0.5) / (df + 0.5))
+        for note_id, tf in postings.items():
+            scores[note_id] = scores.get(note_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + BM25_K1)
+
+    #over-fetch a little: postings of deleted (or expired) notes are dropped when the note is read
+    top = heapq.nlargest(limit * 2, scores.items(), key=lambda entry: entry[1])
+    if not top:
+        return []
+    from db_client import find_v2_note_key, is_expired, notes_read_table, reads_v2
+    candidates = [note_id for note_id, _ in top]
+    if reads_v2():
+        #postings only hold note ids, medical-notes-v2 keys are resolved through note-id-index
+        keys = [key for key in _index_pool.map(lambda note_id: find_v2_note_key(note_id, user_id), candidates) if key]
+    else:
+        keys = [{'note_id': note_id} for note_id in candidates]
+    notes = _batch_get(notes_read_table().name, keys,
+                       projection='note_id, user_id, cleaned_note, created_at, expires_at')
+    #TTL deletes lag behind, a note past its expires_at is gone already
+    notes_by_id = {note['note_id']: note for note in notes if note.get('user_id') == user_id and not is_expired(note)}
+
+    results = []
+    for note_id, score in top:
+        note = notes_by_id.get(note_id)
+        if not note:
+            continue
+        results.append({
+            'note_id': note_id,
+            'created_at': note['created_at'],
+            'score': round(score, 4),
+            'snippet': make_snippet(note['cleaned_note'], terms)
+        })
+        if len(results) == limit:
+            break
+    return results
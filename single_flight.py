@@ -0,0 +1,193 @@
+import hashlib
+import threading
+import time
+import uuid
+import boto3
+from deadline import DeadlineExceeded
+
+#Single-flight coalescing for agent calls: concurrent callers with the same
+#key share one upstream call and get its result or its error - except a
+#leader's DeadlineExceeded, which is its own budget running out rather than
+#the call failing, so the callers sharing it run the call again themselves.
+#  SingleFlight - threads of one container; the first caller runs the call
+#  run_shared   - across containers, through a short-lived lock item in a
+#                 flight store. The caller that creates the item runs the call
+#                 and writes the result back, the others poll the item for it.
+#                 A finished item stays readable for DONE_SECONDS so callers
+#                 arriving just after it completed still share it; a leader
+#                 that died leaves an item that expires after LOCK_SECONDS.
+
+LOCK_SECONDS = 35       #longer than an agent call can take
+DONE_SECONDS = 5
+POLL_SECONDS = 0.1
+#how long a finished item answers waiters; an abandoned one is free to take at once
+_KEEP_SECONDS = {'done': DONE_SECONDS, 'failed': 1, 'abandoned': -1}
+
+
+def flight_key(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.metrics = {'calls': 0, 'shared': 0}
+
+    def do(self, key, fn):
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    self.metrics['calls'] += 1
+                else:
+                    self.metrics['shared'] += 1
+            if leader:
+                break
+            flight.done.wait()
+            if isinstance(flight.error, DeadlineExceeded):
+                continue
+            if flight.error:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+class DynamoFlightStore:
+    #lock items: flight_key, owner, status (running|done|failed|abandoned), result/error, expires_at (TTL)
+
+    def __init__(self, table_name):
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    def acquire(self, key, owner, now):
+        client = self.table.meta.client
+        try:
+            self.table.put_item(
+                Item={'flight_key': key, 'owner': owner, 'status': 'running', 'expires_at': now + LOCK_SECONDS},
+                ConditionExpression='attribute_not_exists(flight_key) OR expires_at < :now',
+                ExpressionAttributeValues={':now': now}
+            )
+            return True
+        except client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def finish(self, key, owner, status, value, now):
+        client = self.table.meta.client
+        try:
+            self.table.update_item(
+                Key={'flight_key': key},
+                UpdateExpression='SET #status = :status, #value = :value, expires_at = :expires_at',
+                ConditionExpression='#owner = :owner',
+                ExpressionAttributeNames={'#status': 'status', '#value': 'result' if status == 'done' else 'error',
+                                          '#owner': 'owner'},
+                ExpressionAttributeValues={':status': status, ':value': value, ':owner': owner,
+                                           ':expires_at': now + _KEEP_SECONDS[status]}
+            )
+        except client.exceptions.ConditionalCheckFailedException:
+            pass #our lock expired and someone else took over
+
+    def read(self, key):
+        return self.table.get_item(Key={'flight_key': key}, ConsistentRead=True).get('Item')
+
+
+class LocalFlightStore:
+    #in-memory stand-in shared by simulated containers
+
+    def __init__(self):
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, owner, now):
+        with self._lock:
+            item = self.items.get(key)
+            if item and item['expires_at'] >= now:
+                return False
+            self.items[key] = {'flight_key': key, 'owner': owner, 'status': 'running', 'expires_at': now + LOCK_SECONDS}
+            return True
+
+    def finish(self, key, owner, status, value, now):
+        with self._lock:
+            item = self.items.get(key)
+            if item and item['owner'] == owner:
+                item.update({'status': status, 'result' if status == 'done' else 'error': value,
+                             'expires_at': now + _KEEP_SECONDS[status]})
+
+    def read(self, key):
+        with self._lock:
+            item = self.items.get(key)
+            return dict(item) if item else None
+
+
+def _wait_or_acquire(store, key, owner, clock, sleep, deadline):
+    #('done', result), ('failed', error) from another container, or ('leader', None)
+    while True:
+        if deadline:
+            deadline.check("shared agent call")
+        now = int(clock())
+        item = store.read(key)
+        if item and item['expires_at'] >= now:
+            if item['status'] == 'done':
+                return 'done', item['result']
+            if item['status'] == 'failed':
+                return 'failed', item['error']
+            sleep(POLL_SECONDS) #another container is running it
+            continue
+        if store.acquire(key, owner, now):
+            return 'leader', None
+
+
+def _finish(store, key, owner, status, value, clock):
+    try:
+        store.finish(key, owner, status, value, int(clock()))
+    except Exception:
+        pass #waiters fall back once the lock expires
+
+
+def run_shared(store, key, fn, clock=time.time, sleep=time.sleep, metrics=None, deadline=None):
+    #fn() once across every container using store; the others get its result or error
+    owner = uuid.uuid4().hex
+    try:
+        outcome, value = _wait_or_acquire(store, key, owner, clock, sleep, deadline)
+    except DeadlineExceeded:
+        raise
+    except Exception:
+        return fn() #lock table unreachable - better an extra agent call than a failed note
+    if outcome == 'done':
+        if metrics is not None:
+            metrics['remote_shared'] = metrics.get('remote_shared', 0) + 1
+        return value
+    if outcome == 'failed':
+        raise Exception(value)
+
+    try:
+        result = fn()
+    except DeadlineExceeded as e:
+        #out of this caller's time, not a failed call - a waiter takes the call over
+        _finish(store, key, owner, 'abandoned', str(e), clock)
+        raise
+    except Exception as e:
+        _finish(store, key, owner, 'failed', str(e), clock)
+        raise
+    _finish(store, key, owner, 'done', result, clock)
+    return result
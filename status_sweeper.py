@@ -0,0 +1,142 @@
+import argparse
+import logging
+from datetime import datetime, timedelta
+import db_client
+from deadline import Deadline
+from db_client import note_write_actions, run_note_writes, settled_item, sync_cleaned_note_change
+
+#Works through notes whose cleaning is not final, found through the sparse
+#pending-status-index (only notes with a pending_status are in it, so this
+#never scans the notes table):
+#  pending/failed, retry_at due - run through the agent again (bulk lane);
+#                                 success settles the note, failure marks it
+#                                 failed and backs off (BACKOFF_SECONDS, doubling)
+#  after MAX_ATTEMPTS retries or MAX_AGE_HOURS - expired: taken out of the
+#                                 index, the stored cleaned_note is kept
+#  edited by the user           - settled as is
+#Every write is conditional on the note being as it was read, so a re-clean
+#or edit in between wins.
+#
+#Runs on a schedule (status_sweeper_handler) or by hand:
+#  python status_sweeper.py [--limit 100] [--report]
+
+logger = logging.getLogger(__name__)
+
+PENDING_STATUSES = ('pending', 'failed')
+MAX_ATTEMPTS = 5
+MAX_AGE_HOURS = 24
+BACKOFF_SECONDS = 300
+PAGE_SIZE = 50
+
+
+def _timestamp(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+
+def _write(item, new_item):
+    return run_note_writes(note_write_actions(
+        item, new_item,
+        'pending_status = :status AND retry_at = :retry_at',
+        {':status': item['pending_status'], ':retry_at': item['retry_at']}
+    ))
+
+
+def sweep_note(item, now):
+    #what happened to the note: completed, failed, expired, settled or skipped (changed meanwhile)
+    from agent_client import get_cleaned_note, AGENT_VERSION
+
+    if item.get('edited_at'):
+        return 'settled' if _write(item, settled_item(item)) else 'skipped'
+
+    attempts = int(item.get('attempts', 0))
+    too_old = item['created_at'] < _timestamp(now - timedelta(hours=MAX_AGE_HOURS))
+    if attempts >= MAX_ATTEMPTS or too_old:
+        expired = {name: value for name, value in item.items() if name not in db_client.PENDING_ATTRIBUTES}
+        expired.update(status='expired', expired_at=_timestamp(now))
+        return 'expired' if _write(item, expired) else 'skipped'
+
+    try:
+        cleaned_note = get_cleaned_note(item['original_note'], lane='bulk')
+    except Exception as e:
+        logger.warning(f"Retry failed for note {item['note_id']}: {type(e).__name__}")
+        failed = dict(item, status='failed', pending_status='failed', attempts=attempts + 1,
+                      retry_at=_timestamp(now + timedelta(seconds=BACKOFF_SECONDS * 2 ** attempts)))
+        return 'failed' if _write(item, failed) else 'skipped'
+
+    completed = settled_item(item, cleaned_note=cleaned_note, cleaned_length=len(cleaned_note),
+                             agent_version=AGENT_VERSION, recleaned_at=_timestamp(now))
+    if not _write(item, completed):
+        return 'skipped'
+    sync_cleaned_note_change(item['user_id'], item['note_id'], item.get('created_at'))
+    return 'completed'
+
+
+def sweep(now=None, limit=None, deadline=None):
+    #one pass over every due note, oldest first; returns counts per outcome
+    now = now or datetime.utcnow()
+    stats = {'completed': 0, 'failed': 0, 'expired': 0, 'settled': 0, 'skipped': 0}
+    swept = 0
+    for status in PENDING_STATUSES:
+        cursor = None
+        while True:
+            kwargs = {'Limit': PAGE_SIZE}
+            if cursor:
+                kwargs['ExclusiveStartKey'] = cursor
+            response = db_client.query_pending_notes(status, _timestamp(now), **kwargs)
+            for item in response['Items']:
+                if (limit and swept >= limit) or (deadline and deadline.expired()):
+                    return stats
+                stats[sweep_note(item, now)] += 1
+                swept += 1
+            cursor = response.get('LastEvaluatedKey')
+            if not cursor:
+                break
+    return stats
+
+
+def report(now=None):
+    #pending_status -> (notes in the index, of which due now)
+    now = now or datetime.utcnow()
+    counts = {}
+    for status in PENDING_STATUSES:
+        due = _count(status, _timestamp(now))
+        total = _count(status, '~') #sorts after every timestamp
+        counts[status] = (total, due)
+    return counts
+
+
+def _count(status, due_before):
+    total, cursor = 0, None
+    while True:
+        kwargs = {'Select': 'COUNT'}
+        if cursor:
+            kwargs['ExclusiveStartKey'] = cursor
+        response = db_client.query_pending_notes(status, due_before, **kwargs)
+        total += response['Count']
+        cursor = response.get('LastEvaluatedKey')
+        if not cursor:
+            return total
+
+
+def status_sweeper_handler(event, context):
+    #scheduled; stops in time to report back
+    stats = sweep(deadline=Deadline.from_context(context, reserve=5))
+    logger.info(f"Status sweep: {stats}")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retry or expire notes whose cleaning is not final")
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--report', action='store_true', help="only count notes in the pending-status index")
+    args = parser.parse_args()
+
+    if args.report:
+        for status, (total, due) in report().items():
+            print(f"{status:>8}: {total} notes, {due} due")
+        return
+    print(sweep(limit=args.limit))
+
+
+if __name__ == "__main__":
+    main()
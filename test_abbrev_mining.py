@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import json_codec
+import local_expander
+
+try:
+    import numpy as np
+    import abbrev_mining
+except ImportError: #numpy is only needed by the offline mining pipeline
+    np = None
+
+
+def pair(original, cleaned, **extra):
+    return dict({'original_note': original, 'cleaned_note': cleaned}, **extra)
+
+
+CORPUS = (
+    [pair("pt w/ cp x2d", "patient with chest pain x2d")] * 30 +
+    [pair("pt c/o sob", "patient complains of shortness of breath")] * 30 +
+    [pair("pt stable, f/u 2wk", "patient stable, follow up 2wk")] * 25 +
+    #cp read as something else once in a while - still confidently chest pain
+    [pair("cp resolved", "cerebral palsy resolved")] +
+    #never taught: edited by hand, or produced by the expander itself
+    [pair("pt w/ ha", "patient with a headache", edited_at='2025-06-28T10:00:00')] * 40 +
+    [pair("pt w/ ha", "pt w/ ha", agent_version='local:abc')] * 40
+)
+
+
+@unittest.skipUnless(np, "numpy not installed")
+class TestAbbrevMining(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_align_pins_expansions_and_kept_tokens(self):
+        pairs = abbrev_mining.align(local_expander.tokenize("pt c/o sob x2d"),
+                                    local_expander.tokenize("Patient complains of shortness of breath x2d"))
+        self.assertEqual(pairs, [('pt', 'patient'), ('c/o', 'complains of'), ('sob', 'shortness of breath'),
+                                 ('x2d', 'x2d')])
+
+    def test_dictionary_ranks_entries_and_reports_coverage(self):
+        counter = abbrev_mining.PairCounter().add_items(CORPUS[:45])
+        counter.merge(abbrev_mining.PairCounter().add_items(CORPUS[45:]))
+        dictionary = abbrev_mining.build_dictionary(counter, min_support=20, threshold=0.8)
+        entries = {entry['token']: entry for entry in dictionary['entries']}
+
+        self.assertEqual(dictionary['notes'], 86)
+        self.assertEqual(entries['pt']['rendering'], 'patient')
+        self.assertEqual((entries['cp']['support'], entries['cp']['occurrences']), (30, 31))
+        self.assertLess(entries['cp']['confidence'], entries['pt']['confidence'])
+        self.assertEqual(entries['f/u']['rendering'], 'follow up')
+        self.assertFalse(entries['stable']['expands'])
+        self.assertNotIn('ha', entries)
+        confidences = [entry['confidence'] for entry in dictionary['entries']]
+        self.assertEqual(confidences, sorted(confidences, reverse=True))
+        #the lone "cp resolved" note is blocked by 'resolved', which only has one example
+        self.assertEqual(dictionary['coverage']['servable_notes'], 85)
+        self.assertIn(['resolved', 1], dictionary['coverage']['blocking_tokens'])
+
+    def test_degraded_and_patched_notes_are_not_mined(self):
+        counter = abbrev_mining.PairCounter().add_items([
+            pair("pt w/ ha", "Patient w/ ha", agent_version=local_expander.DEGRADED_VERSION),
+            pair("pt w/ ha x2d", "patient with a headache x2d", agent_version='near:agent:v1')])
+        self.assertFalse(counter.tokens)
+        self.assertEqual(counter.arrays()['note_tokens'].size, 0)
+
+    def test_mined_dictionary_round_trips_through_the_expander(self):
+        dictionary = abbrev_mining.build_dictionary(abbrev_mining.PairCounter().add_items(CORPUS), min_support=20)
+        path = os.path.join(self.tmp, "expansions.json")
+        with open(path, 'w') as f:
+            f.write(json_codec.dumps(dictionary))
+
+        version, renderings = local_expander.load_dictionary(path, min_confidence=0.85)
+        self.assertEqual(version, dictionary['version'])
+        self.assertEqual(local_expander.expand("Pt c/o SOB x2d", renderings),
+                         "Patient complains of shortness of breath x2d")
+        self.assertIsNone(local_expander.expand("pt w/ ha", renderings))
+
+
+class TestLocalExpander(unittest.TestCase):
+
+    RENDERINGS = {'pt': 'patient', 'w/': 'with', 'cp': 'chest pain', 'um': '', 'stable': 'stable'}
+
+    def test_expand_keeps_numbers_punctuation_and_case(self):
+        self.assertEqual(local_expander.expand("pt um w/ cp 120/80. Stable", self.RENDERINGS),
+                         "Patient with chest pain 120/80. Stable")
+
+    def test_unknown_token_falls_back_to_the_agent(self):
+        self.assertIsNone(local_expander.expand("pt w/ sob", self.RENDERINGS))
+        self.assertIsNone(local_expander.expand("...", self.RENDERINGS))
+
+    @patch('local_expander.DICTIONARY_PATH', None)
+    def test_disabled_without_a_dictionary(self):
+        self.assertIsNone(local_expander.expand_locally("pt w/ cp"))
+
+    @patch('local_expander._dictionary', ('abc123', RENDERINGS))
+    @patch('local_expander.DICTIONARY_PATH', '/opt/expansions.json')
+    def test_expand_locally_tags_the_dictionary_version(self):
+        self.assertEqual(local_expander.expand_locally("pt w/ cp"), ("Patient with chest pain", "local:abc123"))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,83 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from agent_scheduler import AgentScheduler
+from deadline import Deadline, DeadlineExceeded
+
+
+class TestAgentScheduler(unittest.TestCase):
+
+    def test_bulk_leaves_interactive_headroom(self):
+        scheduler = AgentScheduler(max_concurrency=4, interactive_reserve=1, wait_slo_ms=1000)
+        release = threading.Event()
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            bulk = [pool.submit(scheduler.run, 'bulk', lambda: release.wait(2)) for _ in range(5)]
+            while scheduler.stats()['bulk']['running'] < 3:
+                time.sleep(0.01)
+            #the reserved slot is free for a clinician straight away
+            self.assertEqual(scheduler.run('interactive', lambda: "cleaned"), "cleaned")
+            stats = scheduler.stats()
+            self.assertEqual((stats['bulk']['running'], stats['bulk']['queued']), (3, 2))
+            release.set()
+            for future in bulk:
+                future.result()
+        self.assertEqual(scheduler.stats()['bulk']['admitted'], 5)
+
+    def test_weighted_fair_order_when_both_lanes_queue(self):
+        #one slot, so calls run (and append) in the order they were granted
+        scheduler = AgentScheduler(max_concurrency=1, interactive_reserve=0, wait_slo_ms=60000)
+        order = []
+        gate = threading.Event()
+        with ThreadPoolExecutor(max_workers=11) as pool:
+            blockers = [pool.submit(scheduler.run, 'interactive', lambda: gate.wait(2))]
+            while scheduler.stats()['interactive']['running'] < 1:
+                time.sleep(0.01)
+            futures = []
+            for i in range(5):
+                futures.append(pool.submit(scheduler.run, 'bulk', lambda i=i: order.append('b')))
+                futures.append(pool.submit(scheduler.run, 'interactive', lambda i=i: order.append('i')))
+            while scheduler.stats()['bulk']['queued'] + scheduler.stats()['interactive']['queued'] < 10:
+                time.sleep(0.01)
+            gate.set()
+            for future in blockers + futures:
+                future.result()
+        #interactive gets its 4:1 share while both lanes have work queued
+        self.assertEqual(order[:5].count('i'), 4)
+
+    def test_bulk_yields_while_interactive_waits(self):
+        now = [0.0]
+        scheduler = AgentScheduler(max_concurrency=2, interactive_reserve=1, wait_slo_ms=200, clock=lambda: now[0])
+        scheduler._acquire('interactive', None)
+        scheduler._acquire('interactive', None)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            waiting = pool.submit(scheduler._acquire, 'interactive', None)
+            bulk = pool.submit(scheduler._acquire, 'bulk', None)
+            while scheduler.stats()['bulk']['queued'] + scheduler.stats()['interactive']['queued'] < 2:
+                time.sleep(0.01)
+            now[0] = 0.15 #the interactive call has waited for most of its SLO
+            scheduler._release('interactive')
+            waiting.result(timeout=2)
+            self.assertGreaterEqual(scheduler.stats()['bulk_yields'], 1)
+            self.assertEqual(scheduler.stats()['bulk']['queued'], 1)
+            scheduler._release('interactive')
+            scheduler._release('interactive')
+            now[0] = 20 #recent waits have aged out
+            bulk.result(timeout=2)
+
+    def test_deadline_in_queue(self):
+        scheduler = AgentScheduler(max_concurrency=1, interactive_reserve=0)
+        release = threading.Event()
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            running = pool.submit(scheduler.run, 'bulk', lambda: release.wait(2))
+            while scheduler.stats()['bulk']['running'] < 1:
+                time.sleep(0.01)
+            with self.assertRaises(DeadlineExceeded):
+                scheduler.run('interactive', lambda: "never", Deadline(0.1))
+            release.set()
+            running.result()
+        self.assertEqual(scheduler.stats()['interactive']['queued'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import asyncio
+import http.client
+import os
+import socket
+import threading
+import unittest
+from unittest.mock import patch
+
+with patch.dict(os.environ, {'BEDROCK_AGENT_ID': 'test-agent', 'BEDROCK_AGENT_ALIAS_ID': 'test-alias'}):
+    import asgi_app
+import json_codec
+
+
+def echo_handler(event, context):
+    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json', 'X-Request': context.aws_request_id},
+            'body': json_codec.dumps({'event': event, 'remaining_ms': context.get_remaining_time_in_millis()})}
+
+
+def call(app, method, path, body=b'', headers=(), query=b''):
+    #(status, headers, body) from running one request through the ASGI app
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query, 'headers': list(headers)}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+
+class TestAsgiApp(unittest.TestCase):
+
+    def test_request_becomes_api_gateway_event(self):
+        app = asgi_app.App(routes=[('PUT', '/notes/{note_id}', echo_handler)], workers=2)
+        status, headers, body = call(app, 'PUT', '/notes/abc%20123', b'{"cleaned_note": "x"}',
+                                     [(b'authorization', b'Bearer t'), (b'idempotency-key', b'k1')], b'since=2026&x=')
+        event = json_codec.loads(body)['event']
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/json')
+        self.assertEqual(int(headers[b'content-length']), len(body))
+        #handlers look up 'Authorization' the way API Gateway passes it
+        self.assertEqual(event['headers'], {'Authorization': 'Bearer t', 'Idempotency-Key': 'k1'})
+        self.assertEqual(event['pathParameters'], {'note_id': 'abc 123'})
+        self.assertEqual(event['queryStringParameters'], {'since': '2026', 'x': ''})
+        self.assertEqual((event['httpMethod'], event['resource'], event['body']), ('PUT', '/notes/{note_id}',
+                                                                                   '{"cleaned_note": "x"}'))
+        self.assertEqual(headers[b'x-request'].decode(), event['requestContext']['requestId'])
+        #the request budget stands in for the Lambda timeout
+        self.assertGreater(json_codec.loads(body)['remaining_ms'], 1000)
+
+    def test_unknown_routes_and_preflight(self):
+        app = asgi_app.App(routes=[('GET', '/history', echo_handler)], workers=1)
+        self.assertEqual(call(app, 'GET', '/nope')[0], 404)
+        self.assertEqual(call(app, 'POST', '/history')[0], 405)
+        status, headers, _ = call(app, 'OPTIONS', '/history')
+        self.assertEqual(status, 204)
+        self.assertIn(b'access-control-allow-headers', headers)
+        self.assertEqual(call(app, 'GET', '/health')[0], 200)
+        self.assertEqual(call(app, 'GET', '/history', b'x' * (asgi_app.MAX_BODY_BYTES + 1))[0], 413)
+
+    def test_sheds_load_past_max_in_flight(self):
+        release = threading.Event()
+
+        def slow_handler(event, context):
+            release.wait(5)
+            return {'statusCode': 200, 'headers': {}, 'body': 'done'}
+
+        app = asgi_app.App(routes=[('POST', '/process-note', slow_handler)], workers=2, max_in_flight=2)
+
+        async def burst():
+            loop = asyncio.get_running_loop()
+            tasks = [loop.run_in_executor(None, call, app, 'POST', '/process-note') for _ in range(3)]
+            await asyncio.sleep(0.2)
+            release.set()
+            return await asyncio.gather(*tasks)
+
+        results = asyncio.run(burst())
+        self.assertEqual(sorted(status for status, _, _ in results), [200, 200, 503])
+        self.assertEqual(app.metrics['rejected'], 1)
+
+    def test_handler_crash_is_a_500(self):
+        def broken_handler(event, context):
+            raise RuntimeError("bug")
+
+        app = asgi_app.App(routes=[('GET', '/search', broken_handler)], workers=1)
+        status, _, body = call(app, 'GET', '/search')
+        self.assertEqual(status, 500)
+        self.assertEqual(json_codec.loads(body)['error'], "Internal server error")
+
+    def serve(self, app):
+        #built-in server on a thread; returns its address, stop() is registered as cleanup
+        started = threading.Event()
+        address = []
+        loop = asyncio.new_event_loop()
+
+        def ready(sockname, stop):
+            address.append((sockname, stop))
+            started.set()
+
+        server = threading.Thread(target=loop.run_until_complete,
+                                  args=(asgi_app.serve(app, '127.0.0.1', 0, ready),), daemon=True)
+        server.start()
+        self.assertTrue(started.wait(5))
+
+        def stop():
+            loop.call_soon_threadsafe(address[0][1])
+            server.join(5)
+            self.assertFalse(server.is_alive())
+        self.addCleanup(stop)
+        return address[0][0]
+
+    def test_builtin_server_keeps_connection_alive(self):
+        app = asgi_app.App(routes=[('POST', '/process-note', echo_handler)], workers=2)
+        connection = http.client.HTTPConnection(*self.serve(app), timeout=5)
+        for note in ('pt w/ cp', 'pt c/o sob'):
+            connection.request('POST', '/process-note?x=1', body=json_codec.dumps({'note': note}),
+                               headers={'Authorization': 'Bearer t'})
+            response = connection.getresponse()
+            event = json_codec.loads(response.read())['event']
+            self.assertEqual(response.status, 200)
+            self.assertEqual(json_codec.loads(event['body'])['note'], note)
+        connection.close()
+
+    @patch('asgi_app.SERVER_MAX_CONNECTIONS', 1)
+    @patch('asgi_app.SERVER_HEADER_TIMEOUT', 0.2)
+    def test_builtin_server_drops_slow_and_extra_connections(self):
+        address = self.serve(asgi_app.App(routes=[('GET', '/search', echo_handler)], workers=1))
+        slow = socket.create_connection(address, timeout=5)
+        slow.sendall(b"GET /search HTTP/1.1\r\nHost: x\r\n") #headers never finish
+        #only one connection is held, the next one is closed straight away
+        extra = socket.create_connection(address, timeout=5)
+        self.assertEqual(extra.recv(1), b'')
+        extra.close()
+        #the header timeout closes the slow one
+        self.assertEqual(slow.recv(1), b'')
+        slow.close()
+
+    @patch('lambda_function.get_cleaned_note')
+    @patch('lambda_function.save_to_dynamo')
+    @patch('lambda_function.verify_token')
+    def test_serves_the_note_handler(self, mock_verify, mock_save, mock_get_cleaned_note):
+        mock_verify.return_value = ('user123', 'doc@clinic.org')
+        mock_get_cleaned_note.return_value = 'Patient with chest pain'
+        mock_save.return_value = 'note-1'
+
+        with patch('lambda_function.rate_limiter') as mock_rate_limiter:
+            mock_rate_limiter.check.return_value = 0
+            status, _, body = call(asgi_app.App(workers=2), 'POST', '/process-note', b'{"note": "pt w/ cp"}',
+                                   [(b'authorization', b'Bearer valid')])
+
+        self.assertEqual(status, 200)
+        self.assertEqual(json_codec.loads(body)['cleaned_note'], 'Patient with chest pain')
+        self.assertEqual(mock_save.call_args.kwargs['context'].aws_request_id.count('-'), 4)
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+with patch.dict(os.environ, {'BEDROCK_AGENT_ID': 'test-agent', 'BEDROCK_AGENT_ALIAS_ID': 'test-alias'}):
+    import async_client
+from deadline import Deadline, DeadlineExceeded
+
+
+class FakeDynamo:
+    #the aiobotocore DynamoDB client calls async_client makes
+
+    def __init__(self, items=()):
+        self.items = list(items)
+        self.calls = []
+
+    async def put_item(self, **params):
+        self.calls.append(('put_item', params))
+
+    async def transact_write_items(self, **params):
+        self.calls.append(('transact_write_items', params))
+
+    async def query(self, **params):
+        self.calls.append(('query', params))
+        return {'Items': self.items}
+
+
+class FakeSession:
+
+    def __init__(self, client):
+        self.client = client
+        self.closed = False
+
+    def create_client(self, service):
+        session = self
+
+        class Context:
+            async def __aenter__(self):
+                return session.client
+
+            async def __aexit__(self, *exc):
+                session.closed = True
+
+        return Context()
+
+
+class TestAsyncClient(unittest.TestCase):
+
+    @patch.dict(os.environ, {'LOCAL_AGENT_LATENCY_MS': '200'})
+    def test_hundreds_of_agent_streams_without_threads(self):
+        notes = [f"pt w/ cp note {i}" for i in range(300)] + ["pt w/ cp note 0"] * 20
+
+        async def run():
+            started = time.perf_counter()
+            threads = threading.active_count()
+            results = await asyncio.gather(*(async_client.get_cleaned_note(note) for note in notes))
+            agent = await async_client._current().get('bedrock-agent-runtime')
+            return results, time.perf_counter() - started, threading.active_count() - threads, agent.calls
+
+        results, seconds, new_threads, calls = asyncio.run(run())
+        self.assertEqual(results[0], "Patient with chest pain note 0")
+        self.assertEqual(results[-1], results[0])
+        #all in flight at once: one agent latency, not 300 of them or 300 threads
+        self.assertLess(seconds, 1.0)
+        self.assertEqual(new_threads, 0)
+        #identical notes in flight share a call
+        self.assertEqual(calls, 300)
+
+    @patch.dict(os.environ, {'LOCAL_AGENT_LATENCY_MS': '300'})
+    def test_deadline_gives_up_without_cancelling_the_shared_call(self):
+        async def run():
+            shared = asyncio.ensure_future(async_client.get_cleaned_note("pt c/o sob"))
+            with self.assertRaises(DeadlineExceeded):
+                await async_client.get_cleaned_note("pt c/o sob", deadline=Deadline(0.05))
+            return await shared
+
+        self.assertEqual(asyncio.run(run()), "Patient complains of shortness of breath")
+        with self.assertRaises(ValueError):
+            asyncio.run(async_client.get_cleaned_note("   "))
+
+    @patch('async_client._aio_session', None)
+    @patch('db_client.get_user_notes')
+    @patch('db_client.save_to_dynamo')
+    def test_without_aiobotocore_calls_are_offloaded(self, mock_save, mock_get_user_notes):
+        mock_save.return_value = 'note-1'
+        mock_get_user_notes.return_value = [{'note_id': 'note-1'}]
+        context = SimpleNamespace(aws_request_id='req-1')
+
+        async def run():
+            note_id = await async_client.save_to_dynamo('user123', 'pt w/ cp', 'Patient with chest pain', context)
+            notes = await async_client.get_user_notes('user123', limit=5)
+            return note_id, notes
+
+        self.assertEqual(asyncio.run(run()), ('note-1', [{'note_id': 'note-1'}]))
+        self.assertEqual(mock_save.call_args.args[:4], ('user123', 'pt w/ cp', 'Patient with chest pain', context))
+        mock_get_user_notes.assert_called_once_with('user123', limit=5, raise_errors=False)
+
+    @patch('db_client.NOTES_TABLE_PHASE', 'legacy')
+    @patch('reclean_queue.enqueue_outdated')
+    @patch('db_client.note_saved')
+    def test_native_dynamodb_calls(self, mock_note_saved, mock_enqueue):
+        dynamo = FakeDynamo([{'note_id': {'S': 'note-1'}, 'user_id': {'S': 'user123'},
+                              'cleaned_note': {'S': 'Patient with chest pain'},
+                              'created_at': {'S': '2026-03-02T11:00:00'}, 'cleaned_length': {'N': '23'}}])
+        session = FakeSession(dynamo)
+        context = SimpleNamespace(aws_request_id='req-1')
+
+        async def run():
+            note_id = await async_client.save_to_dynamo('user123', 'pt w/ cp', 'Patient with chest pain', context)
+            notes = await async_client.get_user_notes('user123')
+            await async_client.close()
+            return note_id, notes
+
+        with patch('async_client._aio_session', lambda: session):
+            note_id, notes = asyncio.run(run())
+
+        name, put = dynamo.calls[0]
+        self.assertEqual((name, put['TableName']), ('put_item', 'medical-notes'))
+        self.assertEqual(put['Item']['note_id'], {'S': note_id})
+        self.assertEqual(put['Item']['request_id'], {'S': 'req-1'})
+        mock_note_saved.assert_called_once_with('user123', note_id)
+
+        name, query = dynamo.calls[1]
+        self.assertEqual((query['IndexName'], query['ScanIndexForward'], query['Limit']), ('user-notes-index', False, 20))
+        self.assertEqual(list(query['ExpressionAttributeValues'].values()), [{'S': 'user123'}])
+        self.assertEqual(notes[0]['cleaned_note'], 'Patient with chest pain')
+        self.assertEqual(notes[0]['cleaned_length'], 23)
+        self.assertEqual(mock_enqueue.call_args.args[0][0]['note_id'], 'note-1')
+        self.assertTrue(session.closed)
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
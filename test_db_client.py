@@ -0,0 +1,296 @@
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest.mock import patch
+import db_client
+
+
+class TestUserVersion(unittest.TestCase):
+
+    def setUp(self):
+        db_client._version_cache.clear()
+
+    @patch('db_client.versions_table')
+    def test_bump_refreshes_cache(self, mock_versions_table):
+        """A bump is visible to get_user_version without another read"""
+        mock_versions_table.update_item.return_value = {
+            'Attributes': {'note_version': Decimal('4'), 'updated_at': Decimal('1000.5')}
+        }
+        self.assertEqual(db_client.bump_user_version("user123"), 4)
+
+        version, _ = db_client.get_user_version("user123")
+        self.assertEqual(version, 4)
+        mock_versions_table.get_item.assert_not_called()
+
+    @patch('db_client.versions_table')
+    def test_unknown_user_is_version_zero(self, mock_versions_table):
+        mock_versions_table.get_item.return_value = {}
+        self.assertEqual(db_client.get_user_version("new-user"), (0, 0.0))
+
+
+class TestDeltaSync(unittest.TestCase):
+
+    @patch('db_client.changes_table')
+    @patch('db_client.tombstones_table')
+    @patch('db_client.notes_table')
+    def test_changes_since_returns_notes_and_tombstones(self, mock_notes_table, mock_tombstones_table,
+                                                        mock_changes_table):
+        since = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+        created = (datetime.utcnow() - timedelta(minutes=30)).isoformat()
+        mock_notes_table.query.return_value = {'Items': [{
+            'note_id': 'note-2', 'user_id': 'user123', 'cleaned_note': 'Patient with chest pain',
+            'created_at': created, 'original_length': Decimal('7'), 'cleaned_length': Decimal('23')
+        }]}
+        mock_tombstones_table.query.return_value = {'Items': [{'note_id': 'note-1'}]}
+        mock_changes_table.query.return_value = {'Items': []}
+
+        changes = db_client.get_user_changes_since("user123", since)
+        self.assertFalse(changes['full_resync'])
+        self.assertEqual([n['note_id'] for n in changes['notes']], ['note-2'])
+        self.assertNotIn('original_note', changes['notes'][0])
+        self.assertEqual(changes['deleted'], ['note-1'])
+        self.assertGreater(changes['next_since'], created)
+        self.assertFalse(changes['has_more'])
+
+    @patch('db_client.changes_table')
+    @patch('db_client.tombstones_table')
+    @patch('db_client.notes_table')
+    def test_empty_poll_advances_cursor(self, mock_notes_table, mock_tombstones_table, mock_changes_table):
+        """An idle user's cursor moves on, so tombstones aren't re-sent and it never ages into a full resync"""
+        since = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+        mock_notes_table.query.return_value = {'Items': []}
+        mock_tombstones_table.query.return_value = {'Items': [{'note_id': 'note-1'}]}
+        mock_changes_table.query.return_value = {'Items': []}
+
+        changes = db_client.get_user_changes_since("user123", since)
+        self.assertEqual(changes['deleted'], ['note-1'])
+        settled = (datetime.utcnow() - timedelta(seconds=db_client.SYNC_SETTLE_SECONDS)).isoformat()
+        self.assertGreater(changes['next_since'], since)
+        self.assertLessEqual(changes['next_since'], settled)
+
+    @patch('db_client.changes_table')
+    @patch('db_client.tombstones_table')
+    @patch('db_client.notes_table')
+    def test_cursor_held_back_for_recent_notes(self, mock_notes_table, mock_tombstones_table, mock_changes_table):
+        """A note seconds old must not move the cursor past notes the GSI has not shown yet"""
+        since = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+        mock_notes_table.query.return_value = {'Items': [{
+            'note_id': 'note-3', 'cleaned_note': 'x', 'created_at': datetime.utcnow().isoformat()
+        }]}
+        mock_tombstones_table.query.return_value = {'Items': []}
+        mock_changes_table.query.return_value = {'Items': []}
+
+        changes = db_client.get_user_changes_since("user123", since)
+        self.assertLess(changes['next_since'], changes['notes'][0]['created_at'])
+        self.assertGreaterEqual(changes['next_since'], since)
+
+    @patch('db_client.versions_table')
+    @patch('db_client.changes_table')
+    @patch('db_client.tombstones_table')
+    @patch('db_client.notes_table')
+    def test_edited_note_comes_back_in_delta_sync(self, mock_notes_table, mock_tombstones_table, mock_changes_table,
+                                                  mock_versions_table):
+        """An edit keeps created_at, so the note is found through the change log"""
+        since = (datetime.utcnow() - timedelta(hours=1)).isoformat()
+        stored = {'note_id': 'note-1', 'user_id': 'user123', 'cleaned_note': 'old text',
+                  'created_at': (datetime.utcnow() - timedelta(days=2)).isoformat()}
+        mock_notes_table.meta.client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+        mock_notes_table.update_item.return_value = {'Attributes': stored}
+        mock_versions_table.update_item.return_value = {'Attributes': {'note_version': Decimal('2')}}
+        db_client.update_user_note("note-1", "user123", "new text")
+
+        change = mock_changes_table.put_item.call_args.kwargs['Item']
+        self.assertGreater(change['change_key'], since)
+        self.assertEqual(change['created_at'], stored['created_at'])
+        mock_notes_table.query.return_value = {'Items': []} #created before the cursor
+        mock_tombstones_table.query.return_value = {'Items': []}
+        mock_changes_table.query.return_value = {'Items': [change, dict(change, change_key=change['change_key'] + 'x')]}
+        mock_notes_table.get_item.return_value = {'Item': dict(stored, cleaned_note='new text')}
+
+        changes = db_client.get_user_changes_since("user123", since)
+        self.assertEqual([(n['note_id'], n['cleaned_note']) for n in changes['notes']], [('note-1', 'new text')])
+
+    @patch('db_client.record_change')
+    @patch('db_client.bump_user_version')
+    def test_late_save_goes_to_the_change_log(self, mock_bump, mock_record_change):
+        """A retry or journal replay saves under an earlier created_at that cursors may have passed"""
+        db_client.note_saved("user123", "note-1", created_at=datetime.utcnow().isoformat())
+        mock_record_change.assert_not_called()
+        earlier = (datetime.utcnow() - timedelta(minutes=1)).isoformat()
+        db_client.note_saved("user123", "note-1", created_at=earlier)
+        mock_record_change.assert_called_once_with("user123", "note-1", earlier)
+
+    @patch('db_client.notes_table')
+    def test_stale_cursor_requires_full_resync(self, mock_notes_table):
+        since = (datetime.utcnow() - timedelta(days=db_client.TOMBSTONE_RETENTION_DAYS + 1)).isoformat()
+        changes = db_client.get_user_changes_since("user123", since)
+        self.assertTrue(changes['full_resync'])
+        mock_notes_table.query.assert_not_called()
+
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class TestOwnershipCheckedWrites(unittest.TestCase):
+
+    @patch('db_client.bump_user_version')
+    @patch('db_client.record_tombstone')
+    @patch('db_client.notes_table')
+    def test_delete_not_owned(self, mock_notes_table, mock_record_tombstone, mock_bump):
+        """Someone else's note fails the condition and is reported as not found"""
+        mock_notes_table.meta.client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+        mock_notes_table.delete_item.side_effect = ConditionalCheckFailedException()
+
+        self.assertFalse(db_client.delete_user_note("note-1", "intruder"))
+        mock_notes_table.get_item.assert_not_called()
+        mock_record_tombstone.assert_not_called()
+        mock_bump.assert_not_called()
+
+    @patch('db_client.bump_user_version')
+    @patch('db_client.record_tombstone')
+    @patch('db_client.notes_table')
+    def test_delete_own_note(self, mock_notes_table, mock_record_tombstone, mock_bump):
+        mock_notes_table.meta.client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+
+        self.assertTrue(db_client.delete_user_note("note-1", "user123"))
+        kwargs = mock_notes_table.delete_item.call_args.kwargs
+        self.assertEqual(kwargs['Key'], {'note_id': 'note-1'})
+        self.assertEqual(kwargs['ExpressionAttributeValues'], {':uid': 'user123'})
+        mock_record_tombstone.assert_called_once_with("user123", "note-1")
+
+    @patch('db_client.sync_cleaned_note_change')
+    @patch('db_client.notes_table')
+    def test_update_own_note(self, mock_notes_table, mock_sync):
+        mock_notes_table.meta.client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+        mock_notes_table.update_item.return_value = {'Attributes': {
+            'note_id': 'note-1', 'user_id': 'user123', 'cleaned_note': 'old text',
+            'created_at': '2025-06-27T02:11:07', 'original_length': Decimal('7'), 'cleaned_length': Decimal('8')
+        }}
+
+        note = db_client.update_user_note("note-1", "user123", "new text")
+        self.assertEqual(note['cleaned_note'], "new text")
+        self.assertIn('edited_at', note)
+        mock_sync.assert_called_once_with("user123", "note-1", '2025-06-27T02:11:07')
+
+        mock_notes_table.update_item.side_effect = ConditionalCheckFailedException()
+        self.assertIsNone(db_client.update_user_note("note-1", "intruder", "new text"))
+
+
+
+class TestNotesMigrationPhases(unittest.TestCase):
+
+    def note(self):
+        return {'note_id': 'note-1', 'user_id': 'user123', 'created_at': '2025-06-27T02:11:07',
+                'original_note': 'pt w/ cp', 'cleaned_note': 'Patient with chest pain'}
+
+    @patch('db_client.NOTES_TABLE_PHASE', 'dual_write')
+    def test_dual_write_condition_checked_on_read_table(self):
+        actions = db_client.note_write_actions(self.note(), dict(self.note(), cleaned_note='edited'),
+                                               'cleaned_note = :old', {':old': 'Patient with chest pain'})
+        legacy, v2 = actions[0]['Put'], actions[1]['Put']
+        self.assertEqual(legacy['ConditionExpression'], 'cleaned_note = :old')
+        self.assertNotIn('note_key', legacy['Item'])
+        self.assertNotIn('ConditionExpression', v2)
+        self.assertEqual(v2['Item']['note_key'], '2025-06-27T02:11:07#note-1')
+
+        with patch('db_client.NOTES_TABLE_PHASE', 'v2_reads'):
+            actions = db_client.note_write_actions(self.note(), None, 'user_id = :uid', {':uid': 'user123'})
+            self.assertNotIn('ConditionExpression', actions[0]['Delete'])
+            self.assertEqual(actions[1]['Delete']['Key'], {'user_id': 'user123', 'note_key': '2025-06-27T02:11:07#note-1'})
+
+    @patch('db_client.bump_user_version')
+    @patch('db_client.dynamodb')
+    @patch('db_client.NOTES_TABLE_PHASE', 'dual_write')
+    def test_save_writes_both_tables_atomically(self, mock_dynamodb, mock_bump):
+        context = type('Context', (), {'aws_request_id': 'req-1'})()
+        note_id = db_client.save_to_dynamo("user123", "pt w/ cp", "Patient with chest pain", context)
+
+        actions = mock_dynamodb.meta.client.transact_write_items.call_args.kwargs['TransactItems']
+        self.assertEqual(len(actions), 2)
+        self.assertTrue(all(action['Put']['Item']['note_id'] == note_id for action in actions))
+
+    @patch('db_client.note_saved')
+    @patch('db_client.tombstones_table')
+    @patch('db_client.load_note')
+    @patch('db_client.dynamodb')
+    @patch('db_client.NOTES_TABLE_PHASE', 'v2')
+    def test_resumed_save_lands_once(self, mock_dynamodb, mock_load_note, mock_tombstones_table, mock_note_saved):
+        context = type('Context', (), {'aws_request_id': 'req-1'})()
+        client = mock_dynamodb.meta.client
+        client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+        mock_tombstones_table.query.return_value = {'Items': []}
+        created_at = '2026-10-19T08:00:00'
+        db_client.save_to_dynamo("user123", "pt w/ cp", "Patient with chest pain", context, note_id='note-1',
+                                 created_at=created_at, once=True)
+
+        #the full v2 key the crashed request used, so the condition sees its copy
+        put = client.put_item.call_args.kwargs
+        self.assertEqual(put['ConditionExpression'], 'attribute_not_exists(note_id)')
+        self.assertEqual(put['Item']['note_key'], f"{created_at}#note-1")
+        mock_load_note.assert_not_called()
+        mock_note_saved.assert_called_once_with("user123", "note-1", None, created_at)
+
+        #the crashed request saved it after all
+        client.put_item.side_effect = ConditionalCheckFailedException()
+        self.assertEqual(db_client.save_to_dynamo("user123", "pt w/ cp", "Patient with chest pain", context,
+                                                  note_id='note-1', created_at=created_at, once=True), 'note-1')
+        mock_note_saved.assert_called_once()
+
+        #records from before created_at was kept only have the note_id - looked up through the GSI
+        client.put_item.side_effect = None
+        client.reset_mock()
+        mock_load_note.return_value = self.note()
+        self.assertEqual(db_client.save_to_dynamo("user123", "pt w/ cp", "Patient with chest pain", context,
+                                                  note_id='note-1', once=True), 'note-1')
+        client.put_item.assert_not_called()
+        mock_note_saved.assert_called_once()
+
+    @patch('db_client.note_saved')
+    @patch('db_client.tombstones_table')
+    @patch('db_client.dynamodb')
+    @patch('db_client.NOTES_TABLE_PHASE', 'legacy')
+    def test_resumed_save_does_not_bring_back_deleted_notes(self, mock_dynamodb, mock_tombstones_table,
+                                                            mock_note_saved):
+        context = type('Context', (), {'aws_request_id': 'req-1'})()
+        mock_tombstones_table.query.return_value = {'Items': [{'note_id': 'note-1'}]}
+        self.assertEqual(db_client.save_to_dynamo("user123", "pt w/ cp", "Patient with chest pain", context,
+                                                  note_id='note-1', once=True), 'note-1')
+        mock_dynamodb.meta.client.put_item.assert_not_called()
+        mock_note_saved.assert_not_called()
+
+        mock_tombstones_table.query.return_value = {'Items': []}
+        db_client.save_to_dynamo("user123", "pt w/ cp", "Patient with chest pain", context, note_id='note-1', once=True)
+        put = mock_dynamodb.meta.client.put_item.call_args.kwargs
+        self.assertEqual(put['ConditionExpression'], 'attribute_not_exists(note_id)')
+        mock_note_saved.assert_called_once()
+
+    @patch('db_client.notes_v2_table')
+    @patch('db_client.NOTES_TABLE_PHASE', 'v2')
+    def test_v2_reads_are_consistent_base_table_queries(self, mock_v2_table):
+        mock_v2_table.query.return_value = {'Items': []}
+        db_client.get_user_notes("user123")
+        kwargs = mock_v2_table.query.call_args.kwargs
+        self.assertTrue(kwargs['ConsistentRead'])
+        self.assertNotIn('IndexName', kwargs)
+
+        #created_at makes the key - no index lookup and no ownership check in Python
+        mock_v2_table.get_item.return_value = {'Item': self.note()}
+        note = db_client.get_note_by_id('note-1', 'user123', created_at='2025-06-27T02:11:07')
+        self.assertEqual(note['note_id'], 'note-1')
+        self.assertEqual(mock_v2_table.get_item.call_args.kwargs['Key'],
+                         {'user_id': 'user123', 'note_key': '2025-06-27T02:11:07#note-1'})
+
+    @patch('db_client.notes_v2_table')
+    @patch('db_client.NOTES_TABLE_PHASE', 'v2')
+    def test_v2_lookup_by_id_ignores_other_users(self, mock_v2_table):
+        mock_v2_table.query.return_value = {'Items': [{'note_id': 'note-1', 'user_id': 'someone-else',
+                                                       'note_key': '2025-06-27T02:11:07#note-1'}]}
+        self.assertIsNone(db_client.get_note_by_id('note-1', 'user123'))
+        self.assertFalse(db_client.delete_user_note('note-1', 'user123'))
+        mock_v2_table.get_item.assert_not_called()
+        mock_v2_table.delete_item.assert_not_called()
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,56 @@
+import os
+import time
+import unittest
+from unittest.mock import patch
+from deadline import Deadline, DeadlineExceeded, call_with_deadline
+from local_agent import LocalAgent
+from single_flight import SingleFlight
+
+with patch.dict(os.environ, {'BEDROCK_AGENT_ID': 'test-agent-id', 'BEDROCK_AGENT_ALIAS_ID': 'test-alias-id'}):
+    import agent_client
+
+
+class MockContext:
+    def __init__(self, remaining_ms):
+        self.aws_request_id = "test-request-id"
+        self.get_remaining_time_in_millis = lambda: remaining_ms
+
+
+class TestDeadline(unittest.TestCase):
+
+    def test_budget_comes_from_lambda_context(self):
+        deadline = Deadline.from_context(MockContext(10000), reserve=0.5)
+        self.assertAlmostEqual(deadline.remaining(), 9.5, places=1)
+        self.assertAlmostEqual(deadline.reserve(1.5).remaining(), 8.0, places=1)
+        #no Lambda context (local runs) falls back to the default budget
+        self.assertGreater(Deadline.from_context(object()).remaining(), 20)
+
+    def test_call_gives_up_at_deadline(self):
+        self.assertEqual(call_with_deadline(Deadline(1), lambda x: x * 2, 21), 42)
+
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            call_with_deadline(Deadline(0.1), time.sleep, 2)
+        self.assertLess(time.monotonic() - started, 1)
+
+        with self.assertRaises(DeadlineExceeded):
+            Deadline(0).check()
+
+    def test_no_deadline_runs_inline(self):
+        self.assertEqual(call_with_deadline(None, lambda: "cleaned"), "cleaned")
+
+
+class TestAgentClientDeadline(unittest.TestCase):
+
+    #the abandoned call stays in flight - keep it out of the shared SingleFlight
+    @patch('agent_client._flights', SingleFlight())
+    @patch('agent_client.bedrock_agent', LocalAgent(latency=2))
+    def test_slow_agent_call_is_abandoned(self):
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            agent_client.get_cleaned_note("pt w/ cp", deadline=Deadline(0.2))
+        self.assertLess(time.monotonic() - started, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import json_codec
+import export_notes
+
+
+def make_pages(user_id, total, page_size):
+    items = [{'note_id': f"note-{i:03d}", 'user_id': user_id, 'created_at': f"2025-06-27T02:{i // 60:02d}:{i % 60:02d}",
+              'original_note': 'pt w/ cp', 'cleaned_note': 'Patient with chest pain'} for i in range(total)]
+    pages = {}
+    cursor = None
+    for start in range(0, total, page_size):
+        page = items[start:start + page_size]
+        next_cursor = {'note_id': page[-1]['note_id']} if start + page_size < total else None
+        pages[json_codec.dumps(cursor)] = (page, next_cursor)
+        cursor = next_cursor
+    return items, pages
+
+
+class TestExportNotes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_export_to_file_and_resume(self):
+        """An export interrupted mid-way resumes from the checkpoint without duplicates"""
+        items, pages = make_pages("user123", 25, 10)
+        out = os.path.join(self.tmp, "notes.ndjson.gz")
+        checkpoint = os.path.join(self.tmp, "export.ckpt")
+        calls = []
+
+        def flaky_fetch(user_id, cursor, page_size):
+            calls.append(cursor)
+            if len(calls) == 3 and not hasattr(flaky_fetch, 'failed'):
+                flaky_fetch.failed = True
+                raise Exception("connection reset")
+            return pages[json_codec.dumps(cursor)]
+
+        with patch('export_notes.fetch_page', side_effect=flaky_fetch):
+            with self.assertRaises(Exception):
+                export_notes.export_user_notes("user123", export_notes.FileSink(out), checkpoint, 10)
+            self.assertEqual(export_notes.load_checkpoint(checkpoint)['exported'], 20)
+
+            result = export_notes.export_user_notes("user123", export_notes.FileSink(out), checkpoint, 10)
+
+        self.assertEqual(result['exported'], 25)
+        with gzip.open(out, 'rt') as f:
+            exported = [json_codec.loads(line) for line in f]
+        self.assertEqual(exported, items)
+
+    def test_export_to_object_store_stand_in(self):
+        items, pages = make_pages("user123", 30, 10)
+        store = export_notes.LocalObjectStore(self.tmp)
+        sink = export_notes.MultipartUploadSink(store, "exports", "user123.ndjson.gz", part_size=1)
+
+        with patch('export_notes.fetch_page', side_effect=lambda u, c, p: pages[json_codec.dumps(c)]):
+            result = export_notes.export_user_notes("user123", sink, page_size=10)
+
+        self.assertEqual(result['exported'], 30)
+        self.assertEqual(len(sink.parts), 3)
+        with gzip.open(os.path.join(self.tmp, "exports", "user123.ndjson.gz"), 'rt') as f:
+            self.assertEqual(len(f.readlines()), 30)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
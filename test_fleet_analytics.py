@@ -0,0 +1,71 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import json_codec
+
+try:
+    import numpy as np
+    import fleet_analytics
+except ImportError: #numpy is only needed by the offline analytics tooling
+    np = None
+
+
+def note(user_id, created_at, original_length, cleaned_length, latency_ms=0):
+    return {'user_id': user_id, 'created_at': created_at, 'original_length': original_length,
+            'cleaned_length': cleaned_length, 'proccessing_time_ms': latency_ms}
+
+
+NOTES = [
+    note('u1', '2025-06-27T02:11:07.834941', 100, 150, 800),
+    note('u1', '2025-06-27T02:11:07.900000', 200, 260, 1200),
+    note('u1', '2025-06-28T09:00:00', 50, 50),
+    note('u2', '2025-06-27T23:59:59', 400, 800, 2000),
+]
+
+
+@unittest.skipUnless(np, "numpy not installed")
+class TestFleetAnalytics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_merge_remaps_user_codes(self):
+        a = fleet_analytics.ColumnBuilder().add_items(NOTES[:2])
+        b = fleet_analytics.ColumnBuilder().add_items([NOTES[3], NOTES[2]])
+        columns = a.merge(b).columns()
+        self.assertEqual([columns['users'][code] for code in columns['user']], ['u1', 'u1', 'u2', 'u1'])
+
+    def test_report(self):
+        report = fleet_analytics.build_report(fleet_analytics.ColumnBuilder().add_items(NOTES).columns())
+        self.assertEqual((report['notes'], report['users']), (4, 2))
+        #u1 twice on the 27th, once on the 28th; u2 once on the 27th
+        self.assertEqual(report['notes_per_user_per_day']['max'], 2)
+        self.assertEqual(report['notes_per_user_per_day']['count'], 3)
+        self.assertEqual(report['daily']['active_users']['max'], 2)
+        self.assertEqual(report['rollups']['peak_second_notes'], 2)
+        #the note without a recorded latency is left out
+        self.assertEqual(report['agent_latency_ms']['count'], 3)
+        self.assertEqual(report['expansion_ratio']['max'], 2.0)
+        self.assertEqual(report['histograms']['original_length'], {'<=64': 1, '<=128': 1, '<=256': 1, '<=512': 1})
+        self.assertGreaterEqual(report['sizing']['suggested_reserved_concurrency'], 1)
+
+    def test_export_files_and_saved_columns(self):
+        path = os.path.join(self.tmp, "notes.ndjson.gz")
+        with gzip.open(path, 'wb') as f:
+            for item in NOTES:
+                f.write((json_codec.dumps(item) + '\n').encode('utf-8'))
+        columns = fleet_analytics.load_from_exports([path])
+
+        saved = os.path.join(self.tmp, "columns.npz")
+        fleet_analytics.save_columns(saved, columns)
+        loaded = fleet_analytics.load_columns(saved)
+        self.assertEqual(fleet_analytics.build_report(loaded), fleet_analytics.build_report(columns))
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,79 @@
+import os
+import time
+import unittest
+from unittest.mock import patch
+from hedging import Hedger
+from local_agent import LocalAgent
+from single_flight import SingleFlight
+
+with patch.dict(os.environ, {'BEDROCK_AGENT_ID': 'test-agent-id', 'BEDROCK_AGENT_ALIAS_ID': 'test-alias-id'}):
+    import agent_client
+
+
+def warm(hedger, seconds=0.02, count=20):
+    #first-chunk history so the hedger has a p95 to work from
+    hedger._samples.clear()
+    for _ in range(count):
+        hedger._samples.append(seconds)
+    hedger._credits = 1
+
+
+class TestHedger(unittest.TestCase):
+
+    def test_straggler_is_hedged_and_closed(self):
+        hedger = Hedger(budget=0.05)
+        warm(hedger)
+        agents = iter([LocalAgent(latency=2), LocalAgent(latency=0.02)])
+        slow, fast = next(agents), next(agents)
+        calls = iter([slow, fast])
+
+        started = time.monotonic()
+        raw = hedger.call(lambda: next(calls).invoke_agent(inputText="pt w/ cp"))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertIn(b"Patient with chest pain", raw)
+        self.assertEqual(hedger.metrics['hedges'], 1)
+        self.assertEqual(hedger.metrics['hedge_wins'], 1)
+        self.assertEqual(slow.cancelled, 1)
+
+    def test_budget_caps_hedges(self):
+        #first chunks come 10x later than the hedge delay, so every call is a straggler
+        hedger = Hedger(budget=0.25, min_delay=0.01)
+        agent = LocalAgent(latency=0.1)
+        for _ in range(20):
+            credits = hedger._credits
+            warm(hedger, seconds=0.01)
+            hedger._credits = credits
+            hedger.call(lambda: agent.invoke_agent(inputText="pt c/o sob"))
+        #every call is slower than p95, but 20 calls only earn 5 hedges
+        self.assertEqual(hedger.metrics['hedges'], 5)
+        self.assertEqual(agent.calls, 25)
+
+    def test_no_hedging_without_history(self):
+        hedger = Hedger(budget=1.0)
+        agent = LocalAgent(latency=0.05)
+        hedger.call(lambda: agent.invoke_agent(inputText="pt w/ cp"))
+        self.assertEqual((hedger.metrics['hedges'], agent.calls), (0, 1))
+
+    def test_error_only_when_every_attempt_fails(self):
+        hedger = Hedger(budget=0.05)
+        agent = LocalAgent(latency=0.01, failure=Exception("ThrottlingException"))
+        with self.assertRaises(Exception):
+            hedger.call(lambda: agent.invoke_agent(inputText="pt w/ cp"))
+
+
+class TestAgentClientHedging(unittest.TestCase):
+
+    @patch('agent_client._flights', SingleFlight())
+    @patch('agent_client.bedrock_agent', LocalAgent(latency=0.01))
+    def test_interactive_calls_are_hedged_bulk_calls_are_not(self):
+        hedger = Hedger(budget=0.05)
+        warm(hedger, seconds=0.001)
+        hedger._credits = 5
+        with patch('agent_client.hedger', hedger):
+            self.assertEqual(agent_client.get_cleaned_note("pt w/ cp"), "Patient with chest pain")
+            agent_client.get_cleaned_note("pt w/ cp, f/u", lane='bulk')
+        self.assertEqual(hedger.metrics['calls'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import threading
+import time
+import unittest
+import idempotency
+from idempotency import LocalIdempotencyStore, IdempotencyConflict, claim, complete, release, fingerprint
+from deadline import Deadline, DeadlineExceeded
+
+RESPONSE = {'statusCode': 200, 'headers': {}, 'body': '{"note_id": "n1"}'}
+
+
+class TestIdempotency(unittest.TestCase):
+
+    def test_retry_after_completion_replays_response(self):
+        store = LocalIdempotencyStore()
+        outcome, record = claim(store, "user123", "key-1", fingerprint("pt w/ cp"))
+        self.assertEqual(outcome, 'run')
+        complete(store, record, RESPONSE)
+
+        self.assertEqual(claim(store, "user123", "key-1", fingerprint("pt w/ cp")), ('replay', RESPONSE))
+        #keys are scoped to the user
+        self.assertEqual(claim(store, "user456", "key-1", fingerprint("pt w/ cp"))[0], 'run')
+
+    def test_key_reused_for_another_note(self):
+        store = LocalIdempotencyStore()
+        claim(store, "user123", "key-1", fingerprint("pt w/ cp"))
+        with self.assertRaises(IdempotencyConflict):
+            claim(store, "user123", "key-1", fingerprint("pt c/o sob"))
+
+    def test_retry_waits_for_running_request(self):
+        store = LocalIdempotencyStore()
+        _, record = claim(store, "user123", "key-1", fingerprint("pt w/ cp"))
+        threading.Timer(0.3, complete, (store, record, RESPONSE)).start()
+
+        started = time.monotonic()
+        self.assertEqual(claim(store, "user123", "key-1", fingerprint("pt w/ cp"), Deadline(5)), ('replay', RESPONSE))
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+        #gives up at its own deadline
+        claim(store, "user123", "key-2", fingerprint("pt w/ cp"))
+        with self.assertRaises(DeadlineExceeded):
+            claim(store, "user123", "key-2", fingerprint("pt w/ cp"), Deadline(0.3))
+
+    def test_failed_request_released_and_dead_one_taken_over(self):
+        store = LocalIdempotencyStore()
+        _, record = claim(store, "user123", "key-1", fingerprint("pt w/ cp"))
+        release(store, record)
+        self.assertEqual(claim(store, "user123", "key-1", fingerprint("pt w/ cp"))[0], 'run')
+
+        #the owner died mid-request - once its lease is up a retry takes over the same note key
+        later = lambda: time.time() + idempotency.LEASE_SECONDS + 1
+        outcome, takeover = claim(store, "user123", "key-1", fingerprint("pt w/ cp"), clock=later)
+        self.assertEqual(outcome, 'run')
+        stored = store.read("user123#key-1")
+        self.assertEqual((takeover['note_id'], takeover['created_at']), (stored['note_id'], stored['created_at']))
+        self.assertNotEqual(takeover['owner'], record['owner'])
+        self.assertTrue(takeover['resumed'])
+        self.assertNotIn('resumed', record)
+
+
+if __name__ == '__main__':
+    unittest.main()
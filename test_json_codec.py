@@ -0,0 +1,33 @@
+import unittest
+from decimal import Decimal
+import json_codec
+
+
+class TestJsonCodec(unittest.TestCase):
+
+    def tearDown(self):
+        json_codec.use_backend("orjson" if "orjson" in json_codec.BACKENDS else "stdlib")
+
+    def test_decimal_round_trip_all_backends(self):
+        """DynamoDB Decimals serialize as plain numbers on every backend"""
+        item = {'original_length': Decimal('24'), 'ratio': Decimal('3.5'), 'note': 'pt w/ cp'}
+        for name in json_codec.BACKENDS:
+            json_codec.use_backend(name)
+            decoded = json_codec.loads(json_codec.dumps(item))
+            self.assertEqual(decoded, {'original_length': 24, 'ratio': 3.5, 'note': 'pt w/ cp'})
+            self.assertIsInstance(decoded['original_length'], int)
+
+    def test_decode_error_all_backends(self):
+        """Malformed bodies raise the shared DecodeError"""
+        for name in json_codec.BACKENDS:
+            json_codec.use_backend(name)
+            with self.assertRaises(json_codec.DecodeError):
+                json_codec.loads("{not json")
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            json_codec.use_backend("does-not-exist")
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -1,7 +1,16 @@
 import unittest
 import os
+import shutil
+import tempfile
+import time
 from unittest.mock import patch, MagicMock
-from lambda_function import lambda_handler
+import lambda_function
+from lambda_function import lambda_handler, history_lambda_handler, search_lambda_handler, update_note_lambda_handler
+from decimal import Decimal
+from near_duplicate import NearDuplicateIndex
+from deadline import DeadlineExceeded
+from throttle import RateLimiter
+from idempotency import LocalIdempotencyStore
 import json
 
 class MockContext:
@@ -9,6 +18,21 @@ class MockContext:
         self.aws_request_id = "test-request-id"
 
 class TestLambdaHandler(unittest.TestCase):
+
+    def setUp(self):
+        #cleaned notes are remembered per container - start every test with an empty index
+        #and fresh rate limit buckets, idempotency records and write journal
+        journal = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal)
+        self.journal_path = os.path.join(journal, 'journal.ndjson')
+        for target, value in (('lambda_function.near_duplicates', NearDuplicateIndex()),
+                              ('lambda_function.rate_limiter', RateLimiter()),
+                              ('lambda_function.idempotency_store', LocalIdempotencyStore()),
+                              ('write_journal.JOURNAL_PATH', self.journal_path),
+                              ('write_journal._retry_after', 0.0)):
+            patcher = patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
     
     @patch.dict(os.environ, {
         'BEDROCK_AGENT_ID': 'test-agent-id',
@@ -45,6 +69,115 @@ class TestLambdaHandler(unittest.TestCase):
         self.assertEqual(result["statusCode"], 200)
         self.assertIn("cleaned_note", body)
         self.assertEqual(body["cleaned_note"], "Patient with chest pain for 2 days, plan: laboratory tests")
+        #agent latency is recorded for capacity planning
+        self.assertIn("processing_time_ms", mock_save_to_dynamo.call_args.kwargs)
+
+    @patch('lambda_function.verify_token')
+    @patch('lambda_function.save_to_dynamo')
+    @patch('lambda_function.get_cleaned_note')
+    def test_near_duplicate_reuses_earlier_cleaned_note(self, mock_get_cleaned_note, mock_save_to_dynamo, mock_verify_token):
+        mock_verify_token.return_value = ("user123", "test@example.com")
+        mock_get_cleaned_note.return_value = "Patient with chest pain, follow up in 2 weeks"
+        mock_save_to_dynamo.return_value = "note-1"
+
+        first = {"headers": {"Authorization": "Bearer test-token"}, "body": json.dumps({"note": "pt w/ cp, f/u 2wk"})}
+        second = {"headers": {"Authorization": "Bearer test-token"}, "body": json.dumps({"note": "pt w/ cp, f/u 3wk"})}
+        lambda_handler(first, MockContext())
+        result = lambda_handler(second, MockContext())
+
+        self.assertEqual(json.loads(result["body"])["cleaned_note"], "Patient with chest pain, follow up in 3 weeks")
+        self.assertEqual(mock_get_cleaned_note.call_count, 1)
+
+    @patch('lambda_function.verify_token')
+    @patch('lambda_function.save_to_dynamo')
+    @patch('lambda_function.get_cleaned_note')
+    @patch('lambda_function.expand_locally')
+    def test_note_covered_by_local_dictionary_skips_agent(self, mock_expand, mock_get_cleaned_note, mock_save_to_dynamo, mock_verify_token):
+        mock_verify_token.return_value = ("user123", "test@example.com")
+        mock_expand.return_value = ("Patient with chest pain", "local:abc123")
+        mock_save_to_dynamo.return_value = "note-1"
+
+        event = {"headers": {"Authorization": "Bearer test-token"}, "body": json.dumps({"note": "pt w/ cp"})}
+        result = lambda_handler(event, MockContext())
+
+        self.assertEqual(result["statusCode"], 200)
+        self.assertEqual(json.loads(result["body"])["cleaned_note"], "Patient with chest pain")
+        mock_get_cleaned_note.assert_not_called()
+        self.assertEqual(mock_save_to_dynamo.call_args.kwargs["agent_version"], "local:abc123")
+
+    @patch('lambda_function.verify_token')
+    @patch('lambda_function.save_to_dynamo')
+    @patch('lambda_function.get_cleaned_note')
+    def test_agent_out_of_time_returns_degraded_note(self, mock_get_cleaned_note, mock_save_to_dynamo, mock_verify_token):
+        mock_verify_token.return_value = ("user123", "test@example.com")
+        mock_get_cleaned_note.side_effect = DeadlineExceeded("_invoke_agent did not finish within 1.00s")
+        mock_save_to_dynamo.return_value = "note-1"
+
+        context = MockContext()
+        context.get_remaining_time_in_millis = lambda: 3000
+        event = {"headers": {"Authorization": "Bearer test-token"}, "body": json.dumps({"note": "pt w/ cp"})}
+        result = lambda_handler(event, context)
+
+        body = json.loads(result["body"])
+        self.assertEqual(result["statusCode"], 200)
+        self.assertTrue(body["degraded"])
+        self.assertEqual(body["cleaned_note"], "Pt w/ cp")
+        #the agent was left time to save the note, which is re-cleaned later
+        self.assertLessEqual(mock_get_cleaned_note.call_args.kwargs["deadline"].remaining(), 1.0)
+        self.assertEqual(mock_save_to_dynamo.call_args.kwargs["agent_version"], "degraded")
+
+    @patch('lambda_function.verify_token')
+    @patch('lambda_function.save_to_dynamo')
+    @patch('lambda_function.get_cleaned_note')
+    def test_rate_limited_user_gets_429(self, mock_get_cleaned_note, mock_save_to_dynamo, mock_verify_token):
+        mock_verify_token.return_value = ("user123", "test@example.com")
+        mock_get_cleaned_note.return_value = "Patient with chest pain"
+        mock_save_to_dynamo.return_value = "note-1"
+
+        event = {"headers": {"Authorization": "Bearer test-token"}, "body": json.dumps({"note": "pt w/ cp"})}
+        statuses = [lambda_handler(event, MockContext())["statusCode"] for _ in range(20)]
+        result = lambda_handler(event, MockContext())
+
+        self.assertEqual(statuses, [200] * 20)
+        self.assertEqual(result["statusCode"], 429)
+        self.assertGreaterEqual(int(result["headers"]["Retry-After"]), 1)
+
+    @patch('lambda_function.verify_token')
+    @patch('lambda_function.load_note')
+    @patch('lambda_function.save_to_dynamo')
+    @patch('lambda_function.get_cleaned_note')
+    def test_retry_with_idempotency_key_replays_response(self, mock_get_cleaned_note, mock_save_to_dynamo, mock_load_note,
+                                                         mock_verify_token):
+        mock_verify_token.return_value = ("user123", "test@example.com")
+        mock_get_cleaned_note.return_value = "Patient with chest pain"
+        mock_save_to_dynamo.return_value = "note-1"
+        mock_load_note.return_value = {'note_id': 'note-1', 'user_id': 'user123', 'cleaned_note': "Patient with chest pain"}
+
+        event = {"headers": {"Authorization": "Bearer test-token", "Idempotency-Key": "retry-1"},
+                 "body": json.dumps({"note": "pt w/ cp"})}
+        first = lambda_handler(event, MockContext())
+        retry = lambda_handler(event, MockContext())
+
+        self.assertEqual(retry["body"], first["body"])
+        self.assertEqual(retry["headers"]["Idempotent-Replayed"], "true")
+        #the record keeps no note text, the replay read it back from the note
+        record, = lambda_function.idempotency_store.items.values()
+        self.assertNotIn("chest pain", record['response'])
+        #under the key the note was saved with
+        created_at = mock_save_to_dynamo.call_args.kwargs["created_at"]
+        self.assertEqual(json.loads(first["body"])["created_at"], created_at)
+        mock_load_note.assert_called_once_with("note-1", "user123", created_at)
+        #a note deleted since is not brought back from the record
+        mock_load_note.return_value = None
+        self.assertEqual(lambda_handler(event, MockContext())["statusCode"], 410)
+        mock_get_cleaned_note.assert_called_once()
+        mock_save_to_dynamo.assert_called_once()
+        #the note_id is fixed up front so a request taking over a crashed one saves the same note
+        self.assertIsNotNone(mock_save_to_dynamo.call_args.kwargs["note_id"])
+
+        #same key, different note
+        event["body"] = json.dumps({"note": "pt c/o sob"})
+        self.assertEqual(lambda_handler(event, MockContext())["statusCode"], 422)
 
     @patch.dict(os.environ, {
         'BEDROCK_AGENT_ID': 'test-agent-id',
@@ -126,7 +259,41 @@ class TestLambdaHandler(unittest.TestCase):
         body = json.loads(result["body"])
         self.assertEqual(result["statusCode"], 200)
         self.assertIn("cleaned_note", body)
-        self.assertIsNone(body["note_id"])  # Should be None due to DB error
+        self.assertEqual(body["save_status"], "pending")
+
+        # The journaled note is saved by the next invocation, under the note_id it was meant to get
+        journaled_id = mock_save_to_dynamo.call_args.kwargs["note_id"]
+        self.assertEqual(body["note_id"], journaled_id)
+        with patch('write_journal.save_entry') as mock_save_entry:
+            mock_save_to_dynamo.side_effect = None
+            lambda_handler(event, MockContext())
+        self.assertEqual(mock_save_entry.call_args.args[0]["note_id"], journaled_id)
+        self.assertEqual(os.path.getsize(self.journal_path), 0)
+
+    @patch('lambda_function.verify_token')
+    @patch('lambda_function.load_note')
+    @patch('lambda_function.save_to_dynamo')
+    @patch('lambda_function.get_cleaned_note')
+    def test_retry_after_journaled_save_keeps_the_note_id(self, mock_get_cleaned_note, mock_save_to_dynamo,
+                                                           mock_load_note, mock_verify_token):
+        mock_verify_token.return_value = ("user123", "test@example.com")
+        mock_get_cleaned_note.return_value = "Patient with chest pain"
+        mock_save_to_dynamo.side_effect = Exception("DynamoDB connection failed")
+        mock_load_note.return_value = None
+
+        event = {"headers": {"Authorization": "Bearer test-token", "Idempotency-Key": "retry-2"},
+                 "body": json.dumps({"note": "pt w/ cp"})}
+        first = json.loads(lambda_handler(event, MockContext())["body"])
+        with patch('write_journal.replay_pending'):
+            # Not saved yet - the retry waits for the journaled note instead of claiming a second note_id
+            self.assertEqual(lambda_handler(event, MockContext())["statusCode"], 409)
+            mock_load_note.return_value = {'note_id': first["note_id"], 'cleaned_note': "Patient with chest pain"}
+            retry = lambda_handler(event, MockContext())
+
+        body = json.loads(retry["body"])
+        self.assertEqual((body["note_id"], body["save_status"]), (first["note_id"], "saved"))
+        self.assertEqual(retry["headers"]["Idempotent-Replayed"], "true")
+        mock_save_to_dynamo.assert_called_once()
 
     def test_missing_auth_header(self):
         """Test missing Authorization header"""
@@ -160,5 +327,132 @@ class TestLambdaHandler(unittest.TestCase):
         self.assertEqual(result["statusCode"], 401)
         self.assertIn("Invalid or expired token", body["error"])
 
+    @patch('db_client.get_user_version')
+    @patch('db_client.get_user_notes')
+    @patch('lambda_function.verify_token')
+    def test_history_decimal_fields(self, mock_verify_token, mock_get_user_notes, mock_get_user_version):
+        """History serializes the Decimal numbers DynamoDB returns"""
+        mock_verify_token.return_value = ("user123", "test@example.com")
+        mock_get_user_version.return_value = (0, 0.0)
+        mock_get_user_notes.return_value = [{
+            'note_id': 'note-1',
+            'cleaned_note': 'Patient with chest pain',
+            'created_at': '2025-06-27T02:11:07.834941',
+            'original_length': Decimal('7'),
+            'cleaned_length': Decimal('23'),
+        }]
+
+        event = {"headers": {"Authorization": "Bearer test-token"}}
+        result = history_lambda_handler(event, MockContext())
+        body = json.loads(result["body"])
+        self.assertEqual(result["statusCode"], 200)
+        self.assertEqual(body["notes"][0]["original_length"], 7)
+
+    @patch('db_client.get_user_version')
+    @patch('db_client.get_user_notes')
+    @patch('lambda_function.verify_token')
+    def test_history_etag_not_modified(self, mock_verify_token, mock_get_user_notes, mock_get_user_version):
+        """Matching If-None-Match returns 304 without querying notes"""
+        lambda_function._history_cache.clear()
+        mock_verify_token.return_value = ("user123", "test@example.com")
+        mock_get_user_version.return_value = (7, 1000.0)
+
+        event = {"headers": {"Authorization": "Bearer test-token", "if-none-match": '"v7"'}}
+        result = history_lambda_handler(event, MockContext())
+        self.assertEqual(result["statusCode"], 304)
+        self.assertEqual(result["headers"]["ETag"], '"v7"')
+        mock_get_user_notes.assert_not_called()
+
+    @patch('db_client.get_user_version')
+    @patch('db_client.get_user_notes')
+    @patch('lambda_function.verify_token')
+    def test_history_etag_cached_body(self, mock_verify_token, mock_get_user_notes, mock_get_user_version):
+        """Same version is served from the container cache, a new version re-queries"""
+        lambda_function._history_cache.clear()
+        mock_verify_token.return_value = ("user123", "test@example.com")
+        mock_get_user_notes.return_value = []
+        mock_get_user_version.return_value = (3, 1000.0)
+
+        event = {"headers": {"Authorization": "Bearer test-token"}}
+        first = history_lambda_handler(event, MockContext())
+        second = history_lambda_handler(event, MockContext())
+        self.assertEqual(first["headers"]["ETag"], '"v3"')
+        self.assertEqual(second["body"], first["body"])
+        self.assertEqual(mock_get_user_notes.call_count, 1)
+
+        mock_get_user_version.return_value = (4, 1000.0)
+        history_lambda_handler(event, MockContext())
+        self.assertEqual(mock_get_user_notes.call_count, 2)
+
+    @patch('db_client.get_user_version')
+    @patch('db_client.get_user_notes')
+    @patch('lambda_function.verify_token')
+    def test_history_no_etag_while_settling(self, mock_verify_token, mock_get_user_notes, mock_get_user_version):
+        """A version bumped moments ago gets no ETag (GSI may still be catching up)"""
+        lambda_function._history_cache.clear()
+        mock_verify_token.return_value = ("user123", "test@example.com")
+        mock_get_user_notes.return_value = []
+        mock_get_user_version.return_value = (5, time.time())
+
+        event = {"headers": {"Authorization": "Bearer test-token", "If-None-Match": '"v5"'}}
+        result = history_lambda_handler(event, MockContext())
+        self.assertEqual(result["statusCode"], 200)
+        self.assertNotIn("ETag", result["headers"])
+
+    @patch('db_client.get_user_changes_since')
+    @patch('lambda_function.verify_token')
+    def test_history_since_parameter(self, mock_verify_token, mock_changes):
+        """?since= switches history to a delta response"""
+        mock_verify_token.return_value = ("user123", "test@example.com")
+        mock_changes.return_value = {'full_resync': False, 'notes': [], 'deleted': ['note-1'],
+                                     'has_more': False, 'next_since': '2025-06-27T02:11:07'}
+
+        event = {"headers": {"Authorization": "Bearer test-token"},
+                 "queryStringParameters": {"since": "2025-06-27T02:11:07Z"}}
+        result = history_lambda_handler(event, MockContext())
+        body = json.loads(result["body"])
+        self.assertEqual(result["statusCode"], 200)
+        self.assertEqual(body["deleted"], ['note-1'])
+        mock_changes.assert_called_once_with("user123", "2025-06-27T02:11:07")
+
+        event["queryStringParameters"] = {"since": "yesterday"}
+        result = history_lambda_handler(event, MockContext())
+        self.assertEqual(result["statusCode"], 400)
+
+    @patch('search_index.search_notes')
+    @patch('lambda_function.verify_token')
+    def test_search(self, mock_verify_token, mock_search_notes):
+        mock_verify_token.return_value = ("user123", "test@example.com")
+        mock_search_notes.return_value = [{'note_id': 'note-1', 'created_at': '2025-06-27T02:11:07',
+                                           'score': 1.2, 'snippet': 'chest pain'}]
+
+        event = {"headers": {"Authorization": "Bearer test-token"},
+                 "queryStringParameters": {"q": "chest pa*", "limit": "5"}}
+        result = search_lambda_handler(event, MockContext())
+        body = json.loads(result["body"])
+        self.assertEqual(result["statusCode"], 200)
+        self.assertEqual(body["count"], 1)
+        mock_search_notes.assert_called_once_with("user123", "chest pa*", limit=5)
+
+        event["queryStringParameters"] = {}
+        self.assertEqual(search_lambda_handler(event, MockContext())["statusCode"], 400)
+    @patch('db_client.update_user_note')
+    @patch('lambda_function.verify_token')
+    def test_update_note(self, mock_verify_token, mock_update_user_note):
+        mock_verify_token.return_value = ("user123", "test@example.com")
+        mock_update_user_note.return_value = {'note_id': 'note-1', 'cleaned_note': 'Patient with chest pain'}
+
+        event = {"headers": {"Authorization": "Bearer test-token"},
+                 "pathParameters": {"note_id": "note-1"},
+                 "body": json.dumps({"cleaned_note": "Patient with chest pain"})}
+        result = update_note_lambda_handler(event, MockContext())
+        self.assertEqual(result["statusCode"], 200)
+        mock_update_user_note.assert_called_once_with("note-1", "user123", "Patient with chest pain", None)
+
+        #missing and foreign notes look the same
+        mock_update_user_note.return_value = None
+        self.assertEqual(update_note_lambda_handler(event, MockContext())["statusCode"], 404)
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
\ No newline at end of file
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import migrate_notes
+from parallel_scan import LocalTable
+
+
+def make_note(note_id, cleaned="Patient with chest pain"):
+    return {'note_id': note_id, 'user_id': 'user123', 'created_at': '2025-06-27T02:11:07',
+            'original_note': 'pt w/ cp', 'cleaned_note': cleaned}
+
+
+class TransactionCanceledException(Exception):
+    def __init__(self, reasons):
+        self.response = {'CancellationReasons': reasons}
+
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    @patch('migrate_notes.dynamodb')
+    def test_copy_skips_changed_and_already_copied_notes(self, mock_dynamodb):
+        client = mock_dynamodb.meta.client
+        client.exceptions.TransactionCanceledException = TransactionCanceledException
+        #note b changed since the scan (check failed), note c was already dual-written (put failed)
+        client.transact_write_items.side_effect = [
+            TransactionCanceledException([{'Code': 'None'}, {'Code': 'None'},
+                                          {'Code': 'ConditionalCheckFailed'}, {'Code': 'None'},
+                                          {'Code': 'None'}, {'Code': 'ConditionalCheckFailed'}]),
+            {}
+        ]
+        copied, skipped = migrate_notes.copy_batch([make_note('a'), make_note('b'), make_note('c')])
+        self.assertEqual((copied, skipped), (1, 2))
+
+        retried = client.transact_write_items.call_args.kwargs['TransactItems']
+        self.assertEqual(retried[0]['ConditionCheck']['Key'], {'note_id': 'a'})
+        self.assertEqual(retried[1]['Put']['Item']['note_key'], '2025-06-27T02:11:07#a')
+        self.assertEqual(retried[1]['Put']['ConditionExpression'], 'attribute_not_exists(note_key)')
+
+    def test_backfill_resumes_unfinished_segments(self):
+        checkpoint = os.path.join(self.tmp, "backfill.ckpt")
+        table = LocalTable([make_note(f"n{i}") for i in range(40)], max_page_items=5)
+        copied = []
+
+        def flaky_copy(items):
+            if any(item['note_id'] == 'n17' for item in items) and not copied_once:
+                raise Exception("throttled")
+            copied.extend(item['note_id'] for item in items)
+            return len(items), 0
+
+        copied_once = False
+        with patch('migrate_notes.legacy_table', table), patch('migrate_notes.copy_notes', side_effect=flaky_copy):
+            with self.assertRaises(Exception):
+                migrate_notes.backfill(segments=4, checkpoint_path=checkpoint)
+            copied_once = True
+            result = migrate_notes.backfill(segments=4, checkpoint_path=checkpoint)
+
+        #every note copied exactly once across both runs
+        self.assertEqual(sorted(copied), sorted(f"n{i}" for i in range(40)))
+        self.assertEqual(result['copied'], 40)
+        self.assertEqual(sorted(result['finished']), [0, 1, 2, 3])
+
+
+class TestVerify(unittest.TestCase):
+
+    def test_verify_finds_missing_different_and_orphaned(self):
+        legacy = LocalTable([make_note('same'), make_note('missing'), make_note('edited')])
+        v2 = LocalTable([dict(n, note_key=f"{n['created_at']}#{n['note_id']}")
+                         for n in [make_note('same'), make_note('edited', "stale text"), make_note('orphan')]],
+                        hash_key='user_id', range_key='note_key')
+
+        def recheck(note_id, v2_key):
+            return (next((n for n in legacy.items if n['note_id'] == note_id), None),
+                    next((n for n in v2.items if n['note_key'] == v2_key['note_key']), None))
+
+        with patch('migrate_notes.legacy_table', legacy), patch('migrate_notes.v2_table', v2), \
+                patch('migrate_notes._recheck', side_effect=recheck):
+            result = migrate_notes.verify(segments=2)
+        self.assertEqual((result['notes'], result['v2_notes']), (3, 3))
+        self.assertEqual(result['missing'], ['missing'])
+        self.assertEqual(result['different'], ['edited'])
+        self.assertEqual(result['orphaned'], ['orphan'])
+
+    def test_matching_tables(self):
+        notes = [make_note(f"n{i}") for i in range(50)]
+        v2 = LocalTable([dict(n, note_key=f"{n['created_at']}#{n['note_id']}") for n in notes],
+                        hash_key='user_id', range_key='note_key', max_page_items=7)
+        with patch('migrate_notes.legacy_table', LocalTable(notes, max_page_items=7)), patch('migrate_notes.v2_table', v2):
+            result = migrate_notes.verify(segments=4)
+        self.assertEqual(result['mismatched_buckets'], 0)
+        self.assertEqual((result['notes'], result['v2_notes']), (50, 50))
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,87 @@
+import unittest
+import near_duplicate
+from near_duplicate import NearDuplicateIndex, patch_template
+
+
+def tokens(note):
+    return [match.group(0) for match in near_duplicate.TOKEN_RE.finditer(note)]
+
+
+class TestPatchTemplate(unittest.TestCase):
+
+    def test_numbers_kept_verbatim_are_swapped(self):
+        self.assertEqual(patch_template(tokens("bp 130/85 hr 72"), tokens("bp 120/80 hr 72"),
+                                        "Blood pressure 120/80, heart rate 72"),
+                         "Blood pressure 130/85, heart rate 72")
+
+    def test_numbers_inside_rewritten_tokens_are_swapped(self):
+        self.assertEqual(patch_template(tokens("f/u 3wk"), tokens("f/u 2wk"), "Follow up in 2 weeks"),
+                         "Follow up in 3 weeks")
+
+    def test_unsafe_patches_fall_back(self):
+        #1 <-> many changes the words around the number
+        self.assertIsNone(patch_template(tokens("f/u 2wk"), tokens("f/u 1wk"), "Follow up in 1 week"))
+        #the old number occurs twice in the cleaned note
+        self.assertIsNone(patch_template(tokens("hr 80 bp 120/72"), tokens("hr 72 bp 120/72"),
+                                         "Heart rate 72, blood pressure 120 over 72"))
+        #a word was added
+        self.assertIsNone(patch_template(tokens("pt w/ cp and sob"), tokens("pt w/ cp"), "Patient with chest pain"))
+
+
+class TestNearDuplicateIndex(unittest.TestCase):
+
+    def test_near_duplicate_hit_and_metrics(self):
+        index = NearDuplicateIndex()
+        index.add("pt c/o cp, f/u 2wk", "Patient complains of chest pain, follow up in 2 weeks", 'agent:v1')
+
+        #patched output is marked, so it is re-cleaned and never mined as agent output
+        self.assertEqual(index.lookup("pt c/o cp, f/u 4wk"),
+                         ("Patient complains of chest pain, follow up in 4 weeks", 'near:agent:v1'))
+        self.assertEqual(index.lookup("PT c/o cp, f/u 2wk"),
+                         ("Patient complains of chest pain, follow up in 2 weeks", 'agent:v1'))
+        self.assertIsNone(index.lookup("pt denies cp today"))
+        stats = index.stats()
+        self.assertEqual((stats['lookups'], stats['hits'], stats['exact_hits']), (3, 2, 1))
+
+    def test_changed_words_go_to_the_agent(self):
+        index = NearDuplicateIndex()
+        index.add("pt w/ fever since yesterday, f/u 2wk", "Patient with fever since yesterday, follow up in 2 weeks")
+        index.add("no cough", "No cough")
+
+        self.assertIsNone(index.lookup("pt w/ sob since yesterday, f/u 2wk"))
+        self.assertIsNone(index.lookup("no hx"))
+        self.assertIsNone(patch_template(tokens("no hx"), tokens("no cough"), "No cough"))
+
+    def test_least_recently_used_shapes_are_evicted(self):
+        index = NearDuplicateIndex(max_entries=2)
+        index.add("pt w/ cp", "Patient with chest pain")
+        index.add("pt w/ sob", "Patient with shortness of breath")
+        index.lookup("pt w/ cp")
+        index.add("pt w/ ha", "Patient with headache")
+
+        self.assertIsNotNone(index.lookup("pt w/ cp"))
+        self.assertIsNone(index.lookup("pt w/ sob"))
+        self.assertEqual(index.stats()['evictions'], 1)
+
+    def test_flipped_signs_and_comparisons_miss(self):
+        index = NearDuplicateIndex()
+        index.add("pt +fever, +cough", "Patient positive for fever and cough")
+        index.add("temp > 38 today", "Temperature above 38 today")
+
+        self.assertIsNone(index.lookup("pt -fever, -cough"))
+        self.assertIsNone(index.lookup("temp < 39 today"))
+        self.assertIsNone(index.lookup("pt +fever, +cough?"))
+        self.assertEqual(index.lookup("temp > 39 today")[0], "Temperature above 39 today")
+
+    def test_notes_are_not_shared_between_owners(self):
+        index = NearDuplicateIndex()
+        index.add("pt w/ cp, f/u 2wk", "Patient with chest pain, follow up in 2 weeks", owner='user1')
+
+        self.assertIsNone(index.lookup("pt w/ cp, f/u 2wk", owner='user2'))
+        self.assertIsNone(index.lookup("pt w/ cp, f/u 3wk"))
+        self.assertEqual(index.lookup("pt w/ cp, f/u 3wk", owner='user1')[0],
+                         "Patient with chest pain, follow up in 3 weeks")
+
+
+if __name__ == '__main__':
+    unittest.main()
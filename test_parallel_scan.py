@@ -0,0 +1,92 @@
+import unittest
+from unittest.mock import patch
+from boto3.dynamodb.conditions import Attr
+import parallel_scan
+from parallel_scan import LocalTable
+
+
+def make_notes(count):
+    return [{'note_id': f"note-{i}", 'user_id': f"user-{i % 7}", 'status': 'completed',
+             'original_length': i, 'cleaned_length': i * 2, 'created_at': f"2025-06-{1 + i % 28:02d}T00:00:00"}
+            for i in range(count)]
+
+
+def local_notes_table():
+    #module level so it can be pickled into worker processes
+    return LocalTable(make_notes(300), max_page_items=16)
+
+
+def count_items(total, items):
+    return total + len(items)
+
+
+def add(a, b):
+    return a + b
+
+
+class TestParallelScan(unittest.TestCase):
+
+    @patch('parallel_scan.boto3.session.Session')
+    def test_each_worker_gets_its_own_table(self, mock_session):
+        class Table:
+            name = 'medical-notes'
+
+        factory = parallel_scan.worker_tables(Table())
+        factory(), factory()
+        self.assertEqual(mock_session.call_count, 2)
+        mock_session.return_value.resource.return_value.Table.assert_called_with('medical-notes')
+
+        local = local_notes_table()
+        self.assertIs(parallel_scan.worker_tables(local)(), local)
+
+    def test_every_item_scanned_once_across_segments(self):
+        table = local_notes_table()
+        pages = []
+        scan = parallel_scan.parallel_scan(lambda: table, segments=8,
+                                           callback=lambda segment, items, cursor: pages.append(items))
+        note_ids = [item['note_id'] for page in pages for item in page]
+        self.assertEqual(sorted(note_ids), sorted(item['note_id'] for item in table.items))
+        self.assertEqual((scan['scanned'], scan['count']), (300, 300))
+
+    def test_projection_and_filter_pushdown(self):
+        table = local_notes_table()
+        scan = parallel_scan.parallel_scan(
+            lambda: table, segments=4,
+            projection=['note_id', 'status'],
+            filter_expression=Attr('original_length').gte(100) & Attr('created_at').begins_with('2025-06-0'),
+            reducer=lambda found, items: found + items, initial=[], combine=add
+        )
+        expected = [n for n in table.items if n['original_length'] >= 100 and n['created_at'].startswith('2025-06-0')]
+        self.assertEqual(sorted(item['note_id'] for item in scan['result']), sorted(n['note_id'] for n in expected))
+        self.assertEqual(set(scan['result'][0]), {'note_id', 'status'})
+        #the filter runs after the read, so everything still counts as scanned
+        self.assertEqual(scan['scanned'], 300)
+
+    def test_process_pool_reduces_in_workers(self):
+        scan = parallel_scan.parallel_scan(local_notes_table, segments=4, reducer=count_items,
+                                           initial=0, combine=add, processes=True)
+        self.assertEqual(scan['result'], 300)
+
+    def test_resume_only_unfinished_segments(self):
+        table = local_notes_table()
+        cursors = {}
+        parallel_scan.parallel_scan(lambda: table, segments=2, page_size=10,
+                                    callback=lambda segment, items, cursor: cursors.setdefault(segment, cursor))
+        #pretend segment 0 finished and segment 1 stopped after its first page
+        scan = parallel_scan.parallel_scan(lambda: table, segments=2, page_size=10, only_segments=[1],
+                                           start_cursors={1: cursors[1]})
+        segment_one = len(table._segment(1, 2)[0])
+        self.assertEqual(scan['scanned'], segment_one - 10)
+
+    def test_fleet_summary(self):
+        scan = parallel_scan.parallel_scan(local_notes_table, segments=3, reducer=parallel_scan.summarize_page,
+                                           initial=parallel_scan.new_summary(), combine=parallel_scan.merge_summaries)
+        summary = scan['result']
+        self.assertEqual(summary['notes'], 300)
+        self.assertEqual(len(summary['users']), 7)
+        self.assertEqual(summary['original_chars'], sum(range(300)))
+        self.assertEqual(sum(summary['size_histogram'].values()), 300)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import purge_account
+
+
+class TestPurgeAccount(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    @patch('purge_account.dynamodb')
+    def test_batch_delete_retries_unprocessed(self, mock_dynamodb):
+        leftover = {'medical-notes': [{'DeleteRequest': {'Key': {'note_id': 'n2'}}}]}
+        mock_dynamodb.batch_write_item.side_effect = [{'UnprocessedItems': leftover}, {'UnprocessedItems': {}}]
+
+        self.assertEqual(purge_account.batch_delete('medical-notes', [{'note_id': 'n1'}, {'note_id': 'n2'}]), 2)
+        self.assertEqual(mock_dynamodb.batch_write_item.call_args.kwargs['RequestItems'], leftover)
+
+    @patch('purge_account.users_table')
+    @patch('purge_account.versions_table')
+    @patch('purge_account._partition_keys', return_value=[])
+    @patch('purge_account.batch_delete', side_effect=lambda table, keys: len(keys))
+    @patch('purge_account._note_keys_page')
+    def test_purge_resumes_and_deletes_user_last(self, mock_page, mock_batch_delete, mock_partition_keys, mock_versions,
+                                                 mock_users):
+        checkpoint = os.path.join(self.tmp, "purge.ckpt")
+        page_one = [{'note_id': f"a{i}"} for i in range(30)]
+        mock_page.side_effect = [(page_one, {'note_id': 'a29'}), Exception("throttled")]
+
+        with self.assertRaises(Exception):
+            purge_account.purge_user("user123", "doc@hospital.com", checkpoint_path=checkpoint)
+        mock_users.delete_item.assert_not_called()
+
+        #resume: last page, then an empty verification pass
+        mock_page.side_effect = [([{'note_id': 'b0'}], None), ([], None)]
+        result = purge_account.purge_user("user123", "doc@hospital.com", checkpoint_path=checkpoint)
+
+        self.assertEqual(mock_page.call_args_list[2].args, ("user123", {'note_id': 'a29'}))
+        self.assertEqual(result['deleted'], 31)
+        self.assertEqual(result['stage'], 'done')
+        mock_versions.delete_item.assert_called_once_with(Key={'user_id': 'user123'})
+        self.assertIn(('user#user123', 'bucket'), [call.args[1:] for call in mock_partition_keys.call_args_list])
+        mock_users.delete_item.assert_called_once_with(Key={'email': 'doc@hospital.com'})
+
+
+class TestRetention(unittest.TestCase):
+
+    @patch.dict('db_client.RETENTION_POLICIES', {'default': None, 'trial': 30})
+    def test_expires_at_for_policy(self):
+        import db_client
+        self.assertIsNone(db_client.expires_at_for('default'))
+        self.assertGreater(db_client.expires_at_for('trial'), 29 * 86400)
+        self.assertTrue(db_client.is_expired({'expires_at': 1}))
+        self.assertFalse(db_client.is_expired({}))
+        with self.assertRaises(ValueError):
+            db_client.expires_at_for('forever-and-ever')
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,86 @@
+import unittest
+from unittest.mock import patch
+import json_codec
+import reclean_queue
+from agent_client import AGENT_VERSION
+
+
+def note(note_id, version):
+    item = {'note_id': note_id, 'user_id': 'user123', 'original_note': 'pt w/ cp',
+            'cleaned_note': 'Patient with chest pain'}
+    if version:
+        item['agent_version'] = version
+    return item
+
+
+class TestRecleanQueue(unittest.TestCase):
+
+    def setUp(self):
+        reclean_queue._recent.clear()
+
+    @patch('reclean_queue._sqs')
+    @patch('reclean_queue.RECLEAN_QUEUE_URL', 'https://sqs.example/reclean')
+    def test_only_outdated_notes_are_enqueued_once(self, mock_sqs):
+        items = [note('current', AGENT_VERSION), note('old', 'agent:old-alias'), note('legacy', None)]
+
+        self.assertEqual(reclean_queue.enqueue_outdated(items), 2)
+        #hot notes read again straight away are not enqueued twice
+        self.assertEqual(reclean_queue.enqueue_outdated(items), 0)
+
+        entries = mock_sqs.send_message_batch.call_args.kwargs['Entries']
+        self.assertEqual([json_codec.loads(e['MessageBody'])['note_id'] for e in entries], ['old', 'legacy'])
+
+    @patch('db_client.sync_cleaned_note_change')
+    @patch('agent_client.get_cleaned_note')
+    @patch('db_client.dynamodb')
+    @patch('db_client.notes_table')
+    def test_reclean_note_writes_conditionally(self, mock_notes_table, mock_dynamodb, mock_get_cleaned_note, mock_sync):
+        mock_notes_table.name = 'medical-notes'
+        mock_notes_table.get_item.return_value = {'Item': note('old', 'agent:old-alias')}
+        mock_get_cleaned_note.return_value = 'Patient with chest pain (re-cleaned)'
+
+        self.assertTrue(reclean_queue.reclean_note('old', 'user123'))
+        put = mock_dynamodb.meta.client.put_item.call_args.kwargs
+        self.assertEqual(put['ConditionExpression'], 'cleaned_note = :old AND attribute_not_exists(edited_at)')
+        self.assertEqual(put['Item']['agent_version'], AGENT_VERSION)
+        mock_sync.assert_called_once_with('user123', 'old', None)
+
+    @patch('agent_client.get_cleaned_note')
+    @patch('db_client.notes_table')
+    def test_reclean_skips_current_and_foreign_notes(self, mock_notes_table, mock_get_cleaned_note):
+        mock_notes_table.get_item.return_value = {'Item': note('current', AGENT_VERSION)}
+        self.assertFalse(reclean_queue.reclean_note('current', 'user123'))
+        mock_notes_table.get_item.return_value = {'Item': note('old', 'agent:old-alias')}
+        self.assertFalse(reclean_queue.reclean_note('old', 'someone-else'))
+        mock_get_cleaned_note.assert_not_called()
+
+    @patch('reclean_queue.current_agent_version', return_value=AGENT_VERSION)
+    def test_notes_left_to_the_sweeper_are_not_outdated(self, _):
+        self.assertTrue(reclean_queue.is_outdated(note('near', 'near:agent:old-alias')))
+        self.assertFalse(reclean_queue.is_outdated(dict(note('degraded', 'degraded'), pending_status='pending')))
+        self.assertFalse(reclean_queue.is_outdated(note('degraded', 'degraded')))
+        self.assertFalse(reclean_queue.is_outdated(note('local', 'local:abc')))
+
+    @patch('reclean_queue.reclean_note')
+    def test_handler_hands_back_what_it_has_no_time_for(self, mock_reclean_note):
+        class Context:
+            remaining_ms = 60000
+
+            def get_remaining_time_in_millis(self):
+                return self.remaining_ms
+
+        def slow_reclean(note_id, user_id, created_at, deadline):
+            deadline.expires_at -= 30 #a slow agent call
+            return True
+
+        mock_reclean_note.side_effect = slow_reclean
+        records = [{'messageId': f"m{i}", 'body': json_codec.dumps({'note_id': f"n{i}", 'user_id': 'user123'})}
+                   for i in range(5)]
+        result = reclean_queue.reclean_handler({'Records': records}, Context())
+
+        self.assertEqual(mock_reclean_note.call_count, 2)
+        self.assertEqual([failure['itemIdentifier'] for failure in result['batchItemFailures']], ['m2', 'm3', 'm4'])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
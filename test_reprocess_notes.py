@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import reprocess_notes
+from throttle import TokenBucket
+
+
+def make_items(count, prefix="note"):
+    return [{'note_id': f"{prefix}-{i}", 'user_id': 'user123', 'original_note': f"pt w/ cp x{i}d",
+             'cleaned_note': f"old cleaning {i}"} for i in range(count)]
+
+
+class TestReprocessNotes(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.tmp, "reprocess.ckpt")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    @patch('reprocess_notes.write_batch')
+    @patch('reprocess_notes.get_cleaned_note')
+    @patch('reprocess_notes.fetch_page')
+    def test_resumes_after_crash(self, mock_fetch_page, mock_get_cleaned_note, mock_write_batch):
+        """A crash on the second page resumes from the checkpoint without redoing the first"""
+        page_one, page_two = make_items(3, "a"), make_items(2, "b")
+        mock_fetch_page.side_effect = [(page_one, {'note_id': 'a-2'}), Exception("scan failed")]
+        mock_get_cleaned_note.side_effect = lambda note, lane: note.replace("pt w/ cp", "Patient with chest pain")
+        mock_write_batch.side_effect = lambda updates: (len(updates), 0)
+
+        with self.assertRaises(Exception):
+            reprocess_notes.reprocess_notes(concurrency=2, rate=1000, checkpoint_path=self.checkpoint)
+
+        mock_fetch_page.side_effect = [(page_two, None)]
+        stats = reprocess_notes.reprocess_notes(concurrency=2, rate=1000, checkpoint_path=self.checkpoint)
+
+        mock_fetch_page.assert_called_with({'note_id': 'a-2'}, None, reprocess_notes.PAGE_SIZE)
+        self.assertEqual(stats['processed'], 5)
+        self.assertEqual(stats['updated'], 5)
+        self.assertEqual(mock_get_cleaned_note.call_args.kwargs, {"lane": "bulk"})
+        self.assertEqual(mock_get_cleaned_note.call_count, 5)
+
+    @patch('reprocess_notes.write_batch')
+    @patch('reprocess_notes.get_cleaned_note')
+    @patch('reprocess_notes.fetch_page')
+    def test_failed_and_unchanged_notes(self, mock_fetch_page, mock_get_cleaned_note, mock_write_batch):
+        items = make_items(3)
+        mock_fetch_page.return_value = (items, None)
+        mock_get_cleaned_note.side_effect = ["old cleaning 0", ValueError("Note too long"), "new cleaning"]
+        mock_write_batch.side_effect = lambda updates: (len(updates), 0)
+
+        stats = reprocess_notes.reprocess_notes(concurrency=1, rate=1000)
+        self.assertEqual((stats['unchanged'], stats['failed'], stats['updated']), (1, 1, 1))
+        written = mock_write_batch.call_args[0][0]
+        self.assertEqual(written, [(items[2], "new cleaning")])
+
+    @patch('reprocess_notes.write_batch')
+    @patch('reprocess_notes.fetch_page')
+    def test_async_mode_cleans_a_page_on_one_event_loop(self, mock_fetch_page, mock_write_batch):
+        items = make_items(4)
+        mock_fetch_page.return_value = (items, None)
+        mock_write_batch.side_effect = lambda updates: (len(updates), 0)
+
+        async def fake_clean(note):
+            if note.endswith("x3d"):
+                raise ValueError("Note too long")
+            return note.replace("pt w/ cp", "Patient with chest pain")
+
+        with patch('async_client.get_cleaned_note', side_effect=fake_clean):
+            stats = reprocess_notes.reprocess_notes(rate=1000, use_async=True)
+        self.assertEqual((stats['processed'], stats['updated'], stats['failed']), (4, 3, 1))
+        self.assertEqual(mock_write_batch.call_args[0][0][0], (items[0], "Patient with chest pain x0d"))
+
+    @patch('reprocess_notes.sync_cleaned_note_change')
+    @patch('reprocess_notes.dynamodb')
+    @patch('db_client.NOTES_TABLE_PHASE', 'legacy')
+    def test_write_batch_drops_changed_notes(self, mock_dynamodb, mock_sync):
+        """Notes deleted or edited since the read are skipped, the rest are retried"""
+        class TransactionCanceledException(Exception):
+            def __init__(self, reasons):
+                self.response = {'CancellationReasons': reasons}
+
+        client = mock_dynamodb.meta.client
+        client.exceptions.TransactionCanceledException = TransactionCanceledException
+        client.transact_write_items.side_effect = [
+            TransactionCanceledException([{'Code': 'None'}, {'Code': 'ConditionalCheckFailed'}, {'Code': 'None'}]),
+            {}
+        ]
+        items = make_items(3)
+        written, skipped = reprocess_notes.write_batch([(item, "new") for item in items])
+        self.assertEqual((written, skipped), (2, 1))
+        retried = client.transact_write_items.call_args.kwargs['TransactItems']
+        self.assertEqual([a['Put']['Item']['note_id'] for a in retried], ['note-0', 'note-2'])
+        self.assertEqual(mock_sync.call_count, 2)
+
+    def test_progress_line_has_eta(self):
+        stats = {'processed': 50, 'updated': 40, 'skipped': 0, 'failed': 1}
+        line = reprocess_notes.format_progress(stats, 100, 0, 50)
+        self.assertIn("50/100", line)
+        self.assertIn("ETA", line)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        self.assertEqual(bucket.try_acquire(), 0.0)
+        self.assertEqual(bucket.try_acquire(), 0.0)
+        wait = bucket.try_acquire()
+        self.assertGreater(wait, 0.0)
+        self.assertLessEqual(wait, 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
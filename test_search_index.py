@@ -0,0 +1,117 @@
+import unittest
+import uuid
+from unittest.mock import patch
+from boto3.dynamodb.types import Binary, TypeSerializer
+import search_index
+
+NOTE_A = str(uuid.uuid4())
+NOTE_B = str(uuid.uuid4())
+
+
+def stream_record(event_name, old=None, new=None):
+    serializer = TypeSerializer()
+    images = {name: {key: serializer.serialize(value) for key, value in image.items()}
+              for name, image in (('OldImage', old), ('NewImage', new)) if image}
+    return {'eventName': event_name, 'dynamodb': images}
+
+
+def postings(*entries):
+    return {Binary(search_index.encode_posting(note_id, tf)) for note_id, tf in entries}
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class TestSearchIndex(unittest.TestCase):
+
+    def test_tokenize_and_query_parsing(self):
+        self.assertEqual(search_index.tokenize("Patient with chest pain x2d"),
+                         ['patient', 'chest', 'pain', 'x2d'])
+        self.assertEqual(search_index.parse_query("chest the* pain"),
+                         [('chest', False), ('the', True), ('pain', False)])
+
+    def test_posting_round_trip(self):
+        encoded = postings((NOTE_A, 3), (NOTE_B, 300))
+        self.assertEqual(search_index.decode_postings(encoded), {NOTE_A: 3, NOTE_B: 255})
+
+    @patch('search_index.search_table')
+    def test_index_note_adds_one_posting_per_term(self, mock_search_table):
+        written = search_index.index_note("user123", NOTE_A, "chest pain, chest tightness")
+        self.assertEqual(written, 3)
+
+        updates = {call.kwargs['Key']['term']: call.kwargs for call in mock_search_table.update_item.call_args_list}
+        self.assertEqual(set(updates), {'chest', 'pain', 'tightness', search_index.STATS_TERM})
+        chest = updates['chest']
+        self.assertEqual(chest['UpdateExpression'], 'ADD postings :p')
+        self.assertEqual(search_index.decode_postings(chest['ExpressionAttributeValues'][':p']), {NOTE_A: 2})
+
+    @patch('search_index.search_table')
+    def test_note_counted_once(self, mock_search_table):
+        mock_search_table.meta.client.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+        doc_count_updates = lambda: [call for call in mock_search_table.update_item.call_args_list
+                                     if call.kwargs['Key']['term'] == search_index.STATS_TERM]
+        search_index.index_note("user123", NOTE_A, "chest pain")
+        marker = mock_search_table.put_item.call_args.kwargs
+        self.assertEqual(marker['Item']['term'], f"#doc#{NOTE_A}")
+        self.assertEqual(marker['ConditionExpression'], 'attribute_not_exists(term)')
+        self.assertEqual(len(doc_count_updates()), 1)
+
+        #a re-save or journal replay finds the marker already there
+        mock_search_table.put_item.side_effect = ConditionalCheckFailedException()
+        search_index.index_note("user123", NOTE_A, "chest pain")
+        self.assertEqual(len(doc_count_updates()), 1)
+
+        search_index.remove_note("user123", NOTE_A, "chest pain")
+        self.assertEqual(doc_count_updates()[-1].kwargs['ExpressionAttributeValues'], {':d': -1})
+        mock_search_table.delete_item.side_effect = ConditionalCheckFailedException()
+        search_index.remove_note("user123", NOTE_A, "chest pain")
+        self.assertEqual(len(doc_count_updates()), 2)
+
+    @patch('search_index.remove_note')
+    @patch('search_index.index_note')
+    def test_stream_keeps_index_in_step(self, mock_index_note, mock_remove_note):
+        saved = {'note_id': NOTE_A, 'user_id': 'user123', 'cleaned_note': 'Pt w/ cp', 'status': 'pending'}
+        recleaned = dict(saved, cleaned_note='Patient with chest pain', status='completed')
+        search_index.index_stream_handler({'Records': [
+            stream_record('INSERT', new=saved),
+            stream_record('MODIFY', old=saved, new=dict(saved, retry_at='2026-03-02T11:00:00')),
+            stream_record('MODIFY', old=saved, new=recleaned),
+            stream_record('REMOVE', old=recleaned),
+        ]}, None)
+
+        self.assertEqual([call.args for call in mock_index_note.call_args_list],
+                         [('user123', NOTE_A, 'Pt w/ cp'), ('user123', NOTE_A, 'Patient with chest pain')])
+        self.assertEqual([call.args for call in mock_remove_note.call_args_list],
+                         [('user123', NOTE_A, 'Pt w/ cp'), ('user123', NOTE_A, 'Patient with chest pain')])
+
+    @patch('search_index._batch_get')
+    def test_search_ranks_and_skips_deleted_notes(self, mock_batch_get):
+        deleted_note = str(uuid.uuid4())
+        index_items = [
+            {'term': 'chest', 'postings': postings((NOTE_A, 1), (NOTE_B, 3), (deleted_note, 5))},
+            {'term': search_index.STATS_TERM, 'doc_count': 40},
+        ]
+        notes = [
+            {'note_id': NOTE_A, 'user_id': 'user123', 'created_at': '2025-06-27T02:11:07',
+             'cleaned_note': 'Patient with chest pain for 2 days'},
+            {'note_id': NOTE_B, 'user_id': 'user123', 'created_at': '2025-06-28T02:11:07',
+             'cleaned_note': 'Chest pain, chest tightness, chest x-ray ordered'},
+        ]
+        mock_batch_get.side_effect = [index_items, notes]
+
+        results = search_index.search_notes("user123", "chest", limit=5)
+        self.assertEqual([r['note_id'] for r in results], [NOTE_B, NOTE_A])
+        self.assertIn('chest pain', results[1]['snippet'])
+
+        #past its retention, before TTL has deleted it
+        notes[1]['expires_at'] = 1000
+        mock_batch_get.side_effect = [index_items, notes]
+        self.assertEqual([r['note_id'] for r in search_index.search_notes("user123", "chest")], [NOTE_A])
+
+    def test_empty_query(self):
+        self.assertEqual(search_index.search_notes("user123", "the and"), [])
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
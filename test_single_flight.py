@@ -0,0 +1,147 @@
+import os
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from local_agent import LocalAgent
+from single_flight import SingleFlight, LocalFlightStore, run_shared
+from deadline import DeadlineExceeded
+
+with patch.dict(os.environ, {'BEDROCK_AGENT_ID': 'test-agent-id', 'BEDROCK_AGENT_ALIAS_ID': 'test-alias-id'}):
+    import agent_client
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_callers_share_one_call(self):
+        flights = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def slow():
+            calls.append(1)
+            release.wait(2)
+            return "cleaned"
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            futures = [pool.submit(flights.do, "pt w/ cp", slow) for _ in range(5)]
+            while flights.metrics['calls'] + flights.metrics['shared'] < 5:
+                time.sleep(0.01)
+            release.set()
+            self.assertEqual([future.result() for future in futures], ["cleaned"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flights.metrics, {'calls': 1, 'shared': 4})
+
+        #finished flights are forgotten - the next caller runs again
+        flights.do("pt w/ cp", slow)
+        self.assertEqual(len(calls), 2)
+
+    def test_error_is_shared_too(self):
+        flights = SingleFlight()
+        started = threading.Event()
+
+        def failing():
+            started.set()
+            time.sleep(0.1)
+            raise Exception("AI service temporarily unavailable")
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(flights.do, "note", failing)
+            started.wait()
+            follower = pool.submit(flights.do, "note", failing)
+            for future in (leader, follower):
+                with self.assertRaises(Exception):
+                    future.result()
+        self.assertEqual(flights.metrics['calls'], 1)
+
+    def test_leader_out_of_time_is_not_shared(self):
+        flights = SingleFlight()
+        started = threading.Event()
+
+        def out_of_time():
+            started.set()
+            time.sleep(0.1)
+            raise DeadlineExceeded("Agent call did not finish within the deadline")
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(flights.do, "note", out_of_time)
+            started.wait()
+            follower = pool.submit(flights.do, "note", lambda: "cleaned")
+            with self.assertRaises(DeadlineExceeded):
+                leader.result()
+            #the follower had time left - it ran the call itself
+            self.assertEqual(follower.result(), "cleaned")
+        self.assertEqual(flights.metrics['calls'], 2)
+
+
+class TestRunShared(unittest.TestCase):
+
+    def test_result_reused_by_another_container(self):
+        store = LocalFlightStore()
+        calls = []
+        fn = lambda: calls.append(1) or "cleaned"
+
+        self.assertEqual(run_shared(store, "k", fn), "cleaned")
+        metrics = {}
+        self.assertEqual(run_shared(store, "k", fn, metrics=metrics), "cleaned")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(metrics, {'remote_shared': 1})
+
+        #once the done window has passed the call runs again
+        self.assertEqual(run_shared(store, "k", fn, clock=lambda: time.time() + 60), "cleaned")
+        self.assertEqual(len(calls), 2)
+
+    def test_waits_for_running_leader_and_gets_its_error(self):
+        store = LocalFlightStore()
+        store.acquire("k", "other-container", int(time.time()))
+
+        def leader_fails(_):
+            store.finish("k", "other-container", 'failed', "AI agent not found - check configuration", int(time.time()))
+
+        with self.assertRaises(Exception) as raised:
+            run_shared(store, "k", lambda: "never called", sleep=leader_fails)
+        self.assertEqual(str(raised.exception), "AI agent not found - check configuration")
+
+    def test_leader_out_of_time_hands_the_call_over(self):
+        store = LocalFlightStore()
+
+        def out_of_time():
+            raise DeadlineExceeded("Agent call did not finish within the deadline")
+
+        with self.assertRaises(DeadlineExceeded):
+            run_shared(store, "k", out_of_time)
+        #the next caller runs it straight away instead of getting the leader's deadline
+        self.assertEqual(run_shared(store, "k", lambda: "cleaned", sleep=lambda _: self.fail("waited")), "cleaned")
+
+    def test_unreachable_store_falls_back_to_calling(self):
+        class BrokenStore:
+            def read(self, key):
+                raise Exception("ProvisionedThroughputExceededException")
+
+        self.assertEqual(run_shared(BrokenStore(), "k", lambda: "cleaned"), "cleaned")
+
+
+class TestAgentClient(unittest.TestCase):
+
+    @patch('agent_client.bedrock_agent', LocalAgent(latency=0.2))
+    def test_identical_notes_in_flight_make_one_agent_call(self):
+        notes = ["pt w/ cp", "pt  w/ cp ", "pt w/ cp", "pt c/o sob"]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(agent_client.get_cleaned_note, notes))
+
+        self.assertEqual(results, ["Patient with chest pain"] * 3 + ["Patient complains of shortness of breath"])
+        self.assertEqual(agent_client.bedrock_agent.calls, 2)
+
+    @patch('agent_client.bedrock_agent', LocalAgent(latency=0.2))
+    def test_lanes_do_not_share_calls(self):
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            bulk = pool.submit(agent_client.get_cleaned_note, "pt w/ cp", lane='bulk')
+            interactive = pool.submit(agent_client.get_cleaned_note, "pt w/ cp")
+            self.assertEqual(interactive.result(), bulk.result())
+        #an interactive note is not left waiting on a bulk call
+        self.assertEqual(agent_client.bedrock_agent.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import patch
+import status_sweeper
+from agent_client import AGENT_VERSION
+
+NOW = datetime(2026, 3, 2, 12, 0, 0)
+
+
+def pending_note(note_id, status='pending', attempts=0, created_at='2026-03-02T11:00:00.000000', **extra):
+    item = {'note_id': note_id, 'user_id': 'user123', 'original_note': 'pt w/ cp', 'cleaned_note': 'Pt w/ cp',
+            'created_at': created_at, 'status': status, 'pending_status': status,
+            'retry_at': created_at, 'attempts': attempts, 'agent_version': 'degraded'}
+    item.update(extra)
+    return item
+
+
+class TestStatusSweeper(unittest.TestCase):
+
+    @patch('status_sweeper.sync_cleaned_note_change')
+    @patch('agent_client.get_cleaned_note')
+    @patch('db_client.dynamodb')
+    @patch('db_client.notes_table')
+    def test_sweep_retries_only_indexed_notes(self, mock_notes_table, mock_dynamodb, mock_get_cleaned_note, mock_sync):
+        mock_notes_table.name = 'medical-notes'
+        mock_notes_table.query.side_effect = [
+            {'Items': [pending_note('a')], 'LastEvaluatedKey': {'note_id': 'a'}},
+            {'Items': [pending_note('b')]},
+            {'Items': []}
+        ]
+        mock_get_cleaned_note.return_value = 'Patient with chest pain'
+
+        stats = status_sweeper.sweep(now=NOW)
+
+        self.assertEqual(stats['completed'], 2)
+        mock_notes_table.scan.assert_not_called()
+        queries = [call.kwargs for call in mock_notes_table.query.call_args_list]
+        self.assertTrue(all(q['IndexName'] == 'pending-status-index' for q in queries))
+        self.assertEqual(queries[1]['ExclusiveStartKey'], {'note_id': 'a'})
+        mock_get_cleaned_note.assert_called_with('pt w/ cp', lane='bulk')
+
+        put = mock_dynamodb.meta.client.put_item.call_args.kwargs
+        self.assertEqual(put['ConditionExpression'], 'pending_status = :status AND retry_at = :retry_at')
+        #settled notes drop out of the sparse index
+        self.assertEqual(put['Item']['status'], 'completed')
+        self.assertEqual(put['Item']['agent_version'], AGENT_VERSION)
+        for name in ('pending_status', 'retry_at', 'attempts'):
+            self.assertNotIn(name, put['Item'])
+        mock_sync.assert_called_with('user123', 'b', '2026-03-02T11:00:00.000000')
+
+    @patch('agent_client.get_cleaned_note')
+    @patch('db_client.dynamodb')
+    @patch('db_client.notes_table')
+    def test_failed_retry_backs_off(self, mock_notes_table, mock_dynamodb, mock_get_cleaned_note):
+        mock_notes_table.name = 'medical-notes'
+        mock_get_cleaned_note.side_effect = Exception("agent down")
+
+        self.assertEqual(status_sweeper.sweep_note(pending_note('a', status='failed', attempts=2), NOW), 'failed')
+        item = mock_dynamodb.meta.client.put_item.call_args.kwargs['Item']
+        self.assertEqual((item['status'], item['pending_status'], item['attempts']), ('failed', 'failed', 3))
+        self.assertEqual(item['retry_at'], '2026-03-02T12:20:00.000000') #300s * 2**2
+
+    @patch('agent_client.get_cleaned_note')
+    @patch('db_client.dynamodb')
+    @patch('db_client.notes_table')
+    def test_stuck_notes_expire_and_edited_notes_settle(self, mock_notes_table, mock_dynamodb, mock_get_cleaned_note):
+        mock_notes_table.name = 'medical-notes'
+        put_item = mock_dynamodb.meta.client.put_item
+
+        self.assertEqual(status_sweeper.sweep_note(pending_note('a', attempts=5), NOW), 'expired')
+        self.assertEqual(put_item.call_args.kwargs['Item']['status'], 'expired')
+        self.assertNotIn('pending_status', put_item.call_args.kwargs['Item'])
+
+        old = pending_note('b', created_at='2026-02-28T09:00:00.000000')
+        self.assertEqual(status_sweeper.sweep_note(old, NOW), 'expired')
+
+        edited = pending_note('c', edited_at='2026-03-02T11:30:00', cleaned_note='Edited by hand')
+        self.assertEqual(status_sweeper.sweep_note(edited, NOW), 'settled')
+        self.assertEqual(put_item.call_args.kwargs['Item']['cleaned_note'], 'Edited by hand')
+        mock_get_cleaned_note.assert_not_called()
+
+    @patch('agent_client.get_cleaned_note')
+    @patch('db_client.dynamodb')
+    @patch('db_client.notes_table')
+    def test_note_changed_meanwhile_is_skipped(self, mock_notes_table, mock_dynamodb, mock_get_cleaned_note):
+        mock_notes_table.name = 'medical-notes'
+        client = mock_dynamodb.meta.client
+        client.exceptions.ConditionalCheckFailedException = type('ConditionalCheckFailed', (Exception,), {})
+        client.exceptions.TransactionCanceledException = type('TransactionCanceled', (Exception,), {})
+        client.put_item.side_effect = client.exceptions.ConditionalCheckFailedException()
+        mock_get_cleaned_note.return_value = 'Patient with chest pain'
+
+        self.assertEqual(status_sweeper.sweep_note(pending_note('a'), NOW), 'skipped')
+
+    @patch('db_client.bump_user_version')
+    @patch('db_client.notes_table')
+    def test_degraded_save_enters_index(self, mock_notes_table, mock_bump):
+        import db_client
+        context = SimpleNamespace(aws_request_id='req-1')
+        db_client.save_to_dynamo('user123', 'pt w/ cp', 'Pt w/ cp', context, status='pending')
+        item = mock_notes_table.put_item.call_args.kwargs['Item']
+        self.assertEqual((item['pending_status'], item['retry_at'], item['attempts']), ('pending', item['created_at'], 0))
+
+        db_client.save_to_dynamo('user123', 'pt w/ cp', 'Patient with chest pain', context)
+        self.assertNotIn('pending_status', mock_notes_table.put_item.call_args.kwargs['Item'])
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,97 @@
+import unittest
+from unittest.mock import patch
+from throttle import TokenBucket, RateLimiter, LocalRateStore, tenant_for
+
+PLANS = {'standard': {'user_per_minute': 60, 'user_burst': 10, 'tenant_per_minute': 600, 'tenant_burst': 15}}
+
+
+@patch('throttle.PLANS', PLANS)
+class TestRateLimiter(unittest.TestCase):
+
+    def test_user_burst_then_retry_after(self):
+        limiter = RateLimiter()
+        self.assertEqual([limiter.check("u1", "mercy.org") for _ in range(10)], [0.0] * 10)
+        wait = limiter.check("u1", "mercy.org")
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1.0)
+        #other users have their own bucket
+        self.assertEqual(limiter.check("u2", "mercy.org"), 0.0)
+
+    def test_tenant_bucket_covers_all_its_users(self):
+        limiter = RateLimiter()
+        results = [limiter.check(f"u{i}", "mercy.org") for i in range(20)]
+        self.assertEqual(results.count(0.0), 15)
+        self.assertEqual(limiter.check("someone", "other.org"), 0.0)
+
+    def test_containers_see_each_others_usage(self):
+        store = LocalRateStore()
+        clock = lambda: 6000.0 #start of a window, nothing has refilled since
+        first, second = RateLimiter(store, clock, flush_seconds=None), RateLimiter(store, clock, flush_seconds=None)
+        for _ in range(5):
+            self.assertEqual(first.check("u1", "mercy.org"), 0.0)
+        self.assertEqual(first.metrics['syncs'], 2) #new user and tenant buckets are seeded
+        #the background flush reports what a container used
+        first.flush()
+        self.assertEqual(first.metrics['syncs'], 4)
+        #second's new bucket starts from the counter, not a full burst - first's 5 are gone
+        results = [second.check("u1", "mercy.org") for _ in range(6)]
+        self.assertEqual(results[:5], [0.0] * 5)
+        self.assertGreater(results[5], 0)
+        self.assertEqual(second.metrics['syncs'], 2)
+
+    @patch('throttle.SYNC_SECONDS', 0)
+    def test_nearly_empty_bucket_syncs_before_admitting(self):
+        store = LocalRateStore()
+        clock = lambda: 6000.0
+        first, second = RateLimiter(store, clock, flush_seconds=None), RateLimiter(store, clock, flush_seconds=None)
+        self.assertEqual(second.check("u1", "mercy.org"), 0.0)
+        for _ in range(4):
+            self.assertEqual(first.check("u1", "mercy.org"), 0.0)
+        first.flush()
+        #second has 9 left locally; nearly empty, it syncs and learns of first's 4
+        results = [second.check("u1", "mercy.org") for _ in range(7)]
+        self.assertEqual(results[:6], [0.0] * 6)
+        self.assertGreater(results[6], 0)
+
+    def test_checks_do_not_wait_on_the_store(self):
+        class CountingStore(LocalRateStore):
+            calls = 0
+
+            def add(self, key, window, count):
+                CountingStore.calls += 1
+                return super().add(key, window, count)
+
+        limiter = RateLimiter(CountingStore(), flush_seconds=None)
+        self.assertEqual(limiter.check("u1", "mercy.org"), 0.0)
+        self.assertEqual(CountingStore.calls, 2) #only new buckets are seeded first
+        for _ in range(4):
+            self.assertEqual(limiter.check("u1", "mercy.org"), 0.0)
+        self.assertEqual(CountingStore.calls, 2)
+        limiter.flush()
+        self.assertEqual(CountingStore.calls, 4)
+        self.assertEqual(limiter.store.counters[("user#u1", int(limiter.clock() // 60))], 5)
+
+    def test_unreachable_store_limits_locally(self):
+        class BrokenStore:
+            def add(self, key, window, count):
+                raise Exception("ProvisionedThroughputExceededException")
+
+        limiter = RateLimiter(BrokenStore(), flush_seconds=None)
+        results = [limiter.check("u1", "mercy.org") for _ in range(11)]
+        self.assertEqual(results[:10], [0.0] * 10)
+        self.assertGreater(results[10], 0)
+
+    def test_tenant_is_email_domain(self):
+        self.assertEqual(tenant_for("Dr.Smith@Mercy.org"), "mercy.org")
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_drain_puts_bucket_in_debt(self):
+        bucket = TokenBucket(rate=10, capacity=5)
+        bucket.drain(7)
+        self.assertGreater(bucket.try_acquire(), 0.25)
+
+
+if __name__ == '__main__':
+    unittest.main()
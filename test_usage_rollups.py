@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+import json_codec
+import usage_rollups
+
+_serializer = TypeSerializer()
+
+
+def stream_record(event_id, event_name, note, ttl=False, changed_at=1751000000):
+    image = {key: _serializer.serialize(value) for key, value in note.items()}
+    record = {'eventID': event_id, 'eventName': event_name,
+              'dynamodb': {'ApproximateCreationDateTime': changed_at}}
+    record['dynamodb']['NewImage' if event_name == 'INSERT' else 'OldImage'] = image
+    if ttl:
+        record['userIdentity'] = {'type': 'Service', 'principalId': 'dynamodb.amazonaws.com'}
+    return record
+
+
+def note(note_id, user_id, created_at, original_length=100, cleaned_length=150, processing_ms=1200):
+    return {'note_id': note_id, 'user_id': user_id, 'created_at': created_at,
+            'original_length': original_length, 'cleaned_length': cleaned_length,
+            'proccessing_time_ms': processing_ms}
+
+
+class TestUsageRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = usage_rollups.LocalUsageStore(os.path.join(self.tmp, "usage.json"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_inserts_and_deletes_roll_up_per_user_and_globally(self):
+        records = [
+            stream_record('e1', 'INSERT', note('n1', 'u1', '2025-06-27T10:15:00')),
+            stream_record('e2', 'INSERT', note('n2', 'u1', '2025-06-27T11:05:00', 40, 60, 800)),
+            stream_record('e3', 'INSERT', note('n3', 'u2', '2025-06-28T09:00:00')),
+            stream_record('e4', 'MODIFY', note('n1', 'u1', '2025-06-27T10:15:00')),
+            #deleted by the user on 2025-06-27 vs removed by TTL
+            stream_record('e5', 'REMOVE', note('n2', 'u1', '2025-06-27T11:05:00')),
+            stream_record('e6', 'REMOVE', note('n3', 'u2', '2025-06-28T09:00:00'), ttl=True)
+        ]
+        self.assertEqual(usage_rollups.process_records(records, self.store), (1, 0))
+
+        daily = usage_rollups.get_usage('u1', store=self.store)
+        self.assertEqual(daily, [{'notes': 2, 'deleted': 1, 'original_chars': 140, 'cleaned_chars': 210,
+                                  'agent_ms': 2000, 'period': '2025-06-27'}])
+        hourly = usage_rollups.get_usage('u1', 'hour', '2025-06-27T10', '2025-06-27T11', store=self.store)
+        self.assertEqual([(h['period'], h['notes']) for h in hourly], [('2025-06-27T10', 1), ('2025-06-27T11', 1)])
+        fleet = usage_rollups.get_usage(store=self.store)
+        self.assertEqual([(d['period'], d['notes'], d['deleted']) for d in fleet],
+                         [('2025-06-27', 2, 1), ('2025-06-28', 1, 0)])
+
+    def test_redelivered_batch_is_not_counted_twice(self):
+        records = [stream_record(f"e{i}", 'INSERT', note(f"n{i}", 'u1', '2025-06-27T10:00:00')) for i in range(3)]
+        usage_rollups.process_records(records, self.store)
+
+        #a new store instance reads the same file, like a retried Lambda
+        store = usage_rollups.LocalUsageStore(self.store.path)
+        self.assertEqual(usage_rollups.process_records(records, store), (0, 1))
+        self.assertEqual(usage_rollups.get_usage('u1', store=store)[0]['notes'], 3)
+
+    def test_large_batches_split_into_transaction_sized_groups(self):
+        #every user adds 4 rollups (user hour/day) plus the 2 shared global ones
+        records = [stream_record(f"e{i}", 'INSERT', note(f"n{i}", f"u{i}", '2025-06-27T10:00:00')) for i in range(120)]
+        groups = usage_rollups.group_records(records)
+
+        self.assertGreater(len(groups), 1)
+        self.assertTrue(all(len(totals) <= usage_rollups.MAX_UPDATES_PER_GROUP for _, totals in groups))
+        self.assertEqual(sum(totals[('global', 'day#2025-06-27')]['notes'] for _, totals in groups), 120)
+        self.assertEqual(groups, usage_rollups.group_records(records))
+
+    @patch('usage_rollups.dynamodb')
+    def test_dynamo_store_adds_counters_with_a_marker(self, mock_dynamodb):
+        table = MagicMock()
+        table.name = 'medical-note-usage'
+        client = mock_dynamodb.meta.client
+        client.exceptions.TransactionCanceledException = ClientError
+        totals = {('user#u1', 'hour#2025-06-27T10'): {'notes': 1, 'deleted': 0, 'original_chars': 100,
+                                                       'cleaned_chars': 150, 'agent_ms': 1200}}
+
+        self.assertTrue(usage_rollups.DynamoUsageStore(table).apply('g1', totals))
+        actions = client.transact_write_items.call_args.kwargs['TransactItems']
+        self.assertEqual(actions[0]['Put']['Item']['bucket'], 'g1')
+        update = actions[1]['Update']
+        self.assertTrue(update['UpdateExpression'].startswith('ADD '))
+        self.assertIn('if_not_exists(expires_at', update['UpdateExpression'])
+        self.assertNotIn('deleted', update['ExpressionAttributeNames'].values())
+
+        client.transact_write_items.side_effect = ClientError(
+            {'Error': {'Code': 'TransactionCanceledException'},
+             'CancellationReasons': [{'Code': 'ConditionalCheckFailed'}, {'Code': 'None'}]}, 'TransactWriteItems')
+        self.assertFalse(usage_rollups.DynamoUsageStore(table).apply('g1', totals))
+
+    def test_read_records_accepts_event_documents_and_json_lines(self):
+        records = [stream_record('e1', 'INSERT', note('n1', 'u1', '2025-06-27T10:00:00')),
+                   stream_record('e2', 'INSERT', note('n2', 'u1', '2025-06-27T10:00:00'))]
+        event_path = os.path.join(self.tmp, "event.json")
+        lines_path = os.path.join(self.tmp, "records.ndjson")
+        with open(event_path, 'w') as f:
+            f.write(json_codec.dumps({'Records': records}))
+        with open(lines_path, 'w') as f:
+            f.write('\n'.join(json_codec.dumps(record) for record in records) + '\n')
+
+        self.assertEqual(usage_rollups.read_records(event_path), records)
+        self.assertEqual(usage_rollups.read_records(lines_path), records)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import write_journal
+
+
+def entry(note_id, cleaned="Patient with chest pain"):
+    return {'note_id': note_id, 'created_at': '2026-10-19T08:00:00', 'user_id': 'user123',
+            'original_note': 'pt w/ cp', 'cleaned_note': cleaned, 'agent_version': 'a:b', 'request_id': 'r1'}
+
+
+class TestWriteJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'journal.ndjson')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_replay_saves_each_note_once(self):
+        self.assertTrue(write_journal.record(entry('n1', "first try"), self.path))
+        self.assertTrue(write_journal.record(entry('n2'), self.path))
+        self.assertTrue(write_journal.record(entry('n1'), self.path))
+        with open(self.path, 'a') as f:
+            f.write('{"note_id": "n3", "user') #crash mid-append
+
+        saved = []
+        self.assertEqual(write_journal.replay(lambda e, deadline: saved.append(e), self.path), (2, 0))
+        self.assertEqual([(e['note_id'], e['cleaned_note']) for e in saved],
+                         [('n1', "Patient with chest pain"), ('n2', "Patient with chest pain")])
+        self.assertFalse(write_journal.pending(self.path))
+
+    def test_failed_save_keeps_the_rest(self):
+        for note_id in ('n1', 'n2', 'n3'):
+            write_journal.record(entry(note_id), self.path)
+        calls = []
+
+        def flaky(e, deadline):
+            calls.append(e['note_id'])
+            if e['note_id'] == 'n2':
+                raise Exception("ProvisionedThroughputExceededException")
+
+        self.assertEqual(write_journal.replay(flaky, self.path), (1, 2))
+        self.assertEqual(calls, ['n1', 'n2'])
+        self.assertEqual(write_journal.replay(lambda e, deadline: None, self.path), (2, 0))
+
+    @patch('write_journal._retry_after', 0.0)
+    def test_replay_pending_backs_off_while_store_is_down(self):
+        write_journal.record(entry('n1'), self.path)
+        with patch('write_journal.save_entry', side_effect=Exception("unreachable")) as mock_save:
+            self.assertEqual(write_journal.replay_pending(path=self.path), 0)
+            self.assertEqual(write_journal.replay_pending(path=self.path), 0)
+        self.assertEqual(mock_save.call_count, 1)
+        self.assertTrue(write_journal.pending(self.path))
+
+    @patch('db_client.save_to_dynamo')
+    def test_replayed_note_is_saved_once_under_its_key(self, mock_save):
+        write_journal.record(entry('n1'), self.path)
+        self.assertEqual(write_journal.replay(path=self.path), (1, 0))
+        kwargs = mock_save.call_args.kwargs
+        self.assertEqual((kwargs['note_id'], kwargs['created_at'], kwargs['once']), ('n1', '2026-10-19T08:00:00', True))
+
+    def test_nothing_to_replay(self):
+        with patch('write_journal.replay') as mock_replay:
+            self.assertEqual(write_journal.replay_pending(path=self.path), 0)
+        mock_replay.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+import os
+import threading
+import time
+import boto3
+import json_codec
+
+#Token bucket shared by the bulk tools to cap request rates, and the
+#per-user/per-tenant RateLimiter in front of the agent.
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        #rate: tokens added per second, capacity: burst size (defaults to one second of rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        #returns 0 if the tokens were taken, otherwise the seconds until they would be available
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def available(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+    def drain(self, tokens):
+        #take tokens used elsewhere (may go negative, the debt is refilled first); negative gives them back
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens - tokens)
+
+    def acquire(self, tokens=1):
+        #blocks until the tokens are available
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return
+            time.sleep(wait)
+
+
+#RateLimiter: every request takes a token from its user's bucket and from its
+#tenant's (email domain) bucket. Buckets live in the container; a background
+#thread ADDs what each container used to a per-key counter in RATE_LIMIT_TABLE
+#every SYNC_SECONDS, and the other containers' usage that comes back is drained
+#from the local bucket. A bucket new to the container syncs before its first
+#request and starts from the shared counter (less what has refilled since the
+#window began) instead of a full burst. After that checks stay local - only
+#when a bucket is down to its last NEAR_EMPTY share does the request sync first
+#(at most once per SYNC_SECONDS). A container hears of the others' usage only
+#when it syncs, so until then each container serving a key can spend what its
+#bucket held at its last sync: the fleet overshoots a bucket by at most one
+#burst per container beyond the first, far less when the usage is spread out.
+#Without RATE_LIMIT_TABLE the buckets are per container.
+
+#requests per minute and burst size, per user and per tenant
+PLANS = {
+    'standard': {'user_per_minute': 30, 'user_burst': 20, 'tenant_per_minute': 300, 'tenant_burst': 100},
+    'enterprise': {'user_per_minute': 60, 'user_burst': 40, 'tenant_per_minute': 3000, 'tenant_burst': 500},
+}
+#RATE_LIMIT_PLANS='{"standard": {"user_per_minute": 20}}' overrides or adds plans,
+#RATE_LIMIT_TENANT_PLANS='{"mercy.org": "enterprise"}' moves tenants off DEFAULT_PLAN
+for _name, _limits in json_codec.loads(os.environ.get("RATE_LIMIT_PLANS") or "{}").items():
+    PLANS[_name] = dict(PLANS.get(_name, PLANS['standard']), **_limits)
+TENANT_PLANS = json_codec.loads(os.environ.get("RATE_LIMIT_TENANT_PLANS") or "{}")
+DEFAULT_PLAN = os.environ.get("RATE_LIMIT_DEFAULT_PLAN", "standard")
+if DEFAULT_PLAN not in PLANS:
+    raise ValueError(f"Unknown RATE_LIMIT_DEFAULT_PLAN: {DEFAULT_PLAN}")
+#a misspelled plan would otherwise fail every request from that tenant
+for _tenant, _plan in TENANT_PLANS.items():
+    if _plan not in PLANS:
+        raise ValueError(f"Unknown plan in RATE_LIMIT_TENANT_PLANS for {_tenant}: {_plan}")
+
+SYNC_SECONDS = 1.0
+NEAR_EMPTY = 0.25       #share of the burst left when a check syncs before admitting
+WINDOW_SECONDS = 60     #counter items roll over (and expire) per window
+MAX_BUCKETS = 10000
+
+
+def tenant_for(email):
+    return (email or '').rsplit('@', 1)[-1].lower() or 'unknown'
+
+
+class DynamoRateStore:
+    #counter items: limit_key (key#window), used, expires_at (TTL)
+
+    def __init__(self, table_name):
+        self.table = boto3.resource("dynamodb").Table(table_name)
+
+    def add(self, key, window, count):
+        response = self.table.update_item(
+            Key={'limit_key': f"{key}#{window}"},
+            UpdateExpression='ADD used :count SET expires_at = if_not_exists(expires_at, :expires_at)',
+            ExpressionAttributeValues={':count': count, ':expires_at': (window + 2) * WINDOW_SECONDS},
+            ReturnValues='UPDATED_NEW'
+        )
+        return int(response['Attributes']['used'])
+
+
+class LocalRateStore:
+    #in-memory stand-in shared by simulated containers
+
+    def __init__(self):
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, window, count):
+        with self._lock:
+            total = self.counters.get((key, window), 0) + count
+            self.counters[(key, window)] = total
+            return total
+
+
+class _SyncedBucket:
+
+    def __init__(self, rate, capacity):
+        self.bucket = TokenBucket(rate, capacity)
+        self.pending = 0
+        self.window = None      #None until the first sync seeds the bucket
+        self.seen = 0           #counter value after our last sync in this window
+        self.synced_at = 0.0
+
+
+class RateLimiter:
+
+    def __init__(self, store=None, clock=time.time, flush_seconds=SYNC_SECONDS):
+        #flush_seconds=None leaves flushing to the caller (flush())
+        self.store = store
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.metrics = {'checks': 0, 'syncs': 0, 'limited': 0}
+        if store and flush_seconds:
+            threading.Thread(target=self._flush_loop, args=(flush_seconds,), daemon=True,
+                             name='rate-limit-flush').start()
+
+    def _flush_loop(self, seconds):
+        while True:
+            time.sleep(seconds)
+            self.flush()
+
+    def flush(self):
+        #reports what every bucket used since its last sync
+        with self._lock:
+            due = [(key, synced) for key, synced in self._buckets.items() if synced.pending]
+        for key, synced in due:
+            self._sync(key, synced)
+
+    def _bucket(self, key, per_minute, burst):
+        with self._lock:
+            synced = self._buckets.get(key)
+            if synced is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    self._buckets.clear() #forgotten buckets are seeded again from the shared counters
+                synced = self._buckets[key] = _SyncedBucket(per_minute / 60, burst)
+            return synced
+
+    def _sync(self, key, synced):
+        with self._lock:
+            count, synced.pending = synced.pending, 0
+            synced.synced_at = time.monotonic()
+        window = int(self.clock() // WINDOW_SECONDS)
+        try:
+            total = self.store.add(key, window, count)
+        except Exception:
+            with self._lock:
+                synced.pending += count #store unreachable - keep limiting locally, report later
+            return
+        with self._lock:
+            seeding = synced.window is None
+            if synced.window != window:
+                synced.window, synced.seen = window, 0
+            others = total - synced.seen - count
+            synced.seen = total
+        if seeding:
+            #usage earlier in the window has partly refilled since - take the bucket as full when it began
+            others -= (self.clock() - window * WINDOW_SECONDS) * synced.bucket.rate
+        self.metrics['syncs'] += 1
+        if others > 0:
+            synced.bucket.drain(others)
+
+    def _take(self, key, synced):
+        if (self.store and time.monotonic() - synced.synced_at >= SYNC_SECONDS
+                and (synced.window is None or synced.bucket.available() - 1 < synced.bucket.capacity * NEAR_EMPTY)):
+            #new here or about to run out - hear what the other containers used before admitting
+            self._sync(key, synced)
+        wait = synced.bucket.try_acquire()
+        if wait:
+            return wait
+        with self._lock:
+            synced.pending += 1
+        return 0.0
+
+    def check(self, user_id, tenant, plan=None):
+        #0 when the request may go ahead, otherwise the seconds until it could
+        self.metrics['checks'] += 1
+        limits = PLANS[plan or TENANT_PLANS.get(tenant, DEFAULT_PLAN)]
+        user_key, tenant_key = f"user#{user_id}", f"tenant#{tenant}"
+        user = self._bucket(user_key, limits['user_per_minute'], limits['user_burst'])
+        wait = self._take(user_key, user)
+        if not wait:
+            wait = self._take(tenant_key, self._bucket(tenant_key, limits['tenant_per_minute'], limits['tenant_burst']))
+            if wait:
+                #the tenant is out - give the user's token back
+                user.bucket.drain(-1)
+                with self._lock:
+                    user.pending -= 1
+        if wait:
+            self.metrics['limited'] += 1
+        return wait
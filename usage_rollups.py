@@ -0,0 +1,270 @@
+import argparse
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
+import boto3
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer
+import json_codec
+from checkpoints import load_checkpoint, save_checkpoint
+
+#Hourly and daily usage rollups (notes, characters, agent time, deletes) per
+#user and for the whole fleet, maintained from the notes table's change stream.
+#A batch of records is folded into one counter delta per (scope, bucket) and
+#applied as ADD updates inside a transaction together with a marker for the
+#records it covers, so a retried batch is never counted twice.
+#  INSERT  - counted in the hour/day the note was created
+#  REMOVE  - counted as 'deleted' when it happened; TTL expiry is retention, not usage, and is skipped
+#  MODIFY  - re-cleans and edits dont change usage and are skipped
+#
+#Usage (offline replay of captured stream records, JSON lines or {"Records": [...]}):
+#  python usage_rollups.py replay records.ndjson --local usage.json
+#  python usage_rollups.py show --user USER_ID --granularity day --local usage.json
+
+dynamodb = boto3.resource("dynamodb")
+usage_table = dynamodb.Table("medical-note-usage")
+
+GLOBAL_SCOPE = "global"
+APPLIED_SCOPE = "#applied"
+COUNTERS = ('notes', 'deleted', 'original_chars', 'cleaned_chars', 'agent_ms')
+MAX_UPDATES_PER_GROUP = 99      #TransactWriteItems takes 100 actions, one is the marker
+MARKER_TTL_SECONDS = 2 * 86400  #stream records live 24h, retries cant come later than that
+HOURLY_RETENTION_DAYS = int(os.environ.get("USAGE_HOURLY_RETENTION_DAYS", "90"))
+REPLAY_BATCH_SIZE = 100
+
+_deserializer = TypeDeserializer()
+
+
+def user_scope(user_id):
+    return f"user#{user_id}"
+
+
+def bucket_keys(timestamp):
+    #ISO timestamp -> (hour bucket, day bucket)
+    return f"hour#{timestamp[:13]}", f"day#{timestamp[:10]}"
+
+
+def _image(record, name):
+    image = record['dynamodb'].get(name) or {}
+    return {key: _deserializer.deserialize(value) for key, value in image.items()}
+
+
+def is_ttl_removal(record):
+    identity = record.get('userIdentity') or {}
+    return identity.get('type') == 'Service' and identity.get('principalId') == 'dynamodb.amazonaws.com'
+
+
+def record_deltas(record):
+    #[(scope, bucket, counters)] for one stream record, [] if it doesnt change usage
+    if record['eventName'] == 'INSERT':
+        note = _image(record, 'NewImage')
+        timestamp = note['created_at']
+        counters = {
+            'notes': 1,
+            'original_chars': int(note.get('original_length', 0)),
+            'cleaned_chars': int(note.get('cleaned_length', 0)),
+            'agent_ms': int(note.get('proccessing_time_ms', 0))
+        }
+    elif record['eventName'] == 'REMOVE' and not is_ttl_removal(record):
+        note = _image(record, 'OldImage')
+        changed_at = record['dynamodb'].get('ApproximateCreationDateTime', time.time())
+        timestamp = datetime.fromtimestamp(float(changed_at), timezone.utc).replace(tzinfo=None).isoformat()
+        counters = {'deleted': 1}
+    else:
+        return []
+
+    deltas = []
+    for scope in (user_scope(note['user_id']), GLOBAL_SCOPE):
+        for bucket in bucket_keys(timestamp):
+            deltas.append((scope, bucket, counters))
+    return deltas
+
+
+def group_records(records):
+    #consecutive records folded into groups of at most MAX_UPDATES_PER_GROUP counter
+    #updates. Grouping is deterministic, so a retried batch produces the same group ids
+    groups = []
+    totals, event_ids = {}, []
+    for record in records:
+        deltas = record_deltas(record)
+        new_keys = {(scope, bucket) for scope, bucket, _ in deltas} - totals.keys()
+        if len(totals) + len(new_keys) > MAX_UPDATES_PER_GROUP:
+            groups.append((_group_id(event_ids), totals))
+            totals, event_ids = {}, []
+        event_ids.append(record['eventID'])
+        for scope, bucket, counters in deltas:
+            total = totals.setdefault((scope, bucket), dict.fromkeys(COUNTERS, 0))
+            for name, value in counters.items():
+                total[name] += value
+    if event_ids:
+        groups.append((_group_id(event_ids), totals))
+    return groups
+
+
+def _group_id(event_ids):
+    return hashlib.sha1('\n'.join(event_ids).encode('utf-8')).hexdigest()
+
+
+def hourly_expires_at(bucket):
+    #hourly buckets are kept HOURLY_RETENTION_DAYS after the hour, daily ones forever
+    if not bucket.startswith('hour#'):
+        return None
+    hour = datetime.strptime(bucket[5:], '%Y-%m-%dT%H').replace(tzinfo=timezone.utc)
+    return int(hour.timestamp()) + HOURLY_RETENTION_DAYS * 86400
+
+
+class DynamoUsageStore:
+
+    def __init__(self, table=None):
+        self.table = table or usage_table
+
+    def apply(self, group_id, totals):
+        #returns False if this group was already applied by an earlier delivery
+        actions = [{'Put': {
+            'TableName': self.table.name,
+            'Item': {'scope': APPLIED_SCOPE, 'bucket': group_id, 'expires_at': int(time.time()) + MARKER_TTL_SECONDS},
+            'ConditionExpression': 'attribute_not_exists(#scope)',
+            'ExpressionAttributeNames': {'#scope': 'scope'}
+        }}]
+        for (scope, bucket), counters in sorted(totals.items()):
+            names, values, adds = {}, {}, []
+            for i, (name, value) in enumerate(counters.items()):
+                if value:
+                    names[f"#c{i}"], values[f":c{i}"] = name, value
+                    adds.append(f"#c{i} :c{i}")
+            if not adds:
+                continue
+            expression = 'ADD ' + ', '.join(adds)
+            expires_at = hourly_expires_at(bucket)
+            if expires_at:
+                expression += ' SET expires_at = if_not_exists(expires_at, :expires_at)'
+                values[':expires_at'] = expires_at
+            actions.append({'Update': {
+                'TableName': self.table.name,
+                'Key': {'scope': scope, 'bucket': bucket},
+                'UpdateExpression': expression,
+                'ExpressionAttributeNames': names,
+                'ExpressionAttributeValues': values
+            }})
+
+        client = dynamodb.meta.client
+        try:
+            client.transact_write_items(TransactItems=actions)
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons', [])
+            if reasons and reasons[0].get('Code') == 'ConditionalCheckFailed':
+                return False
+            raise
+        return True
+
+    def query(self, scope, granularity, start, end):
+        items = []
+        kwargs = {'KeyConditionExpression': Key('scope').eq(scope) &
+                  Key('bucket').between(f"{granularity}#{start}", f"{granularity}#{end}")}
+        while True:
+            response = self.table.query(**kwargs)
+            items.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return items
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+class LocalUsageStore:
+    #JSON file stand-in for the usage table, for offline replays
+
+    def __init__(self, path):
+        self.path = path
+        self.state = load_checkpoint(path) or {'applied': [], 'rollups': {}}
+
+    def apply(self, group_id, totals):
+        if group_id in self.state['applied']:
+            return False
+        for (scope, bucket), counters in totals.items():
+            rollup = self.state['rollups'].setdefault(f"{scope}|{bucket}", {'scope': scope, 'bucket': bucket})
+            for name, value in counters.items():
+                if value:
+                    rollup[name] = rollup.get(name, 0) + value
+        self.state['applied'].append(group_id)
+        save_checkpoint(self.path, self.state)
+        return True
+
+    def query(self, scope, granularity, start, end):
+        low, high = f"{granularity}#{start}", f"{granularity}#{end}"
+        return sorted((rollup for rollup in self.state['rollups'].values()
+                       if rollup['scope'] == scope and low <= rollup['bucket'] <= high),
+                      key=lambda rollup: rollup['bucket'])
+
+
+def process_records(records, store=None):
+    #returns (groups applied, groups skipped as duplicates)
+    store = store or DynamoUsageStore()
+    applied = skipped = 0
+    for group_id, totals in group_records(records):
+        if store.apply(group_id, totals):
+            applied += 1
+        else:
+            skipped += 1
+    return applied, skipped
+
+
+def usage_stream_handler(event, context):
+    #DynamoDB stream consumer; an exception retries the whole batch, already applied groups are skipped
+    applied, skipped = process_records(event.get('Records', []))
+    return {'applied': applied, 'skipped': skipped}
+
+
+def get_usage(user_id=None, granularity='day', start='0000', end='9999', store=None):
+    #rollups for one user (or the whole fleet) between two ISO prefixes, oldest first
+    store = store or DynamoUsageStore()
+    scope = user_scope(user_id) if user_id else GLOBAL_SCOPE
+    rollups = store.query(scope, granularity, start, end)
+    return [dict({name: int(rollup.get(name, 0)) for name in COUNTERS}, period=rollup['bucket'].split('#', 1)[1])
+            for rollup in rollups]
+
+
+def read_records(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        document = json_codec.loads(data)
+    except json_codec.DecodeError:
+        return [json_codec.loads(line) for line in data.splitlines() if line.strip()]
+    if isinstance(document, dict):
+        return document['Records'] if 'Records' in document else [document]
+    return document
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Usage rollups from the notes change stream")
+    commands = parser.add_subparsers(dest='command', required=True)
+    replay = commands.add_parser('replay', help="feed captured stream records through the consumer")
+    replay.add_argument('path')
+    replay.add_argument('--batch-size', type=int, default=REPLAY_BATCH_SIZE, help="records per simulated stream batch")
+    replay.add_argument('--local', help="JSON file to use instead of the medical-note-usage table")
+    show = commands.add_parser('show', help="print rollups")
+    show.add_argument('--user', help="user id (default: fleet-wide)")
+    show.add_argument('--granularity', choices=['hour', 'day'], default='day')
+    show.add_argument('--start', default='0000')
+    show.add_argument('--end', default='9999')
+    show.add_argument('--local', help="JSON file written by replay --local")
+    args = parser.parse_args()
+
+    store = LocalUsageStore(args.local) if args.local else DynamoUsageStore()
+    if args.command == 'replay':
+        records = read_records(args.path)
+        applied = skipped = 0
+        for start in range(0, len(records), args.batch_size):
+            done, duplicates = process_records(records[start:start + args.batch_size], store)
+            applied += done
+            skipped += duplicates
+        print(f"Replayed {len(records)} records: {applied} groups applied, {skipped} already applied")
+        return
+
+    for rollup in get_usage(args.user, args.granularity, args.start, args.end, store):
+        print(f"{rollup['period']}: notes {rollup['notes']} deleted {rollup['deleted']} "
+              f"chars {rollup['original_chars']}/{rollup['cleaned_chars']} agent {rollup['agent_ms'] / 1000:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
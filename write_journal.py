@@ -0,0 +1,183 @@
+import argparse
+import fcntl
+import os
+import threading
+import time
+from types import SimpleNamespace
+import json_codec
+from deadline import Deadline
+
+#Write-ahead journal for note saves that failed. process_note appends the
+#note (with the note_id it was going to be saved under, and when) as one
+#NDJSON line, fsynced, instead of losing it. Later invocations replay up to
+#REPLAY_BATCH entries before handling their own request - only when the
+#journal is non-empty, so the happy path costs one stat() - and drop what
+#was written. Replays reuse the journaled note_id and created_at - the key the
+#failed save used - and save the note only if it is not there yet (a save that
+#reached DynamoDB after all, or a note the user has deleted since, counts as
+#done); the late save goes to the change log so delta sync picks the note up.
+#Lambda keeps the journal in /tmp (lost if the container is recycled);
+#containers should point WRITE_JOURNAL_PATH at a persistent volume.
+#
+#Usage:
+#  python write_journal.py status [--path PATH]
+#  python write_journal.py drain [--path PATH]
+
+JOURNAL_PATH = os.environ.get("WRITE_JOURNAL_PATH", "/tmp/note-write-journal.ndjson")
+REPLAY_BATCH = 10
+REPLAY_SECONDS = 1.0
+RETRY_SECONDS = 30      #after a failed replay, leave the store alone this long
+
+FIELDS = ('note_id', 'created_at', 'user_id', 'original_note', 'cleaned_note', 'agent_version',
+          'processing_time_ms', 'request_id', 'status')
+
+_lock = threading.Lock()
+_retry_after = 0.0
+
+
+class _Locked:
+    #the journal file, locked against other threads and processes
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+
+    def __enter__(self):
+        _lock.acquire()
+        try:
+            flags = os.O_RDWR | os.O_CREAT | (os.O_APPEND if self.mode == 'a' else 0)
+            self.file = open(os.open(self.path, flags, 0o600), self.mode)
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        except Exception:
+            _lock.release()
+            raise
+        return self.file
+
+    def __exit__(self, *exc):
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+        finally:
+            _lock.release()
+
+
+def record(entry, path=None):
+    #True once the entry is durably in the journal
+    path = path or JOURNAL_PATH
+    line = json_codec.dumps({field: entry.get(field) for field in FIELDS}) + "\n"
+    try:
+        with _Locked(path, 'a') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        return True
+    except Exception as e:
+        print(f"Failed to journal note {entry.get('note_id')}: {str(e)}")
+        return False
+
+
+def _read(f):
+    f.seek(0)
+    entries = {}
+    for line in f:
+        try:
+            entry = json_codec.loads(line)
+        except json_codec.DecodeError:
+            continue #torn last line from a crash mid-append
+        entries[entry['note_id']] = entry #dedup - a note journaled twice is saved once
+    return list(entries.values())
+
+
+def _rewrite(f, entries):
+    f.seek(0)
+    f.truncate()
+    f.writelines(json_codec.dumps(entry) + "\n" for entry in entries)
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def pending(path=None):
+    path = path or JOURNAL_PATH
+    try:
+        return os.path.getsize(path) > 0
+    except OSError:
+        return False
+
+
+def save_entry(entry, deadline=None):
+    from db_client import save_to_dynamo
+    return save_to_dynamo(
+        user_id=entry['user_id'],
+        original_note=entry['original_note'],
+        cleaned_note=entry['cleaned_note'],
+        context=SimpleNamespace(aws_request_id=entry.get('request_id')),
+        agent_version=entry.get('agent_version'),
+        processing_time_ms=entry.get('processing_time_ms') or 0,
+        deadline=deadline,
+        note_id=entry['note_id'],
+        created_at=entry.get('created_at'),
+        status=entry.get('status') or 'completed',
+        once=True
+    )
+
+
+def replay(save=None, path=None, batch=REPLAY_BATCH, deadline=None):
+    #saves up to `batch` journaled notes, stopping at the first failure; returns (saved, left)
+    save = save or save_entry
+    path = path or JOURNAL_PATH
+    with _Locked(path, 'r+') as f:
+        entries = _read(f)
+        saved = 0
+        for entry in entries[:batch]:
+            if deadline and deadline.expired():
+                break
+            try:
+                save(entry, deadline)
+            except Exception as e:
+                print(f"Journal replay failed for note {entry['note_id']}: {str(e)}")
+                break
+            saved += 1
+        _rewrite(f, entries[saved:])
+    return saved, len(entries) - saved
+
+
+def replay_pending(deadline=None, path=None):
+    #called at the start of an invocation; a no-op unless the journal has entries
+    global _retry_after
+    if not pending(path) or time.monotonic() < _retry_after:
+        return 0
+    budget = Deadline(min(REPLAY_SECONDS, deadline.remaining() if deadline else REPLAY_SECONDS))
+    try:
+        saved, left = replay(path=path, deadline=budget)
+    except Exception as e:
+        print(f"Journal replay failed: {str(e)}")
+        saved, left = 0, 1
+    if left and not saved:
+        _retry_after = time.monotonic() + RETRY_SECONDS
+    return saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or drain the note write journal")
+    parser.add_argument('command', choices=('status', 'drain'))
+    parser.add_argument('--path', default=JOURNAL_PATH)
+    args = parser.parse_args()
+
+    if not pending(args.path):
+        print("Journal is empty")
+        return
+    if args.command == 'status':
+        with _Locked(args.path, 'r+') as f:
+            print(f"{len(_read(f))} notes waiting to be saved")
+        return
+    total = 0
+    while pending(args.path):
+        saved, left = replay(path=args.path, batch=100)
+        total += saved
+        print(f"Saved {total}, {left} left")
+        if not saved:
+            raise SystemExit("Save failed, stopping - run again later")
+
+
+if __name__ == "__main__":
+    main()